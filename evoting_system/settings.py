@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'voting.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +84,32 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Results pages cache tallies and rendered fragments in the RESULTS_CACHE_ALIAS
+# backend. Point RESULTS_CACHE_BACKEND at FileBasedCache, Redis or Memcached
+# to share entries across worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': os.environ.get('RESULTS_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RESULTS_CACHE_LOCATION', 'election-results'),
+        'TIMEOUT': 3600,
+    },
+}
+
+RESULTS_CACHE_ALIAS = 'results'
+RESULTS_CACHE_TIMEOUT = 3600
+
+# Where results pages read tallies from: 'database' (grouped query over
+# Vote, shared by every worker) or 'chain' (this process's tally index).
+RESULTS_TALLY_SOURCE = 'database'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -129,3 +157,107 @@ LOGIN_REDIRECT_URL = 'home'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Tests run against a temporary BLOCKCHAIN_STORAGE_DIR, never the one below
+
+TEST_RUNNER = 'evoting_system.test_runner.TemporaryChainRunner'
+
+
+# Blockchain storage
+# Blocks are kept in an append-only log under this directory so the chain
+# survives restarts. Set to None to keep the chain in process memory only.
+# It is opened on first use, and only one process may hold it open for
+# writing; run several workers through BLOCKCHAIN_WRITER_ADDRESS below.
+# Ballot blocks are written as fixed-width binary records; add
+# 'compression': 'zlib' (or 'zstd', with the zstandard package) to the
+# options to compress them too, or 'codec': 'json' to write JSON records.
+
+BLOCKCHAIN_STORAGE_DIR = BASE_DIR / 'chaindata'
+BLOCKCHAIN_STORAGE_OPTIONS = {
+    'sync_every': 64,
+    'sync_interval': 0.05,
+}
+
+# With no storage directory, keep blocks as packed columns (about a tenth
+# of the memory of Block objects) rather than as a list of objects.
+
+BLOCKCHAIN_COMPACT_MEMORY = False
+
+# Every BLOCKCHAIN_SNAPSHOT_INTERVAL blocks, save the tally and voter
+# indexes under BLOCKCHAIN_STORAGE_DIR/snapshots; start-up then replays only
+# the blocks after the newest snapshot. 0 or None turns snapshots off.
+
+BLOCKCHAIN_SNAPSHOT_INTERVAL = 10000
+
+# Votes are sealed into one block per BLOCKCHAIN_BATCH_SIZE ballots, or
+# after BLOCKCHAIN_BATCH_MAX_WAIT_MS, whichever comes first. A batch size
+# of 1 seals every vote into its own block.
+
+BLOCKCHAIN_BATCH_SIZE = 1
+BLOCKCHAIN_BATCH_MAX_WAIT_MS = 200
+
+# Run several worker processes against one chain: set this to a Unix socket
+# path or a (host, port) pair, start `manage.py chain_writer`, and workers
+# will open BLOCKCHAIN_STORAGE_DIR read-only and send ballots to the writer.
+# None keeps the chain private to each process.
+
+BLOCKCHAIN_WRITER_ADDRESS = None
+
+# Give every election its own chain, under BLOCKCHAIN_STORAGE_DIR/shards, with
+# its own tip, indexes and writer, so concurrent elections do not contend for
+# one tip. The existing chain keeps earlier ballots and, every
+# BLOCKCHAIN_ANCHOR_INTERVAL seconds, records the tip hash of every shard
+# that has grown; None disables anchoring. Shards use the same sealer
+# settings, BLOCKCHAIN_AUTHORITY_SINCE included.
+
+BLOCKCHAIN_SHARDED = False
+BLOCKCHAIN_ANCHOR_INTERVAL = 60
+
+# How blocks are sealed: 'pow' mines at BLOCKCHAIN_DIFFICULTY leading zero
+# hex digits; 'adaptive-pow' retunes the difficulty towards
+# BLOCKCHAIN_TARGET_BLOCK_SECONDS; 'hmac' and 'ed25519' skip mining and have
+# this deployment, as the single authority, sign every block. HMAC uses
+# BLOCKCHAIN_SEAL_KEY (SECRET_KEY when None); Ed25519 uses the hex raw keys
+# BLOCKCHAIN_SIGNING_KEY and BLOCKCHAIN_VERIFY_KEY (needs `cryptography`).
+# Each block records the difficulty it was mined at and is verified against
+# it, so raising BLOCKCHAIN_DIFFICULTY leaves earlier blocks valid; no block
+# verifies below BLOCKCHAIN_MIN_DIFFICULTY, which is also the adaptive floor.
+# To switch an existing chain to an authority, set BLOCKCHAIN_AUTHORITY_SINCE
+# to its current length; blocks below it stay checked as proof of work.
+
+BLOCKCHAIN_CONSENSUS = 'pow'
+BLOCKCHAIN_DIFFICULTY = 2
+BLOCKCHAIN_MIN_DIFFICULTY = 2
+BLOCKCHAIN_TARGET_BLOCK_SECONDS = 1.0
+BLOCKCHAIN_SEAL_KEY = None
+BLOCKCHAIN_SIGNING_KEY = None
+BLOCKCHAIN_VERIFY_KEY = None
+BLOCKCHAIN_AUTHORITY_SINCE = 1
+
+# Number of processes searching proof-of-work nonces. 1 mines in the
+# request thread; None uses every CPU core.
+
+BLOCKCHAIN_MINER_WORKERS = 1
+
+# Serve the vote, results and explorer pages with async views. Enable when
+# running evoting_system.asgi under an ASGI server such as uvicorn; this also
+# mounts the live results stream, which WSGI workers cannot hold open.
+
+VOTING_ASYNC_VIEWS = False
+
+# Broker fanning live results out to Server-Sent Events subscribers. The
+# default delivers within this process; any class implementing
+# voting.events.Broker can be swapped in.
+
+VOTING_EVENT_BROKER = 'voting.events.InProcessBroker'
+
+# Count and time blocks, proof of work, validation, tallies and requests,
+# exported at /metrics in the Prometheus text format. False removes the
+# instrumentation and the endpoint entirely.
+
+VOTING_METRICS = True
+
+# Client addresses that may scrape /metrics without signing in; staff
+# accounts can always read it. Put the Prometheus server's address here.
+
+VOTING_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
@@ -0,0 +1,24 @@
+"""
+Test runner that keeps the test suite away from the project's chain data
+"""
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TemporaryChainRunner(DiscoverRunner):
+    """Runs the tests with BLOCKCHAIN_STORAGE_DIR pointing at a throwaway directory"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._storage_dir = tempfile.mkdtemp(prefix='chaindata-test-')
+        settings.BLOCKCHAIN_STORAGE_DIR = self._storage_dir
+
+    def teardown_test_environment(self, **kwargs):
+        from voting.blockchain import blockchain, vote_batcher
+        vote_batcher.close()
+        blockchain.close()
+        shutil.rmtree(self._storage_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
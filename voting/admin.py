@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Election, Candidate, Voter, Vote
+from .models import Election, Candidate, CandidateTally, Voter, Vote
 
 
 @admin.register(Election)
@@ -15,6 +15,8 @@ class CandidateAdmin(admin.ModelAdmin):
     list_display = ['name', 'election', 'get_vote_count']
     list_filter = ['election']
     search_fields = ['name', 'description']
+    # Vote counts come from the one-to-one tally row, fetched in the same query
+    list_select_related = ['election', 'tally']
 
 
 @admin.register(Voter)
@@ -39,3 +41,14 @@ class VoteAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         # Prevent vote modification
         return False
+
+
+@admin.register(CandidateTally)
+class CandidateTallyAdmin(admin.ModelAdmin):
+    list_display = ['candidate', 'election', 'votes']
+    list_filter = ['election']
+    readonly_fields = ['candidate', 'election', 'votes']
+    
+    def has_add_permission(self, request):
+        # Tallies are maintained by vote submission and rebuild_tallies
+        return False
@@ -0,0 +1,251 @@
+"""
+Tallies, turnout and votes over time computed over vote columns
+
+Every query runs over a snapshot of the chain's votes held as columns
+(see columns.VoteColumns), with NumPy when it is installed and plain
+Python otherwise. A snapshot is taken once per chain length and sorted
+by cast time once, so time-range filters are two binary searches rather
+than a rescan of the chain.
+"""
+import math
+import threading
+import weakref
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .columns import EPOCH, MISSING, VoteColumns, numpy
+
+Tally = Dict[int, int]
+
+
+def _micros(moment: Optional[datetime]) -> Optional[int]:
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+class _Snapshot:
+    """The columns as of one chain length, with a cast-time ordering"""
+
+    def __init__(self, columns: VoteColumns):
+        if numpy is not None:
+            arrays = columns.as_numpy()
+            cast_at = arrays['cast_at']
+            # Ballots arrive in time order, so this is usually the identity
+            if bool(numpy.all(cast_at[1:] >= cast_at[:-1])):
+                self.arrays = arrays
+            else:
+                order = numpy.argsort(cast_at, kind='stable')
+                self.arrays = {field: values[order] for field, values in arrays.items()}
+        else:
+            rows = len(columns.cast_at)
+            arrays = {field: list(values[:rows]) for field, values in columns.arrays().items()}
+            order = sorted(range(rows), key=arrays['cast_at'].__getitem__)
+            self.arrays = {field: [values[i] for i in order] for field, values in arrays.items()}
+        self.rows = len(self.arrays['cast_at'])
+
+    def window(self, start: Optional[int], end: Optional[int]) -> Dict[str, Any]:
+        """Columns for votes cast in [start, end), as slices of the sorted arrays"""
+        cast_at = self.arrays['cast_at']
+        if numpy is not None:
+            low = 0 if start is None else int(numpy.searchsorted(cast_at, start, side='left'))
+            high = self.rows if end is None else int(numpy.searchsorted(cast_at, end, side='left'))
+        else:
+            low = 0 if start is None else bisect_left(cast_at, start)
+            high = self.rows if end is None else bisect_left(cast_at, end)
+        return {field: values[low:max(low, high)] for field, values in self.arrays.items()}
+
+
+class VoteAnalytics:
+    """
+    Analytics over one chain's votes.
+
+    Reuses the store's columns when the chain is kept in a
+    CompactBlockStore; otherwise the votes are collected into columns once
+    and kept current by a chain listener. The first collection runs
+    without the chain's append lock, so votes keep being sealed while a
+    long chain is read; blocks are added by index, so any appended
+    meanwhile are picked up once and only once.
+    """
+
+    def __init__(self, chain):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        columns = getattr(chain.chain, 'votes', None)
+        if isinstance(columns, VoteColumns):
+            self.columns = columns
+            return
+        # Weakly, so analytics_for's entry can go once nothing else uses the chain
+        self._chain = weakref.proxy(chain)
+        self._append_lock = threading.Lock()
+        height = len(chain.chain)
+        self.columns = VoteColumns.from_blocks(chain.iter_blocks(0, height))
+        self._height = height - 1  # index of the last block collected
+        chain.add_listener(_block_listener(self, chain))
+        # Blocks announced before the listener was added
+        self._catch_up(len(chain.chain))
+
+    def _catch_up(self, stop: int):
+        """Collect the blocks below ``stop`` that have not been collected yet"""
+        from .blockchain import iter_votes
+        with self._append_lock:
+            for block in self._chain.iter_blocks(self._height + 1, stop):
+                for vote in iter_votes(block):
+                    self.columns.append(vote)
+                self._height = block.index
+
+    def _add_block(self, block):
+        self._catch_up(block.index + 1)
+
+    def snapshot(self) -> _Snapshot:
+        """The current snapshot, rebuilt only when votes have been added"""
+        with self._lock:
+            if self._snapshot is None or self._snapshot.rows != len(self.columns.cast_at):
+                self._snapshot = _Snapshot(self.columns)
+            return self._snapshot
+
+    def _window(self, start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+        return self.snapshot().window(_micros(start), _micros(end))
+
+    def tallies(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[int, Tally]:
+        """Every election's candidate tallies in one pass, optionally for votes cast in [start, end)"""
+        votes = self._window(start, end)
+        result: Dict[int, Tally] = {}
+        if numpy is not None:
+            pairs = numpy.stack([votes['election_id'], votes['candidate_id']], axis=1)
+            if len(pairs):
+                keys, counts = numpy.unique(pairs, axis=0, return_counts=True)
+                for (election_id, candidate_id), count in zip(keys.tolist(), counts.tolist()):
+                    result.setdefault(election_id, {})[candidate_id] = count
+        else:
+            for (election_id, candidate_id), count in Counter(
+                    zip(votes['election_id'], votes['candidate_id'])).items():
+                result.setdefault(election_id, {})[candidate_id] = count
+        result.pop(MISSING, None)
+        return result
+
+    def tally(self, election_id: int, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> Tally:
+        """One election's candidate tally, optionally for votes cast in [start, end)"""
+        votes = self._window(start, end)
+        if numpy is not None:
+            candidates = votes['candidate_id'][votes['election_id'] == election_id]
+            keys, counts = numpy.unique(candidates, return_counts=True)
+            return dict(zip(keys.tolist(), counts.tolist()))
+        return dict(Counter(candidate_id for candidate_id, vote_election
+                            in zip(votes['candidate_id'], votes['election_id'])
+                            if vote_election == election_id))
+
+    def votes_over_time(self, election_id: int, bucket: timedelta, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None) -> List[Tuple[datetime, int]]:
+        """
+        Votes cast per bucket of time, as (bucket start, count) pairs.
+
+        Buckets are aligned to start, or to the first vote when start is
+        not given, and run to the bucket holding end or the last vote;
+        empty buckets are included.
+        """
+        votes = self._window(start, end)
+        width = bucket // timedelta(microseconds=1)
+        if numpy is not None:
+            cast_at = votes['cast_at'][(votes['election_id'] == election_id) & (votes['cast_at'] != MISSING)]
+        else:
+            cast_at = [moment for moment, vote_election in zip(votes['cast_at'], votes['election_id'])
+                       if vote_election == election_id and moment != MISSING]
+        if not len(cast_at):
+            return []
+
+        origin = _micros(start) if start is not None else int(cast_at[0]) // width * width
+        last = _micros(end) - 1 if end is not None else int(cast_at[-1])
+        buckets = (last - origin) // width + 1
+        if numpy is not None:
+            counts = numpy.bincount((cast_at - origin) // width, minlength=buckets).tolist()
+        else:
+            counts = [0] * buckets
+            for moment in cast_at:
+                counts[(moment - origin) // width] += 1
+        return [(EPOCH + timedelta(microseconds=origin + number * width), count)
+                for number, count in enumerate(counts)]
+
+    def turnout(self, election_id: int, eligible: int, start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> Dict[str, Any]:
+        """Distinct voters in an election against the number eligible"""
+        votes = self._window(start, end)
+        if numpy is not None:
+            voters = int(numpy.unique(votes['voter_id'][votes['election_id'] == election_id]).size)
+        else:
+            voters = len({voter_id for voter_id, vote_election in zip(votes['voter_id'], votes['election_id'])
+                          if vote_election == election_id})
+        return {
+            'voters': voters,
+            'eligible': eligible,
+            'turnout': voters / eligible * 100 if eligible else 0.0,
+        }
+
+
+def _block_listener(analytics: VoteAnalytics, chain) -> Callable:
+    """A chain listener feeding the analytics without keeping them alive; it removes itself after them"""
+    add_block = weakref.WeakMethod(analytics._add_block)
+    chain = weakref.ref(chain)
+
+    def listener(block):
+        method, owner = add_block(), chain()
+        if method is not None:
+            method(block)
+        elif owner is not None:
+            owner.remove_listener(listener)
+    return listener
+
+
+_analytics: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+_analytics_lock = threading.Lock()
+
+
+def analytics_for(chain=None) -> VoteAnalytics:
+    """The analytics for a chain (the global one by default), created on first use"""
+    from . import blockchain as chain_module
+    chain = chain if chain is not None else chain_module.blockchain
+    if isinstance(chain, chain_module.Deferred):
+        # Keyed on the chain itself, so a substituted chain gets its own analytics
+        chain = chain.open()
+    with _analytics_lock:
+        analytics = _analytics.get(chain)
+        if analytics is None:
+            analytics = _analytics[chain] = VoteAnalytics(chain)
+        return analytics
+
+
+def timeline_bucket(election, buckets: int = 24) -> timedelta:
+    """A whole-minute bucket width splitting an election's voting period into at most this many"""
+    minutes = (election.end_date - election.start_date) / timedelta(minutes=1)
+    return timedelta(minutes=max(math.ceil(minutes / buckets), 1))
+
+
+def election_activity(election, chain=None) -> Dict[str, Any]:
+    """Votes over the voting period and turnout, for the results page"""
+    from . import blockchain as chain_module
+    from .models import Voter
+    chain = chain if chain is not None else chain_module.blockchain
+    # A sharded ledger keeps ballots cast before sharding on its base chain
+    chains = chain.chains_for(election.id) if hasattr(chain, 'chains_for') else [chain]
+    bucket = timeline_bucket(election)
+    counts: Dict[datetime, int] = Counter()
+    voters = 0
+    for part in chains:
+        analytics = analytics_for(part)
+        counts.update(dict(analytics.votes_over_time(election.id, bucket,
+                                                     election.start_date, election.end_date)))
+        voters += analytics.turnout(election.id, 0)['voters']
+    timeline = sorted(counts.items())
+    peak = max(counts.values(), default=0)
+    eligible = Voter.objects.count()
+    return {
+        'timeline': [{'start': moment, 'votes': count, 'height': count / peak * 100 if peak else 0}
+                     for moment, count in timeline],
+        'turnout': {'voters': voters, 'eligible': eligible,
+                    'turnout': voters / eligible * 100 if eligible else 0.0},
+    }
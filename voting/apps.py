@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class VotingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'voting'
+
+    def ready(self):
+        # Results cache entries are dropped and live results pushed as soon as a vote block lands
+        from . import cache, events
+        cache.install()
+        events.install()
+
+        # Queries are counted on the connection of whichever thread runs them
+        from . import metrics, middleware
+        if metrics.ENABLED:
+            middleware.install()
+
+        # Workers sharing a writer process's chain pick up new blocks before each request
+        from django.conf import settings
+        if getattr(settings, 'BLOCKCHAIN_WRITER_ADDRESS', None) is not None:
+            from django.core.signals import request_started
+            request_started.connect(_refresh_chain, dispatch_uid='voting-refresh-chain')
+
+
+def _refresh_chain(**kwargs):
+    from .blockchain import blockchain
+    blockchain.refresh()
@@ -0,0 +1,201 @@
+"""
+Async versions of the vote, results and explorer views for ASGI deployments
+
+Enable them with VOTING_ASYNC_VIEWS = True and serve evoting_system.asgi
+with an ASGI server such as uvicorn. Database reads use the async ORM;
+sessions, messages, template rendering and transactions are synchronous in
+Django, so they run through sync_to_async. Proof of work happens on the
+vote batcher's writer thread and chain validation in a worker thread, so
+no request holds the event loop or a thread while a block is mined.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .batching import DuplicateVoteError
+from .blockchain import blockchain
+from .cache import get_activity, get_results, results_etag, results_last_modified, results_version
+from .events import election_channel, get_broker, poll_chain, tally_message
+from .models import Election, Candidate, Voter, Vote
+from .pipeline import arecord_vote
+from .views import block_page, selected_chain
+from .writer import WriterUnavailableError
+
+_render = sync_to_async(render)
+_add_message = sync_to_async(messages.add_message)
+
+
+async def _aget_or_404(model, **kwargs):
+    try:
+        return await model.objects.aget(**kwargs)
+    except model.DoesNotExist:
+        raise Http404(f'No {model._meta.object_name} matches the given query.')
+
+
+async def _authenticated_user(request):
+    """Resolve the session user off the event loop; None when anonymous"""
+    return await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+
+async def vote(request, election_id):
+    """Cast a vote"""
+    user = await _authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    election = await _aget_or_404(Election, id=election_id)
+
+    # Check if election is ongoing
+    if not election.is_ongoing():
+        await _add_message(request, messages.ERROR, 'This election is not currently active.')
+        return redirect('election_detail', election_id=election_id)
+
+    try:
+        voter = await Voter.objects.aget(user=user)
+    except Voter.DoesNotExist:
+        await _add_message(request, messages.ERROR, 'You are not registered as a voter.')
+        return redirect('election_detail', election_id=election_id)
+
+    # Check if already voted
+    # The first lookup may open the chain from disk; keep that off the event loop
+    if (await sync_to_async(voter.has_voted_in_blockchain, thread_sensitive=False)(election)
+            or await Vote.objects.filter(voter=voter, election=election).aexists()):
+        await _add_message(request, messages.ERROR, 'You have already voted in this election.')
+        return redirect('election_detail', election_id=election_id)
+
+    if request.method == 'POST':
+        candidate_id = request.POST.get('candidate_id')
+        if not candidate_id:
+            await _add_message(request, messages.ERROR, 'Please select a candidate.')
+            return redirect('vote', election_id=election_id)
+
+        candidate = await _aget_or_404(Candidate, id=candidate_id, election=election)
+
+        # Await the sealed block without blocking the event loop
+        try:
+            vote_record = await arecord_vote(voter, candidate, election)
+        except DuplicateVoteError:
+            await _add_message(request, messages.ERROR, 'You have already voted in this election.')
+            return redirect('election_detail', election_id=election_id)
+        except WriterUnavailableError:
+            await _add_message(request, messages.ERROR,
+                               'Your vote could not be recorded right now. Please try again in a moment.')
+            return redirect('vote', election_id=election_id)
+
+        await _add_message(request, messages.SUCCESS,
+                           f'Your vote for {candidate.name} has been recorded successfully!')
+        return redirect('vote_confirmation', vote_id=vote_record.id)
+
+    candidates = [candidate async for candidate in election.candidates.all()]
+    context = {
+        'election': election,
+        'candidates': candidates,
+    }
+    return await _render(request, 'voting/vote.html', context)
+
+
+async def results(request, election_id):
+    """Show election results"""
+    etag, last_modified = await sync_to_async(
+        lambda: (results_etag(request, election_id), results_last_modified(request, election_id)))()
+    etag = quote_etag(etag) if etag else None
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    election = await _aget_or_404(Election, id=election_id)
+    # The version was already read for the ETag and is reused for every entry
+    version = await sync_to_async(results_version)(election.id, request)
+    results_data, total_votes = await sync_to_async(get_results)(election, version)
+    activity = await sync_to_async(get_activity)(election, blockchain, version)
+
+    context = {
+        'election': election,
+        'results': results_data,
+        'total_votes': total_votes,
+        'results_version': version,
+        'cache_alias': getattr(settings, 'RESULTS_CACHE_ALIAS', 'default'),
+        'cache_timeout': getattr(settings, 'RESULTS_CACHE_TIMEOUT', None),
+        'activity': activity,
+        # The stream is only mounted for ASGI deployments (see urls.py)
+        'live_results': getattr(settings, 'VOTING_ASYNC_VIEWS', False),
+    }
+    response = await _render(request, 'voting/results.html', context)
+    if etag:
+        response.headers.setdefault('ETag', etag)
+    if last_modified:
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return response
+
+
+async def blockchain_view(request):
+    """View one page of the blockchain, or of one election's shard with ?election="""
+    # Opening a shard and reading blocks may touch disk and validation hashes blocks; keep all off the loop
+    shard, chain = await sync_to_async(selected_chain, thread_sensitive=False)(request)
+    blocks, next_cursor, previous_cursor, chain_length = await sync_to_async(
+        block_page, thread_sensitive=False)(chain, request)
+    is_valid = await sync_to_async(chain.is_chain_valid, thread_sensitive=False)()
+
+    context = {
+        'shard': shard,
+        'chain': blocks,
+        'is_valid': is_valid,
+        'chain_length': chain_length,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+    }
+    return await _render(request, 'voting/blockchain.html', context)
+
+
+SSE_KEEPALIVE_SECONDS = 15
+# How often streams check the chain writer's shared store for new blocks
+SSE_POLL_SECONDS = 1
+
+
+def _sse_event(event: str, data) -> str:
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def results_stream(request, election_id):
+    """Stream an election's tally as Server-Sent Events"""
+    election = await _aget_or_404(Election, id=election_id)
+    broker = get_broker()
+
+    async def events():
+        subscription = broker.subscribe(election_channel(election.id))
+        try:
+            # Start from a full snapshot; every later event carries the tally too
+            yield _sse_event('tally', tally_message(blockchain, election.id))
+            # Blocks sealed by a writer process reach this one's listeners only when its view refreshes
+            polling = getattr(settings, 'BLOCKCHAIN_WRITER_ADDRESS', None) is not None
+            timeout = SSE_POLL_SECONDS if polling else SSE_KEEPALIVE_SECONDS
+            idle = 0
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), timeout)
+                except asyncio.TimeoutError:
+                    if polling:
+                        await sync_to_async(poll_chain, thread_sensitive=False)(blockchain, SSE_POLL_SECONDS)
+                    idle += timeout
+                    if idle >= SSE_KEEPALIVE_SECONDS:
+                        idle = 0
+                        yield ': keepalive\n\n'
+                    continue
+                idle = 0
+                yield _sse_event('delta', message)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,198 @@
+"""
+Offline audit of an exported chain against the Vote table
+
+Works on the newline-delimited JSON written by the blockchain export
+view, one block per line, so it can run on a machine other than the
+server. The export is read as a stream and verified in chunks of lines
+across worker processes; each chunk needs only the block before it, and
+only a bounded number of chunks are held at once, so memory does not
+grow with the chain. Every chunk also recounts its votes, and the merged
+tally is compared with a recount of the Vote table read through a
+server-side cursor.
+
+A sharded ledger exports the base chain and then every election's shard,
+each line naming its shard. Each shard is verified as a chain of its own,
+and every shard tip the base chain anchors must match the exported shard.
+"""
+import json
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .blockchain import Block, block_fault, iter_votes
+
+# (election_id, candidate_id) -> votes
+Tally = Dict[Tuple[Any, Any], int]
+
+
+def _chunks(lines: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _last_block(line: str) -> Optional[Dict[str, Any]]:
+    try:
+        block_dict = json.loads(line)
+        Block.from_dict(block_dict)
+        return block_dict
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # The chunk holding this line reports it
+        return None
+
+
+def _anchors(block: Block) -> List[Tuple[Any, int, str]]:
+    """The ``(shard, height, hash)`` tips a base chain block anchors"""
+    if not isinstance(block.data, dict) or not isinstance(block.data.get('anchor'), list):
+        return []
+    return [tuple(tip) for tip in block.data['anchor'] if isinstance(tip, list) and len(tip) == 3]
+
+
+def audit_lines(lines: List[str], previous: Optional[Dict[str, Any]], sealer) -> Dict[str, Any]:
+    """
+    Verify and recount one chunk of an export that follows the ``previous`` block record.
+
+    A line whose shard differs from the one before it, or the first line
+    of the export (``previous`` None), starts that shard's chain at its
+    genesis block. Returns the chunk's block and vote counts, its tally,
+    the shards it starts, the tips its base chain blocks anchor, the hash
+    of every shard block, and the first fault as ``(shard, index,
+    reason)``, or None; counting stops at the fault.
+    """
+    result = {'blocks': 0, 'votes': 0, 'tally': Counter(), 'starts': [], 'anchors': [],
+              'hashes': {}, 'failure': None}
+    previous_block = Block.from_dict(previous) if previous is not None else None
+    shard = previous.get('shard') if previous is not None else None
+    for line in lines:
+        try:
+            block_dict = json.loads(line)
+            block = Block.from_dict(block_dict)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            index = previous_block.index + 1 if previous_block is not None else 0
+            result['failure'] = (shard, index, 'not a block record')
+            return result
+        if previous_block is None or block_dict.get('shard') != shard:
+            # Each shard's chain starts with its own genesis block
+            shard, previous_block = block_dict.get('shard'), None
+            result['starts'].append(shard)
+        index = previous_block.index + 1 if previous_block is not None else 0
+
+        if block.index != index:
+            fault = f'out of sequence (recorded as block {block.index})'
+        elif previous_block is None:
+            # The genesis block links to nothing and carries no seal
+            fault = None if block.hash == block.calculate_hash() else 'hash does not match the block contents'
+        else:
+            fault = block_fault(block, previous_block, sealer)
+        if fault is not None:
+            result['failure'] = (shard, index, fault)
+            return result
+
+        result['blocks'] += 1
+        for vote in iter_votes(block):
+            result['votes'] += 1
+            if vote.get('election_id') is not None:
+                result['tally'][vote['election_id'], vote['candidate_id']] += 1
+        if shard is None:
+            result['anchors'].extend(_anchors(block))
+        else:
+            result['hashes'][shard, index] = block.hash
+        previous_block = block
+    return result
+
+
+def audit_export(lines: Iterable[str], sealer, workers: Optional[int] = None,
+                 chunk_size: int = 5000) -> Dict[str, Any]:
+    """
+    Verify an exported chain's hashes, links, seals and anchors, and recount it.
+
+    Returns the number of blocks and votes verified, the tally of the
+    verified blocks and the first fault as ``(shard, index, reason)``, or
+    None when every block checks out. Chunks are verified across
+    ``workers`` processes (every core by default); verification stops at
+    the first faulty chunk.
+    """
+    workers = workers or os.cpu_count() or 1
+    result = {'blocks': 0, 'votes': 0, 'tally': Counter(), 'failure': None}
+    anchors: Dict[Tuple[Any, int], str] = {}
+    heights: Dict[Any, int] = {}
+
+    def merge(chunk_result) -> bool:
+        result['blocks'] += chunk_result['blocks']
+        result['votes'] += chunk_result['votes']
+        result['tally'].update(chunk_result['tally'])
+        result['failure'] = chunk_result['failure']
+        for shard in chunk_result['starts']:
+            if shard in heights or heights and shard is None:
+                # Anchors are only known in full once the base chain has been read
+                result['failure'] = result['failure'] or (shard, 0, 'chain appears out of order in the export')
+            heights[shard] = -1
+        for shard, height, block_hash in chunk_result['anchors']:
+            anchors[shard, height] = block_hash
+        # Blocks are merged in export order, so every anchor before them is known
+        for (shard, index), block_hash in chunk_result['hashes'].items():
+            heights[shard] = max(heights[shard], index)
+            anchored = anchors.get((shard, index))
+            if anchored is not None and anchored != block_hash and result['failure'] is None:
+                result['failure'] = (shard, index, 'hash does not match the tip anchored in the base chain')
+        return result['failure'] is None
+
+    previous = None
+    if workers <= 1:
+        for chunk in _chunks(lines, chunk_size):
+            if not merge(audit_lines(chunk, previous, sealer)):
+                return result
+            previous = _last_block(chunk[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque()
+            for chunk in _chunks(lines, chunk_size):
+                in_flight.append(pool.submit(audit_lines, chunk, previous, sealer))
+                previous = _last_block(chunk[-1])
+                # Keep a bounded number of chunks in memory at once
+                while len(in_flight) >= workers * 2:
+                    if not merge(in_flight.popleft().result()):
+                        pool.shutdown(cancel_futures=True)
+                        return result
+            while in_flight:
+                if not merge(in_flight.popleft().result()):
+                    pool.shutdown(cancel_futures=True)
+                    return result
+
+    if not result['blocks']:
+        result['failure'] = (None, 0, 'the export holds no blocks')
+        return result
+    for shard, height in sorted(anchors, key=lambda tip: (_order(tip[0]), tip[1])):
+        if heights.get(shard, -1) < height:
+            result['failure'] = (shard, height, 'anchored in the base chain but missing from the export')
+            break
+    return result
+
+
+def database_tally(chunk_size: int = 2000) -> Tally:
+    """Recount the Vote table, streaming rows through a server-side cursor"""
+    from .models import Vote
+    rows = Vote.objects.order_by().values_list('election_id', 'candidate_id')
+    return Counter(rows.iterator(chunk_size=chunk_size))
+
+
+def _order(value: Any) -> Tuple[int, Any]:
+    # Ids are integers unless a ballot was written outside the pipeline
+    return (0, value) if isinstance(value, int) else (1, str(value))
+
+
+def tally_differences(database: Tally, chain: Tally) -> List[Tuple[Any, Any, int, int]]:
+    """``(election_id, candidate_id, database_votes, chain_votes)`` for every count that differs, in order"""
+    keys = sorted(set(database) | set(chain), key=lambda key: (_order(key[0]), _order(key[1])))
+    return [(election_id, candidate_id, database.get((election_id, candidate_id), 0),
+             chain.get((election_id, candidate_id), 0))
+            for election_id, candidate_id in keys
+            if database.get((election_id, candidate_id), 0) != chain.get((election_id, candidate_id), 0)]
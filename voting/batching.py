@@ -0,0 +1,136 @@
+"""
+Single-writer mempool that seals votes into blocks
+"""
+import threading
+from concurrent.futures import Future
+from time import monotonic
+from typing import Any, Dict, List, Tuple
+
+from .merkle import merkle_proofs
+
+
+class DuplicateVoteError(Exception):
+    """Raised when a voter already has a ballot on the chain or in the mempool"""
+
+
+class VoteBatcher:
+    """
+    Collects submitted votes and seals them into one block at a time.
+
+    A single writer thread owns every append made through the batcher, so
+    concurrent submitters can never race for the same chain tip, and
+    duplicate ballots are rejected against the chain and the mempool
+    before they are queued. A block is sealed once ``batch_size`` votes
+    are pending or the oldest pending vote has waited ``max_wait_ms``
+    milliseconds. With a batch size above one, each block carries the
+    votes and their Merkle root, so proof of work is paid once per batch
+    rather than once per vote, and every submitter receives a receipt with
+    a Merkle inclusion proof for their own vote. With a batch size of one,
+    each vote is sealed into its own block as before.
+    """
+
+    def __init__(self, blockchain, batch_size: int = 100, max_wait_ms: float = 200):
+        self.blockchain = blockchain
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[Dict[str, Any], Future]] = []
+        self._pending_ballots = set()
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, vote: Dict[str, Any]) -> Future:
+        """Queue a vote; the returned future resolves to its receipt"""
+        future = Future()
+        ballot = (vote.get('election_id'), vote.get('voter_id'))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('vote batcher is closed')
+            if ballot in self._pending_ballots or self.blockchain.verify_vote(ballot[1], ballot[0]):
+                future.set_exception(DuplicateVoteError(f'voter {ballot[1]} has already voted'))
+                return future
+            self._pending.append((vote, future))
+            self._pending_ballots.add(ballot)
+            if self._oldest is None:
+                self._oldest = monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='vote-batcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._ready():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(self._oldest + self.max_wait - monotonic(), 0)
+                    self._condition.wait(timeout)
+                batch = self._take_batch()
+                closed = self._closed
+            if batch:
+                self._seal(batch)
+            if closed and not batch:
+                return
+
+    def _ready(self) -> bool:
+        if len(self._pending) >= self.batch_size:
+            return True
+        return self._oldest is not None and monotonic() - self._oldest >= self.max_wait
+
+    def _take_batch(self) -> List[Tuple[Dict[str, Any], Future]]:
+        batch = self._pending[:self.batch_size]
+        self._pending = self._pending[self.batch_size:]
+        self._oldest = monotonic() if self._pending else None
+        return batch
+
+    def _seal(self, batch: List[Tuple[Dict[str, Any], Future]]):
+        votes = [vote for vote, _ in batch]
+        try:
+            if self.batch_size == 1:
+                block = self.blockchain.add_block(votes[0])
+            else:
+                block = self.blockchain.add_batch(votes)
+        except Exception as exc:
+            block = None
+            for _, future in batch:
+                future.set_exception(exc)
+        finally:
+            # Ballots leave the mempool only once the chain's voter index has them
+            with self._condition:
+                for vote in votes:
+                    self._pending_ballots.discard((vote.get('election_id'), vote.get('voter_id')))
+        if block is None:
+            return
+        if self.batch_size == 1:
+            batch[0][1].set_result({'block_index': block.index, 'block_hash': block.hash})
+            return
+        root = block.data['merkle_root']
+        for leaf_index, ((_, future), proof) in enumerate(zip(batch, merkle_proofs(votes))):
+            future.set_result({
+                'block_index': block.index,
+                'block_hash': block.hash,
+                'merkle_root': root,
+                'leaf_index': leaf_index,
+                'proof': proof,
+            })
+
+    def flush(self):
+        """Seal every pending vote immediately"""
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._seal(batch)
+
+    def close(self):
+        """Stop accepting votes and seal whatever is still pending"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,249 @@
+"""
+Benchmarks of the blockchain and voting hot paths
+
+Each benchmark returns result records: a name, the parameters it ran
+with and timing statistics in seconds per operation. run_benchmarks()
+wraps them with the environment they ran in so results from different
+versions can be compared; see the bench management command.
+"""
+import contextlib
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import django
+from django.conf import settings
+
+from .batching import VoteBatcher
+from . import blockchain as chain_module
+from .blockchain import Block, Blockchain
+from .loadgen import fill_chain
+from .storage import CompactBlockStore, FileBlockStore, MemoryBlockStore
+
+SUITES = ['hash', 'pow', 'chain', 'views']
+
+
+def summarize(times: List[float], **extra) -> Dict[str, Any]:
+    """Timing statistics for a list of per-operation durations"""
+    ordered = sorted(times)
+    mean = statistics.fmean(ordered)
+    return {
+        'samples': len(ordered),
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'p95': ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        'mean': mean,
+        'ops_per_sec': 1 / mean if mean else None,
+        **extra,
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int = 5, number: int = 1) -> Dict[str, Any]:
+    """Time number calls of func, repeat times; statistics are per call"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - started) / number)
+    return summarize(times, number=number)
+
+
+def record(name: str, params: Dict[str, Any], timing: Dict[str, Any]) -> Dict[str, Any]:
+    return {'name': name, 'params': params, **timing}
+
+
+def _sample_block(index: int = 1) -> Block:
+    vote = {'voter_id': index, 'candidate_id': 1, 'election_id': 1, 'timestamp': '0'}
+    return Block(index, 0.0, vote, '0' * 64)
+
+
+def bench_hash(repeat: int = 5) -> List[Dict[str, Any]]:
+    """Block.calculate_hash for a single-vote block"""
+    block = _sample_block()
+    return [record('calculate_hash', {}, measure(block.calculate_hash, repeat, number=10000))]
+
+
+def bench_pow(difficulties: Iterable[int], repeat: int = 5) -> List[Dict[str, Any]]:
+    """Blockchain.proof_of_work at each difficulty, on a fresh block per sample"""
+    chain = Blockchain()
+    results = []
+    for difficulty in difficulties:
+        chain.difficulty = difficulty
+        blocks = iter(range(1, repeat + 1))
+        timing = measure(lambda: chain.proof_of_work(_sample_block(next(blocks))), repeat)
+        results.append(record('proof_of_work', {'difficulty': difficulty}, timing))
+    chain.close()
+    return results
+
+
+@contextlib.contextmanager
+def _scratch_chain(store: str):
+    """A chain in a throwaway store: 'memory', 'compact' or 'file' in a temporary directory"""
+    if store in ('memory', 'compact'):
+        chain = Blockchain(MemoryBlockStore() if store == 'memory' else CompactBlockStore())
+        try:
+            yield chain
+        finally:
+            chain.close()
+        return
+    directory = tempfile.mkdtemp(prefix='bench-chain-')
+    chain = Blockchain(FileBlockStore(directory))
+    try:
+        yield chain
+    finally:
+        chain.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_chain(sizes: Iterable[int], candidates: Iterable[int], store: str = 'file',
+                difficulty: int = 0, repeat: int = 5) -> List[Dict[str, Any]]:
+    """
+    Appends, validation and queries as the chain grows.
+
+    For every size and candidate count a chain of single-vote blocks is
+    built at the given difficulty, timing add_block, then full and
+    checkpointed validation, the per-candidate count, the election tally
+    and the voter lookup are measured on it.
+    """
+    results = []
+    for size in sizes:
+        for candidate_count in candidates:
+            params = {'blocks': size, 'candidates': candidate_count, 'store': store,
+                      'difficulty': difficulty}
+            with _scratch_chain(store) as chain:
+                chain.difficulty = difficulty
+                started = time.perf_counter()
+                fill_chain(chain, size, batch_size=1, candidates=candidate_count)
+                elapsed = time.perf_counter() - started
+                results.append(record('add_block', params, summarize([elapsed / size], number=size)))
+
+                results.append(record('is_chain_valid_full', params,
+                                      measure(lambda: chain.is_chain_valid(full=True), repeat)))
+                results.append(record('is_chain_valid', params, measure(chain.is_chain_valid, repeat)))
+                results.append(record('get_votes_for_candidate', params,
+                                      measure(lambda: chain.get_votes_for_candidate(1), repeat, 1000)))
+                results.append(record('tally', params, measure(lambda: chain.tally(1), repeat, 1000)))
+                results.append(record('verify_vote', params,
+                                      measure(lambda: chain.verify_vote(size // 2, 1), repeat, 1000)))
+    return results
+
+
+@contextlib.contextmanager
+def _test_database():
+    """Run against a throwaway test database, as the test runner does"""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def bench_views(voters: int = 200, candidates: int = 3, difficulty: int = 2) -> List[Dict[str, Any]]:
+    """
+    End-to-end vote and results latency through Django's test client.
+
+    Runs on a test database and a fresh in-memory chain sealed by its own
+    single writer, so neither the configured database nor the configured
+    chain is touched.
+    """
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.urls import reverse
+    from django.utils import timezone
+
+    from .cache import results_cache
+    from .models import Candidate, Election, Voter
+
+    chain = Blockchain()
+    chain.difficulty = difficulty
+    batcher = VoteBatcher(chain, batch_size=1)
+    params = {'voters': voters, 'candidates': candidates, 'difficulty': difficulty}
+    with _test_database(), contextlib.ExitStack() as stack:
+        # The views and pipeline reach the chain and batcher through these stand-ins
+        stack.enter_context(chain_module.blockchain.substitute(chain))
+        stack.enter_context(chain_module.vote_batcher.substitute(batcher))
+        stack.callback(batcher.close)
+        results_cache().clear()
+
+        now = timezone.now()
+        election = Election.objects.create(
+            title='Benchmark', description='', is_active=True,
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(days=1))
+        candidate_ids = [Candidate.objects.create(election=election, name=f'Candidate {number}').id
+                         for number in range(candidates)]
+        User.objects.bulk_create([User(username=f'bench{number}', password='!')
+                                  for number in range(voters)])
+        users = list(User.objects.filter(username__startswith='bench').order_by('id'))
+        Voter.objects.bulk_create([Voter(user=user, voter_id=f'B{user.id}') for user in users])
+
+        client = Client()
+        vote_url = reverse('vote', args=[election.id])
+        times = []
+        for number, user in enumerate(users):
+            client.force_login(user)
+            started = time.perf_counter()
+            client.post(vote_url, {'candidate_id': candidate_ids[number % candidates]})
+            times.append(time.perf_counter() - started)
+        results = [record('views.vote', params, summarize(times))]
+
+        results_url = reverse('results', args=[election.id])
+
+        def cold():
+            results_cache().clear()
+            client.get(results_url)
+
+        results.append(record('views.results_cold', params, measure(cold, 20)))
+        results.append(record('views.results_warm', params, measure(lambda: client.get(results_url), 20)))
+        etag = client.get(results_url)['ETag']
+        results.append(record('views.results_not_modified', params, measure(
+            lambda: client.get(results_url, HTTP_IF_NONE_MATCH=etag), 20)))
+    chain.close()
+    return results
+
+
+def _revision() -> Optional[str]:
+    """The git commit being benchmarked, when run from a checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(settings.BASE_DIR),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(suites: Iterable[str] = SUITES, sizes: Iterable[int] = (1000, 10000, 100000),
+                   candidates: Iterable[int] = (3, 50), difficulties: Iterable[int] = (1, 2, 3, 4),
+                   store: str = 'file', chain_difficulty: int = 0, voters: int = 200,
+                   repeat: int = 5, progress: Callable[[str], None] = None) -> Dict[str, Any]:
+    """Run the selected suites and return a JSON-serializable report"""
+    suites = list(suites)
+    runners = {
+        'hash': lambda: bench_hash(repeat),
+        'pow': lambda: bench_pow(difficulties, repeat),
+        'chain': lambda: bench_chain(sizes, candidates, store, chain_difficulty, repeat),
+        'views': lambda: bench_views(voters),
+    }
+    report = {
+        'started': datetime.now(dt_timezone.utc).isoformat(),
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for suite in suites:
+        if progress is not None:
+            progress(suite)
+        report['results'].extend(runners[suite]())
+    return report
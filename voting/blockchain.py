@@ -1,132 +1,760 @@
 """
 Blockchain implementation for secure vote storage
 """
+import atexit
 import hashlib
+import hmac
 import json
+import logging
+import os
+import struct
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from time import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterator, Optional
+
+from .batching import VoteBatcher
+from .consensus import AdaptiveProofOfWork, Ed25519Authority, HmacAuthority, ProofOfWork
+from .indexes import VoterIndex
+from .merkle import merkle_root
+from .metrics import (ADD_BLOCK_SECONDS, POW_ATTEMPTS, POW_SECONDS, TALLY_SECONDS,
+                      VALIDATION_SECONDS, timed)
+from .mining import NONCE, ParallelMiner, SequentialMiner
+from .snapshots import SnapshotError, SnapshotStore
+from .storage import CompactBlockStore, MemoryBlockStore, FileBlockStore
+
+logger = logging.getLogger(__name__)
+
+# Hash versions: 1 hashes the whole block as sorted JSON (the original
+# scheme, still verified for chains written before headers existed);
+# 2 hashes a fixed binary header followed by the nonce; 3 adds the
+# proof-of-work target the block was sealed at to the header; 4 keeps
+# that header but promotes an odd Merkle node instead of duplicating it.
+LEGACY_HASH_VERSION = 1
+TARGET_HASH_VERSION = 3
+MERKLE_HASH_VERSION = 4
+HASH_VERSION = 4
+
+# version, index, timestamp, SHA-256 of the data, previous block hash
+HEADER = struct.Struct('<Bqd32s32s')
+# version, index, timestamp, target, SHA-256 of the data, previous block hash
+TARGET_HEADER = struct.Struct('<BqdB32s32s')
+
+
+def digest_data(data: Dict[str, Any]) -> bytes:
+    """SHA-256 of the canonical JSON encoding of a block's data"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).digest()
 
 
 class Block:
     """Represents a single block in the blockchain"""
     
+    # No per-instance __dict__: long chains hold many blocks
+    __slots__ = ('index', 'timestamp', 'data', 'previous_hash', 'nonce', 'version', 'hash', 'seal', 'target')
+    
     def __init__(self, index: int, timestamp: float, data: Dict[str, Any], 
-                 previous_hash: str, nonce: int = 0):
+                 previous_hash: str, nonce: int = 0, version: int = HASH_VERSION, target: int = 0):
         self.index = index
         self.timestamp = timestamp
         self.data = data
         self.previous_hash = previous_hash
         self.nonce = nonce
+        self.version = version
+        # Leading zero hex digits the hash was mined to; None before headers recorded it
+        self.target: Optional[int] = target if version >= TARGET_HASH_VERSION else None
         self.hash = self.calculate_hash()
+        self.seal: Optional[str] = None  # An authority's signature over the hash
+    
+    def header_prefix(self) -> bytes:
+        """Fixed-layout header covering everything but the nonce"""
+        # Hashes are hex digests; the genesis block's '0' pads to all zeros
+        previous = bytes.fromhex(self.previous_hash.rjust(64, '0'))
+        if self.version >= TARGET_HASH_VERSION:
+            return TARGET_HEADER.pack(self.version, self.index, self.timestamp, self.target,
+                                      digest_data(self.data), previous)
+        return HEADER.pack(self.version, self.index, self.timestamp,
+                           digest_data(self.data), previous)
     
     def calculate_hash(self) -> str:
         """Calculate the hash of the block"""
-        block_string = json.dumps({
-            'index': self.index,
-            'timestamp': self.timestamp,
-            'data': self.data,
-            'previous_hash': self.previous_hash,
-            'nonce': self.nonce
-        }, sort_keys=True)
-        return hashlib.sha256(block_string.encode()).hexdigest()
+        if self.version == LEGACY_HASH_VERSION:
+            block_string = json.dumps({
+                'index': self.index,
+                'timestamp': self.timestamp,
+                'data': self.data,
+                'previous_hash': self.previous_hash,
+                'nonce': self.nonce
+            }, sort_keys=True)
+            return hashlib.sha256(block_string.encode()).hexdigest()
+        return hashlib.sha256(self.header_prefix() + NONCE.pack(self.nonce)).hexdigest()
+    
+    @classmethod
+    def from_dict(cls, block_dict: Dict[str, Any]) -> 'Block':
+        """Rebuild a stored block without recomputing its hash"""
+        block = cls.__new__(cls)
+        block.index = block_dict['index']
+        block.timestamp = block_dict['timestamp']
+        block.data = block_dict['data']
+        block.previous_hash = block_dict['previous_hash']
+        block.nonce = block_dict['nonce']
+        # Blocks stored before versioned headers were hashed as JSON
+        block.version = block_dict.get('version', LEGACY_HASH_VERSION)
+        block.hash = block_dict['hash']
+        block.seal = block_dict.get('seal')
+        block.target = block_dict.get('target', 0) if block.version >= TARGET_HASH_VERSION else None
+        return block
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert block to dictionary"""
-        return {
+        block_dict = {
             'index': self.index,
             'timestamp': self.timestamp,
             'data': self.data,
             'previous_hash': self.previous_hash,
             'nonce': self.nonce,
+            'version': self.version,
             'hash': self.hash
         }
+        if self.target is not None:
+            block_dict['target'] = self.target
+        # Proof-of-work blocks keep the layout they have always had
+        if self.seal is not None:
+            block_dict['seal'] = self.seal
+        return block_dict
+
+
+def iter_votes(block: Block):
+    """Yield the votes in a block, whether it holds one vote or a batch"""
+    if 'votes' in block.data:
+        yield from block.data['votes']
+    elif block.data.get('candidate_id') is not None:
+        yield block.data
+
+
+def block_fault(block: Block, previous: Block, sealer) -> Optional[str]:
+    """Why one block fails verification against the stored block before it, or None"""
+    # Check if hash is correct
+    if block.hash != block.calculate_hash():
+        return 'hash does not match the block contents'
+    
+    # Check if previous hash matches
+    if block.previous_hash != previous.hash:
+        return 'previous hash does not match the preceding block'
+    
+    # Check proof of work, or the authority's seal
+    fault = sealer.fault(block, previous)
+    if fault is not None:
+        return fault
+    
+    # Check that a batched block's Merkle root covers its votes
+    if 'votes' in block.data:
+        legacy = block.version < MERKLE_HASH_VERSION
+        if merkle_root(block.data['votes'], legacy) != block.data.get('merkle_root'):
+            return 'Merkle root does not cover the votes'
+    return None
+
+
+def block_is_valid(block: Block, previous: Block, sealer) -> bool:
+    """Check one block against the stored block before it"""
+    return block_fault(block, previous, sealer) is None
+
+
+def verify_block_range(block_dicts: List[Dict[str, Any]], previous_dict: Dict[str, Any],
+                       sealer) -> Optional[int]:
+    """Verify consecutive blocks; return the index of the first invalid one, or None"""
+    previous = Block.from_dict(previous_dict)
+    for block_dict in block_dicts:
+        block = Block.from_dict(block_dict)
+        if not block_is_valid(block, previous, sealer):
+            return block.index
+        previous = block
+    return None
 
 
 class Blockchain:
     """Blockchain for storing votes securely"""
     
-    def __init__(self):
-        self.chain: List[Block] = []
-        self.difficulty = 2  # Number of leading zeros required in hash
-        self.create_genesis_block()
+    def __init__(self, store=None, miner=None, checkpoint_key: bytes = b'', snapshots=None,
+                 sealer=None):
+        # Any sequence of blocks with append(); defaults to process memory
+        self.chain = store if store is not None else MemoryBlockStore()
+        # Nonce search engine; ParallelMiner spreads it across processes
+        self.miner = miner if miner is not None else SequentialMiner()
+        # Seals new blocks and checks stored ones; proof of work unless configured otherwise
+        self.sealer = sealer if sealer is not None else ProofOfWork(miner=self.miner)
+        self.checkpoint_key = checkpoint_key  # Signs validation checkpoints and snapshots
+        self.snapshots = snapshots  # SnapshotStore the indexes are bootstrapped from, if any
+        self._lock = threading.RLock()  # Serializes appends to the chain tip
+        self._listeners: List[Callable[[Block], None]] = []
+        self._snapshot_writer: Optional[ThreadPoolExecutor] = None  # Started with the first snapshot
+        # A read-only store is extended by its writer process, genesis included
+        if not len(self.chain) and not getattr(self.chain, 'readonly', False):
+            self.create_genesis_block()
+        self.rebuild_indexes()
     
     def create_genesis_block(self):
         """Create the first block in the blockchain"""
         genesis_block = Block(0, time(), {'vote': 'Genesis Block'}, '0')
         self.chain.append(genesis_block)
     
-    def get_latest_block(self) -> Block:
-        """Get the most recent block in the chain"""
+    @property
+    def difficulty(self) -> int:
+        """Number of leading zeros required in hash for proof of work"""
+        return self.sealer.difficulty
+    
+    @difficulty.setter
+    def difficulty(self, value: int):
+        self.sealer.difficulty = value
+    
+    def get_latest_block(self) -> Optional[Block]:
+        """Get the most recent block in the chain, or None before a reader sees the genesis block"""
+        if len(self.chain) == 0:
+            return None
         return self.chain[-1]
     
+    @timed(ADD_BLOCK_SECONDS)
     def add_block(self, data: Dict[str, Any]) -> Block:
         """Add a new block to the blockchain with proof of work"""
-        previous_block = self.get_latest_block()
-        new_block = Block(
-            index=len(self.chain),
-            timestamp=time(),
-            data=data,
-            previous_hash=previous_block.hash
-        )
-        
-        # Proof of work
-        new_block = self.proof_of_work(new_block)
-        self.chain.append(new_block)
+        with self._lock:
+            previous_block = self.get_latest_block()
+            new_block = Block(
+                index=len(self.chain),
+                timestamp=time(),
+                data=data,
+                previous_hash=previous_block.hash
+            )
+            
+            # Proof of work, or the authority's signature
+            new_block = self.seal_block(new_block, previous_block)
+            self.chain.append(new_block)
+            self._index_block(new_block)
+            state = self._index_state(new_block) if self._snapshot_due(new_block) else None
+        self._notify(new_block)
+        if state is not None:
+            self._save_snapshot(state)
         return new_block
     
+    def add_listener(self, callback: Callable[[Block], None]):
+        """Call ``callback(block)`` after every block is appended and indexed"""
+        self._listeners.append(callback)
+    
+    def remove_listener(self, callback: Callable[[Block], None]):
+        """Stop calling a previously added listener"""
+        self._listeners.remove(callback)
+    
+    def _notify(self, block: Block):
+        for callback in list(self._listeners):
+            try:
+                callback(block)
+            except Exception:
+                logger.exception('Blockchain listener %r failed', callback)
+    
+    def add_batch(self, votes: List[Dict[str, Any]]) -> Block:
+        """Seal several votes into one block under their Merkle root"""
+        return self.add_block({'votes': votes, 'merkle_root': merkle_root(votes)})
+    
+    def refresh(self) -> int:
+        """
+        Index and announce blocks another process appended to a shared store.
+
+        A no-op unless the store is a read-only view of another process's
+        chain. Returns the number of new blocks.
+        """
+        refresh = getattr(self.chain, 'refresh', None)
+        if refresh is None:
+            return 0
+        with self._lock:
+            start = len(self.chain)
+            stop = refresh()
+            new_blocks = self.chain[start:stop]
+            for block in new_blocks:
+                self._index_block(block)
+        for block in new_blocks:
+            self._notify(block)
+        return len(new_blocks)
+    
+    def rebuild_indexes(self):
+        """
+        Rebuild the tally and voter indexes with a single pass over the chain.
+
+        With a snapshot store, the pass starts after the newest snapshot
+        whose signature verifies and whose block hash matches the chain at
+        its height; without a usable one every block is replayed.
+        """
+        height = self._restore_snapshot()
+        if height is not None:
+            for block in self.iter_blocks(height + 1):
+                self._index_block(block)
+            return
+        self._candidate_votes: Dict[int, int] = defaultdict(int)
+        self._election_votes: Dict[Any, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self._voters = VoterIndex(capacity=max(len(self.chain) * 2, 100000))
+        self._election_tips: Dict[Any, Block] = {}
+        for block in self.chain:
+            self._index_block(block)
+    
+    def _restore_snapshot(self) -> Optional[int]:
+        """Load the indexes from the newest usable snapshot; returns its height, or None"""
+        if self.snapshots is None:
+            return None
+        for state in self.snapshots.states(self.checkpoint_key):
+            height = state['height']
+            if height >= len(self.chain):
+                continue
+            block = self.chain[height]
+            if block.hash != state['hash'] or block.calculate_hash() != block.hash:
+                logger.warning('Snapshot at height %d does not match the chain', height)
+                continue
+            self._candidate_votes = defaultdict(int, state['candidate_votes'])
+            self._election_votes = defaultdict(lambda: defaultdict(int))
+            for election_id, tally in state['election_votes'].items():
+                self._election_votes[election_id].update(tally)
+            self._voters = VoterIndex.restore(state['ballots'], state['bloom'])
+            self._election_tips = {election_id: self.chain[index]
+                                   for election_id, index in state['election_tips'].items()}
+            return height
+        return None
+    
+    def _snapshot_due(self, block: Block) -> bool:
+        # Read-only views load the writer's snapshots but never write their own
+        return (self.snapshots is not None and not getattr(self.chain, 'readonly', False)
+                and self.snapshots.due(block.index))
+    
+    def _index_state(self, block: Block) -> Callable[[], Dict[str, Any]]:
+        """
+        Capture the indexes as of a block; the returned function builds the state.
+
+        Called under the lock, where only the per-candidate tallies are
+        copied; the voter index, which grows with every ballot, is copied
+        when the function runs.
+        """
+        voters = self._voters.capture()
+        candidate_votes = dict(self._candidate_votes)
+        election_votes = {election_id: dict(tally) for election_id, tally in self._election_votes.items()}
+        election_tips = {election_id: tip.index for election_id, tip in self._election_tips.items()}
+        
+        def state() -> Dict[str, Any]:
+            ballots, bloom = voters()
+            return {
+                'height': block.index,
+                'hash': block.hash,
+                'candidate_votes': candidate_votes,
+                'election_votes': election_votes,
+                'election_tips': election_tips,
+                'ballots': ballots,
+                'bloom': bloom,
+            }
+        return state
+    
+    def _save_snapshot(self, state: Callable[[], Dict[str, Any]]):
+        """Copy, encode and sign the captured indexes on a background thread, off the writer's path"""
+        with self._lock:
+            if self._snapshot_writer is None:
+                self._snapshot_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chain-snapshot')
+        self._snapshot_writer.submit(self._write_snapshot, state)
+    
+    def _write_snapshot(self, state: Callable[[], Dict[str, Any]]):
+        state = state()
+        # A failed snapshot only costs start-up time, never the block
+        try:
+            self.snapshots.save(state, self.checkpoint_key)
+        except (OSError, SnapshotError) as error:
+            logger.warning('Could not snapshot the indexes at height %d: %s', state['height'], error)
+    
+    def _index_block(self, block: Block):
+        """Record a newly appended block in the tally and voter indexes"""
+        for vote in iter_votes(block):
+            candidate_id = vote['candidate_id']
+            self._candidate_votes[candidate_id] += 1
+            election_id = vote.get('election_id')
+            voter_id = vote.get('voter_id')
+            if voter_id is not None:
+                self._voters.add(voter_id, election_id)
+            if election_id is not None:
+                self._election_votes[election_id][candidate_id] += 1
+                self._election_tips[election_id] = block
+    
+    def close(self):
+        """Finish pending snapshots, then flush and release the underlying block store, miner and sealer"""
+        if self._snapshot_writer is not None:
+            self._snapshot_writer.shutdown()
+            self._snapshot_writer = None
+        self.chain.close()
+        self.miner.close()
+        self.sealer.close()
+    
+    @timed(POW_SECONDS, result=lambda block: POW_ATTEMPTS.observe(block.nonce + 1))
+    def seal_block(self, block: Block, previous: Optional[Block] = None) -> Block:
+        """
+        Set a block's target, nonce and hash, and its seal under an authority, with the chain's sealer.
+
+        ``previous`` defaults to the stored block before it.
+        """
+        if previous is None and 0 < block.index <= len(self.chain):
+            previous = self.chain[block.index - 1]
+        return self.sealer.seal(block, previous)
+    
     def proof_of_work(self, block: Block) -> Block:
+        """Seal a block; the name predates sealers other than proof of work"""
+        return self.seal_block(block)
+    
+    @timed(VALIDATION_SECONDS)
+    def is_chain_valid(self, full: bool = False, workers: int = 1) -> bool:
         """
-        Simple proof of work algorithm:
-        - Find a number (nonce) such that hash(block) contains leading zeros
+        Verify the integrity of the blockchain.
+        
+        By default only blocks appended since the last successful check are
+        verified, starting from a keyed checkpoint of the last verified
+        height; the checkpointed block itself is re-hashed to confirm the
+        chain has not been swapped underneath it. Pass full=True to audit
+        every block, optionally split across worker processes.
         """
-        block.nonce = 0
-        block.hash = block.calculate_hash()
+        with self._lock:
+            length = len(self.chain)
+        if length == 0:
+            # A reader attached before its writer stored the genesis block
+            return True
+        start = 1 if full else self._checkpoint_height(length) + 1
         
-        while not block.hash.startswith('0' * self.difficulty):
-            block.nonce += 1
-            block.hash = block.calculate_hash()
+        if workers > 1:
+            valid = self._verify_parallel(start, length, workers)
+        else:
+            previous_block = self.chain[start - 1]
+            valid = True
+            for i in range(start, length):
+                current_block = self.chain[i]
+                if not block_is_valid(current_block, previous_block, self.sealer):
+                    valid = False
+                    break
+                previous_block = current_block
         
-        return block
+        if valid and start < length:
+            self._save_checkpoint(length - 1, self.chain[length - 1].hash)
+        return valid
     
-    def is_chain_valid(self) -> bool:
-        """Verify the integrity of the blockchain"""
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i - 1]
-            
-            # Check if hash is correct
-            if current_block.hash != current_block.calculate_hash():
-                return False
-            
-            # Check if previous hash matches
-            if current_block.previous_hash != previous_block.hash:
-                return False
-            
-            # Check proof of work
-            if not current_block.hash.startswith('0' * self.difficulty):
-                return False
-        
-        return True
+    def audit(self, workers: Optional[int] = None) -> bool:
+        """Verify every block, spreading hash ranges across all cores by default"""
+        return self.is_chain_valid(full=True, workers=workers or os.cpu_count() or 1)
+    
+    def _verify_parallel(self, start: int, stop: int, workers: int, chunk_size: int = 5000) -> bool:
+        """Verify [start, stop) in chunks; each chunk needs only the stored block before it"""
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = []
+            for chunk_start in range(start, stop, chunk_size):
+                chunk = [block.to_dict() for block in self.chain[chunk_start:min(chunk_start + chunk_size, stop)]]
+                in_flight.append(pool.submit(verify_block_range, chunk,
+                                             self.chain[chunk_start - 1].to_dict(), self.sealer))
+                # Keep a bounded number of chunks in memory at once
+                if len(in_flight) >= workers * 2:
+                    if in_flight.pop(0).result() is not None:
+                        pool.shutdown(cancel_futures=True)
+                        return False
+            return all(future.result() is None for future in in_flight)
+    
+    def _checkpoint_height(self, length: int) -> int:
+        """Height of the last verified block, or 0 when the checkpoint is unusable"""
+        checkpoint = self.chain.read_meta('checkpoint')
+        if not checkpoint:
+            return 0
+        height, block_hash = checkpoint['height'], checkpoint['hash']
+        if not hmac.compare_digest(checkpoint['digest'], self._checkpoint_digest(height, block_hash)):
+            return 0
+        if height >= length:
+            return 0
+        block = self.chain[height]
+        if block.hash != block_hash or block.calculate_hash() != block_hash:
+            return 0
+        return height
+    
+    def _save_checkpoint(self, height: int, block_hash: str):
+        self.chain.write_meta('checkpoint', {
+            'height': height,
+            'hash': block_hash,
+            'digest': self._checkpoint_digest(height, block_hash),
+        })
+    
+    def _checkpoint_digest(self, height: int, block_hash: str) -> str:
+        message = f'{height}:{block_hash}'.encode()
+        return hmac.new(self.checkpoint_key, message, hashlib.sha256).hexdigest()
     
     def get_chain(self) -> List[Dict[str, Any]]:
         """Get the entire blockchain as a list of dictionaries"""
         return [block.to_dict() for block in self.chain]
     
+    def iter_blocks(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Block]:
+        """Lazily yield blocks in [start, stop) without materializing the chain"""
+        stop = len(self.chain) if stop is None else min(stop, len(self.chain))
+        for index in range(max(start, 0), stop):
+            yield self.chain[index]
+    
     def get_votes_for_candidate(self, candidate_id: int) -> int:
-        """Count votes for a specific candidate from the blockchain"""
-        count = 0
-        for block in self.chain[1:]:  # Skip genesis block
-            if block.data.get('candidate_id') == candidate_id:
-                count += 1
-        return count
-    
-    def verify_vote(self, voter_id: int) -> bool:
-        """Check if a voter has already voted"""
-        for block in self.chain[1:]:  # Skip genesis block
-            if block.data.get('voter_id') == voter_id:
-                return True
-        return False
-
-
-# Global blockchain instance
-blockchain = Blockchain()
+        """Count votes for a specific candidate from the tally index"""
+        return self._candidate_votes.get(candidate_id, 0)
+    
+    @timed(TALLY_SECONDS.labels('chain'))
+    def tally(self, election_id: int) -> Dict[int, int]:
+        """Get the vote count of every candidate in an election"""
+        return dict(self._election_votes.get(election_id, {}))
+    
+    def election_tip(self, election_id: int) -> Optional[Block]:
+        """Get the latest block holding a vote for an election"""
+        return self._election_tips.get(election_id)
+    
+    def get_total_votes(self, election_id: int = None) -> int:
+        """Get the number of votes cast in an election, or on the whole chain"""
+        if election_id is None:
+            return sum(self._candidate_votes.values())
+        return sum(self._election_votes.get(election_id, {}).values())
+    
+    def verify_vote(self, voter_id: int, election_id: int = None) -> bool:
+        """Check if a voter has already voted, optionally in one election"""
+        return self._voters.has_voted(voter_id, election_id)
+
+
+def _setting(name: str, default: Any = None) -> Any:
+    """Read a Django setting, falling back when settings are not configured"""
+    try:
+        from django.conf import settings
+    except ImportError:
+        return default
+    return getattr(settings, name, default) if settings.configured else default
+
+
+def _default_store():
+    """Use the on-disk store configured in settings, if any; read-only when a writer process owns it"""
+    storage_dir = _setting('BLOCKCHAIN_STORAGE_DIR')
+    if _setting('BLOCKCHAIN_WRITER_ADDRESS') is not None:
+        if not storage_dir:
+            raise ValueError('BLOCKCHAIN_WRITER_ADDRESS requires BLOCKCHAIN_STORAGE_DIR')
+        return FileBlockStore(storage_dir, readonly=True)
+    if storage_dir:
+        return FileBlockStore(storage_dir, **_setting('BLOCKCHAIN_STORAGE_OPTIONS', {}))
+    if _setting('BLOCKCHAIN_COMPACT_MEMORY', False):
+        return CompactBlockStore()
+    return MemoryBlockStore()
+
+
+def _default_batcher(chain: Blockchain):
+    """Single writer for votes, batching them when BLOCKCHAIN_BATCH_SIZE is above one"""
+    address = _setting('BLOCKCHAIN_WRITER_ADDRESS')
+    if address is not None:
+        from .writer import RemoteBatcher
+        return RemoteBatcher(address, _authkey(), chain=chain)
+    batch_size = max(_setting('BLOCKCHAIN_BATCH_SIZE', 1), 1)
+    max_wait_ms = _setting('BLOCKCHAIN_BATCH_MAX_WAIT_MS', 200)
+    from .sharding import ShardedBatcher, ShardedLedger
+    if isinstance(chain, ShardedLedger):
+        return ShardedBatcher(chain, batch_size, max_wait_ms)
+    return VoteBatcher(chain, batch_size, max_wait_ms)
+
+
+def _default_snapshots():
+    """Snapshot the indexes next to the on-disk store every BLOCKCHAIN_SNAPSHOT_INTERVAL blocks"""
+    storage_dir = _setting('BLOCKCHAIN_STORAGE_DIR')
+    interval = _setting('BLOCKCHAIN_SNAPSHOT_INTERVAL', 10000)
+    if not storage_dir or not interval:
+        return None
+    return SnapshotStore(os.path.join(storage_dir, 'snapshots'), interval)
+
+
+def _default_ledger(base: Blockchain, miner=None):
+    """
+    Give every election a chain of its own when BLOCKCHAIN_SHARDED is set.
+
+    Shards live in ``shards/election-<id>/`` under BLOCKCHAIN_STORAGE_DIR,
+    each with its own snapshots, or in memory without a storage directory;
+    they are read-only views when the base chain is one. The base chain
+    anchors the shard tips every BLOCKCHAIN_ANCHOR_INTERVAL seconds.
+    """
+    if not _setting('BLOCKCHAIN_SHARDED', False):
+        return base
+    from .sharding import ShardedLedger
+    storage_dir = _setting('BLOCKCHAIN_STORAGE_DIR')
+    root = os.path.join(storage_dir, 'shards') if storage_dir else None
+    readonly = getattr(base.chain, 'readonly', False)
+    interval = _setting('BLOCKCHAIN_SNAPSHOT_INTERVAL', 10000)
+
+    def open_shard(election_id, create: bool) -> Optional[Blockchain]:
+        snapshots = None
+        if root is None:
+            if not create:
+                return None
+            store = CompactBlockStore() if _setting('BLOCKCHAIN_COMPACT_MEMORY', False) else MemoryBlockStore()
+        else:
+            directory = os.path.join(root, f'election-{election_id}')
+            if not create and not os.path.isdir(directory):
+                return None
+            options = {} if readonly else _setting('BLOCKCHAIN_STORAGE_OPTIONS', {})
+            store = FileBlockStore(directory, readonly=readonly, **options)
+            if interval:
+                snapshots = SnapshotStore(os.path.join(directory, 'snapshots'), interval)
+        return Blockchain(store, miner, checkpoint_key=_authkey(), snapshots=snapshots,
+                          sealer=_default_sealer(miner))
+
+    existing = []
+    if root is not None and os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            if name.startswith('election-'):
+                election_id = name[len('election-'):]
+                existing.append(int(election_id) if election_id.isdigit() else election_id)
+    return ShardedLedger(base, open_shard, existing, _setting('BLOCKCHAIN_ANCHOR_INTERVAL'))
+
+
+def _default_miner():
+    """Mine across processes when BLOCKCHAIN_MINER_WORKERS is above one"""
+    workers = _setting('BLOCKCHAIN_MINER_WORKERS', 1)
+    if workers is not None and workers <= 1:
+        return SequentialMiner()
+    return ParallelMiner(workers)
+
+
+def _default_sealer(miner=None):
+    """
+    Seal blocks as BLOCKCHAIN_CONSENSUS says: 'pow', 'adaptive-pow', 'hmac' or 'ed25519'.
+
+    Proof of work mines at BLOCKCHAIN_DIFFICULTY; the adaptive form starts
+    there and retunes towards BLOCKCHAIN_TARGET_BLOCK_SECONDS. No block
+    verifies below BLOCKCHAIN_MIN_DIFFICULTY. Authorities sign with
+    BLOCKCHAIN_SEAL_KEY (HMAC, SECRET_KEY by default) or the hex
+    BLOCKCHAIN_SIGNING_KEY / BLOCKCHAIN_VERIFY_KEY pair (Ed25519), from
+    block BLOCKCHAIN_AUTHORITY_SINCE on.
+    """
+    consensus = _setting('BLOCKCHAIN_CONSENSUS', 'pow')
+    difficulty = _setting('BLOCKCHAIN_DIFFICULTY', 2)
+    min_difficulty = min(_setting('BLOCKCHAIN_MIN_DIFFICULTY', 1), difficulty)
+    since = _setting('BLOCKCHAIN_AUTHORITY_SINCE', 1)
+    if consensus == 'pow':
+        return ProofOfWork(difficulty, miner, min_difficulty)
+    if consensus == 'adaptive-pow':
+        return AdaptiveProofOfWork(_setting('BLOCKCHAIN_TARGET_BLOCK_SECONDS', 1.0), difficulty, miner,
+                                   min_difficulty=min_difficulty)
+    if consensus == 'hmac':
+        key = _setting('BLOCKCHAIN_SEAL_KEY')
+        return HmacAuthority(key.encode() if isinstance(key, str) else key or _authkey(), since, min_difficulty)
+    if consensus == 'ed25519':
+        private_key, public_key = _setting('BLOCKCHAIN_SIGNING_KEY'), _setting('BLOCKCHAIN_VERIFY_KEY')
+        return Ed25519Authority(bytes.fromhex(private_key) if private_key else None,
+                                bytes.fromhex(public_key) if public_key else None, since, min_difficulty)
+    raise ValueError(f'Unknown BLOCKCHAIN_CONSENSUS {consensus!r}')
+
+
+def _authkey() -> bytes:
+    return str(_setting('SECRET_KEY', '')).encode()
+
+
+class Deferred:
+    """
+    Stands in for an object that is only built on first use.
+
+    Attribute reads and writes go to the object, building it first;
+    close() only closes it if it was ever built.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.__dict__.update(_deferred_factory=factory, _deferred_target=None,
+                             _deferred_lock=threading.Lock())
+
+    @property
+    def is_open(self) -> bool:
+        return self._deferred_target is not None
+
+    def open(self) -> Any:
+        """The object, built on the first call"""
+        if self._deferred_target is None:
+            with self._deferred_lock:
+                if self._deferred_target is None:
+                    self._opened(self._deferred_factory())
+        return self._deferred_target
+
+    def _opened(self, target: Any):
+        self.__dict__['_deferred_target'] = target
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.open(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.open(), name, value)
+
+    def close(self):
+        if self._deferred_target is not None:
+            self._deferred_target.close()
+
+    @contextmanager
+    def substitute(self, target: Any):
+        """Stand in for ``target`` until the block exits, then for the configured object again"""
+        with self._deferred_lock:
+            previous = self._deferred_target
+            self.__dict__['_deferred_target'] = target
+        try:
+            yield target
+        finally:
+            with self._deferred_lock:
+                self.__dict__['_deferred_target'] = previous
+
+
+class DeferredChain(Deferred):
+    """
+    The global chain, opened on first use rather than at import.
+
+    Importing the module (any management command, every process that
+    loads the URLconf) must not open, recover or lock the on-disk store.
+    Listeners added before the chain opens are attached when it does.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        super().__init__(factory)
+        self.__dict__['_deferred_listeners'] = []
+
+    def _opened(self, target: Any):
+        for callback in self._deferred_listeners:
+            target.add_listener(callback)
+        super()._opened(target)
+
+    def add_listener(self, callback: Callable[[Block], None]):
+        with self._deferred_lock:
+            if self._deferred_target is None:
+                self._deferred_listeners.append(callback)
+                return
+        self._deferred_target.add_listener(callback)
+
+    def remove_listener(self, callback: Callable[[Block], None]):
+        with self._deferred_lock:
+            if self._deferred_target is None:
+                self._deferred_listeners.remove(callback)
+                return
+        self._deferred_target.remove_listener(callback)
+
+
+def _open_global_chain():
+    miner = _default_miner()
+    return _default_ledger(Blockchain(_default_store(), miner, checkpoint_key=_authkey(),
+                                      snapshots=_default_snapshots(), sealer=_default_sealer(miner)),
+                           miner)
+
+
+# Global blockchain instance, opened on first use
+blockchain = DeferredChain(_open_global_chain)
+atexit.register(blockchain.close)
+
+# Global vote mempool; the only writer of votes to the global chain, or a
+# client of the writer process when BLOCKCHAIN_WRITER_ADDRESS is set
+vote_batcher = Deferred(lambda: _default_batcher(blockchain.open()))
+atexit.register(vote_batcher.close)
+
+
+def open_chain_reader():
+    """
+    Attach read-only to the configured on-disk chain, for tools running beside its writer.
+
+    Call refresh() to pick up blocks appended since, and close() when done.
+    Without BLOCKCHAIN_STORAGE_DIR there is no other process's chain to
+    attach to, and the global chain is returned.
+    """
+    storage_dir = _setting('BLOCKCHAIN_STORAGE_DIR')
+    if not storage_dir:
+        return blockchain
+    # Verifying blocks needs the sealer's keys and targets, but no miner
+    return _default_ledger(Blockchain(FileBlockStore(storage_dir, readonly=True), checkpoint_key=_authkey(),
+                                      snapshots=_default_snapshots(), sealer=_default_sealer()))
@@ -0,0 +1,195 @@
+"""
+Results cache keyed on what each election's results are built from
+
+Entries, rendered fragments and ETags are keyed on the election's latest
+vote block and, when tallies are read from the database, on the state of
+its CandidateTally rows. Blocks are sealed before their Vote rows commit,
+so a key built from the tip alone could hold, or an ETag vouch for, the
+count from before the commit.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Max, Sum
+from django.db.models.signals import post_delete, post_save
+
+from . import blockchain as chain_module
+from .blockchain import iter_votes
+
+# Fragment name used by the {% cache %} tag in results.html
+RESULTS_FRAGMENT = 'election_results'
+
+# Versions this process has cached entries under, per election
+_cached_versions: Dict[Any, Set[str]] = defaultdict(set)
+
+
+def results_cache():
+    """The cache backend configured by RESULTS_CACHE_ALIAS"""
+    return caches[getattr(settings, 'RESULTS_CACHE_ALIAS', 'default')]
+
+
+def election_tip_hash(election_id: int) -> str:
+    """Hash of the latest block holding a vote for the election"""
+    tip = chain_module.blockchain.election_tip(election_id)
+    return tip.hash if tip is not None else 'empty'
+
+
+def _tally_source() -> str:
+    return getattr(settings, 'RESULTS_TALLY_SOURCE', 'database')
+
+
+def _tally_state(election_id: int) -> Dict[str, Any]:
+    """When an election's CandidateTally rows last changed and their total"""
+    from .models import CandidateTally
+    return CandidateTally.objects.filter(election_id=election_id).aggregate(
+        updated=Max('updated_at'), votes=Sum('votes'))
+
+
+def _results_state(election_id: int, request=None) -> Tuple[str, Optional[datetime]]:
+    """
+    An election's results version and last change, read once per request.
+
+    The version is the election's tip hash, and with database tallies the
+    tally rows' last change and total as well; the last change is the
+    later of the tip's time and the rows'.
+    """
+    memo = request.__dict__.setdefault('_results_state', {}) if request is not None else {}
+    if election_id in memo:
+        return memo[election_id]
+    tip = chain_module.blockchain.election_tip(election_id)
+    version = tip.hash if tip is not None else 'empty'
+    times = [datetime.fromtimestamp(tip.timestamp, tz=dt_timezone.utc)] if tip is not None else []
+    if _tally_source() != 'chain':
+        state = _tally_state(election_id)
+        updated = state['updated'].timestamp() if state['updated'] is not None else 0
+        version = f"{version}:{updated:.6f}:{state['votes'] or 0}"
+        if state['updated'] is not None:
+            times.append(state['updated'])
+    memo[election_id] = version, max(times, default=None)
+    return memo[election_id]
+
+
+def results_version(election_id: int, request=None) -> str:
+    """Identifies the content of an election's results; pass the request to read it once per request"""
+    return _results_state(election_id, request)[0]
+
+
+def _keys(election_id: int, version: str) -> List[str]:
+    return [
+        f'results:tally:{election_id}:{version}',
+        f'results:data:{election_id}:{version}',
+        f'results:activity:{election_id}:{version}',
+        make_template_fragment_key(RESULTS_FRAGMENT, [election_id, version]),
+    ]
+
+
+def _load_tally(election_id: int) -> Dict[int, int]:
+    """Read a tally from the source named by RESULTS_TALLY_SOURCE"""
+    if _tally_source() == 'chain':
+        return chain_module.blockchain.tally(election_id)
+    from .models import Election
+    return Election(id=election_id).get_tally()
+
+
+def get_tally(election_id: int, version: Optional[str] = None) -> Dict[int, int]:
+    """Every candidate's vote count, cached until the election's results change"""
+    version = version or results_version(election_id)
+    _cached_versions[election_id].add(version)
+    return results_cache().get_or_set(
+        f'results:tally:{election_id}:{version}',
+        lambda: _load_tally(election_id),
+    )
+
+
+def get_results(election, version: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """Ranked results rows and the total vote count for an election, under a known version if given"""
+    version = version or results_version(election.id)
+    _cached_versions[election.id].add(version)
+    return results_cache().get_or_set(
+        f'results:data:{election.id}:{version}',
+        lambda: _compute_results(election, version),
+    )
+
+
+def get_activity(election, chain=None, version: Optional[str] = None) -> Dict[str, Any]:
+    """Votes over time and turnout for an election, cached until its results change"""
+    from .analytics import election_activity
+    version = version or results_version(election.id)
+    _cached_versions[election.id].add(version)
+    return results_cache().get_or_set(
+        f'results:activity:{election.id}:{version}',
+        lambda: election_activity(election, chain),
+    )
+
+
+def _compute_results(election, version: str) -> Tuple[List[Dict[str, Any]], int]:
+    tally = get_tally(election.id, version)
+    results_data = []
+    total_votes = 0
+    for candidate in election.candidates.all():
+        vote_count = tally.get(candidate.id, 0)
+        total_votes += vote_count
+        results_data.append({
+            'candidate': candidate,
+            'votes': vote_count,
+        })
+
+    # Calculate percentages
+    for result in results_data:
+        if total_votes > 0:
+            result['percentage'] = (result['votes'] / total_votes) * 100
+        else:
+            result['percentage'] = 0
+
+    # Sort by votes (descending)
+    results_data.sort(key=lambda x: x['votes'], reverse=True)
+    return results_data, total_votes
+
+
+def invalidate_election(election_id: int):
+    """Drop every entry this process cached for an election, and those under its current version"""
+    stale = _cached_versions.pop(election_id, set()) | {results_version(election_id)}
+    results_cache().delete_many([key for version in stale for key in _keys(election_id, version)])
+
+
+def invalidate_block(block):
+    """Drop cached entries for every election with a vote in a new block"""
+    for election_id in {vote.get('election_id') for vote in iter_votes(block)}:
+        invalidate_election(election_id)
+
+
+def _candidate_changed(sender, instance, **kwargs):
+    invalidate_election(instance.election_id)
+
+
+def _election_changed(sender, instance, **kwargs):
+    invalidate_election(instance.id)
+
+
+def install(chain=None):
+    """Invalidate the results cache whenever the chain gains a block or candidates change"""
+    from .models import Candidate, Election
+    (chain or chain_module.blockchain).add_listener(invalidate_block)
+    for model, receiver in [(Candidate, _candidate_changed), (Election, _election_changed)]:
+        post_save.connect(receiver, sender=model, dispatch_uid=f'results-cache-{model.__name__}-save')
+        post_delete.connect(receiver, sender=model, dispatch_uid=f'results-cache-{model.__name__}-delete')
+
+
+def results_etag(request, election_id: int, **kwargs):
+    """ETag for a results page; None while flash messages are waiting to be shown"""
+    if len(messages.get_messages(request)):
+        return None
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    return f'{results_version(election_id, request)}:{user_id}'
+
+
+def results_last_modified(request, election_id: int, **kwargs):
+    """Time of the election's latest vote block, or of its tally rows' last change when later"""
+    if len(messages.get_messages(request)):
+        return None
+    return _results_state(election_id, request)[1]
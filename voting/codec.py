@@ -0,0 +1,233 @@
+"""
+Binary block records and payload compression
+
+Ballot blocks are stored as fixed-width binary records instead of JSON:
+a header of the block's fields with hashes as raw digests, then one
+32-byte row per vote (voter, candidate and election ids and the cast time
+in microseconds, see columns.pack_vote). A single-vote block takes about
+a third of its JSON size. Blocks that do not fit the layout exactly (the
+genesis block, ad hoc data) stay JSON; decoding always yields the same
+Block, so hashes verify and to_dict() still gives JSON for display.
+
+Payloads may also be compressed with zlib, or with zstd when the
+``zstandard`` package is installed.
+"""
+import struct
+import zlib
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from .columns import pack_vote, unpack_vote
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+
+# Encoding in the low bits of a payload's codec byte, compression in the high bits
+CODEC_JSON = 0
+CODEC_BINARY = 1
+ENCODING_MASK = 0x0F
+COMPRESSION_FLAGS = {None: 0x00, 'zlib': 0x10, 'zstd': 0x20}
+COMPRESSION_MASK = 0xF0
+
+KIND_VOTE = 1  # one ballot
+KIND_BATCH = 2  # several ballots under a Merkle root
+
+# kind, hash version, index, timestamp, nonce, hash, previous hash
+BLOCK_HEADER = struct.Struct('<BBqdQ32s32s')
+# proof-of-work target, after the header of blocks that record one (hash version 3 on)
+TARGET = struct.Struct('<B')
+# voter id, candidate id, election id, cast time in microseconds
+VOTE = struct.Struct('<qqqq')
+BATCH = struct.Struct('<32sI')
+SEAL_LENGTH = struct.Struct('<H')
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _digest_bytes(value: Any) -> Optional[bytes]:
+    """The 32 raw bytes of a lowercase hex SHA-256 digest, or None"""
+    if not isinstance(value, str) or len(value) != 64:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return raw if raw.hex() == value else None
+
+
+def _seal_bytes(seal: Any) -> Optional[bytes]:
+    """A ``<scheme>:<hex signature>`` seal with the signature as raw bytes, or None"""
+    if not isinstance(seal, str):
+        return None
+    scheme, separator, signature = seal.partition(':')
+    try:
+        raw = bytes.fromhex(signature)
+    except ValueError:
+        return None
+    if not separator or not scheme.isascii() or raw.hex() != signature:
+        return None
+    return scheme.encode() + b':' + raw
+
+
+def _seal_text(seal: bytes) -> str:
+    scheme, _, signature = seal.partition(b':')
+    return f'{scheme.decode()}:{signature.hex()}'
+
+
+def encode_block(block) -> Optional[bytes]:
+    """A binary record that decode_block() turns back into an identical block, or None"""
+    digest = _digest_bytes(block.hash)
+    previous = _digest_bytes(block.previous_hash)
+    if (digest is None or previous is None
+            or type(block.index) is not int or not 0 <= block.index < 2 ** 63
+            or type(block.timestamp) is not float
+            or type(block.nonce) is not int or not 0 <= block.nonce < 2 ** 64
+            or type(block.version) is not int or not 0 <= block.version < 256):
+        return None
+    target = b''
+    if block.target is not None:
+        if type(block.target) is not int or not 0 <= block.target < 256:
+            return None
+        target = TARGET.pack(block.target)
+    seal = b''
+    if block.seal is not None:
+        seal = _seal_bytes(block.seal)
+        if seal is None or len(seal) >= 2 ** 16:
+            return None
+
+    data = block.data
+    if not isinstance(data, dict):
+        return None
+    if data.keys() == {'votes', 'merkle_root'} and isinstance(data['votes'], list):
+        merkle_root = _digest_bytes(data['merkle_root'])
+        rows = [pack_vote(vote) if isinstance(vote, dict) else None for vote in data['votes']]
+        if merkle_root is None or not rows or None in rows:
+            return None
+        kind, body = KIND_BATCH, BATCH.pack(merkle_root, len(rows))
+    else:
+        rows = [pack_vote(data)]
+        if rows[0] is None:
+            return None
+        kind, body = KIND_VOTE, b''
+
+    return b''.join([
+        BLOCK_HEADER.pack(kind, block.version, block.index, block.timestamp, block.nonce, digest, previous),
+        target,
+        body,
+        *(VOTE.pack(*row) for row in rows),
+        SEAL_LENGTH.pack(len(seal)), seal,
+    ])
+
+
+def decode_block(payload: bytes):
+    """Rebuild a block from encode_block() output"""
+    from .blockchain import TARGET_HASH_VERSION, Block
+    kind, version, index, timestamp, nonce, digest, previous = BLOCK_HEADER.unpack_from(payload)
+    offset = BLOCK_HEADER.size
+    target = None
+    if version >= TARGET_HASH_VERSION:
+        (target,) = TARGET.unpack_from(payload, offset)
+        offset += TARGET.size
+    if kind == KIND_BATCH:
+        merkle_root, count = BATCH.unpack_from(payload, offset)
+        offset += BATCH.size
+    elif kind == KIND_VOTE:
+        count = 1
+    else:
+        raise ValueError(f'unknown binary block kind {kind}')
+    votes = [unpack_vote(*row) for row in VOTE.iter_unpack(payload[offset:offset + count * VOTE.size])]
+    offset += count * VOTE.size
+    (seal_length,) = SEAL_LENGTH.unpack_from(payload, offset)
+    offset += SEAL_LENGTH.size
+
+    block = Block.from_dict({
+        'index': index,
+        'timestamp': timestamp,
+        'data': votes[0] if kind == KIND_VOTE else {'votes': votes, 'merkle_root': merkle_root.hex()},
+        'previous_hash': previous.hex(),
+        'nonce': nonce,
+        'version': version,
+        'target': target,
+        'hash': digest.hex(),
+    })
+    if seal_length:
+        block.seal = _seal_text(bytes(payload[offset:offset + seal_length]))
+    return block
+
+
+def check_compression(method: Optional[str]):
+    """Raise ValueError for an unknown method, ImportError when zstd is not installed"""
+    if method not in COMPRESSION_FLAGS:
+        raise ValueError(f'unknown compression {method!r}; use None, zlib or zstd')
+    if method == 'zstd' and zstandard is None:
+        raise ImportError('zstd compression requires the zstandard package')
+
+
+def compress(payload: bytes, method: Optional[str], level: int = -1) -> Tuple[int, bytes]:
+    """Compression flag and bytes, leaving payloads that would not shrink as they are"""
+    if method is None:
+        return 0, payload
+    if method == 'zlib':
+        compressed = zlib.compress(payload, level)
+    else:
+        compressed = zstandard.ZstdCompressor(level=3 if level < 0 else level).compress(payload)
+    if len(compressed) >= len(payload):
+        return 0, payload
+    return COMPRESSION_FLAGS[method], compressed
+
+
+def decompress(payload: bytes, flag: int) -> bytes:
+    if flag == COMPRESSION_FLAGS[None]:
+        return payload
+    if flag == COMPRESSION_FLAGS['zlib']:
+        return zlib.decompress(payload)
+    if flag == COMPRESSION_FLAGS['zstd']:
+        if zstandard is None:
+            raise IOError('reading zstd-compressed records requires the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise IOError(f'unknown record compression {flag:#x}')
+
+
+def compress_stream(chunks: Iterable[bytes], method: str) -> Iterator[bytes]:
+    """Compress a byte stream incrementally, as one zlib or zstd frame"""
+    check_compression(method)
+    compressor = zlib.compressobj() if method == 'zlib' else zstandard.ZstdCompressor().compressobj()
+    return _compressed(chunks, compressor)
+
+
+def _compressed(chunks: Iterable[bytes], compressor) -> Iterator[bytes]:
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def decompress_lines(stream, size: int = 1 << 16) -> Iterator[str]:
+    """
+    Text lines of a binary stream that may be zlib- or zstd-compressed.
+
+    The format is recognized from the first bytes; data is decompressed
+    incrementally, so memory stays bounded however large the stream is.
+    """
+    head = stream.read(4)
+    if head[:1] == b'\x78':
+        decompressor = zlib.decompressobj()
+    elif head == ZSTD_MAGIC:
+        if zstandard is None:
+            raise IOError('reading a zstd-compressed export requires the zstandard package')
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = None
+
+    pending = b''
+    chunk = head
+    while chunk:
+        pending += decompressor.decompress(chunk) if decompressor is not None else chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8') + '\n'
+        chunk = stream.read(size)
+    if pending:
+        yield pending.decode('utf-8')
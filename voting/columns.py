@@ -0,0 +1,164 @@
+"""
+Columnar vote storage: one typed array per vote field
+"""
+from array import array
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; the arrays work without it
+    numpy = None
+
+# Keys of a ballot as submitted by the pipeline
+VOTE_FIELDS = frozenset(['voter_id', 'candidate_id', 'election_id', 'timestamp'])
+
+# Stands in for a field a vote does not carry
+MISSING = -1
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def timestamp_to_micros(value: Any) -> Optional[int]:
+    """
+    Microseconds since the epoch for a ballot timestamp.
+
+    Ballots carry ``str(timezone.now())``; numbers are read as epoch
+    seconds. Returns None for anything else.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return round(value * 1_000_000)
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            return round(float(value) * 1_000_000)
+        except ValueError:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+@lru_cache(maxsize=4096)
+def _second_text(seconds: int) -> str:
+    return str(EPOCH + timedelta(seconds=seconds))[:-len('+00:00')]
+
+
+def micros_to_timestamp(micros: int) -> str:
+    """The ``str(timezone.now())`` form of a UTC time in microseconds"""
+    # Formatting a datetime dominates decoding; ballots in a block share their second
+    seconds, fraction = divmod(micros, 1_000_000)
+    if fraction:
+        return f'{_second_text(seconds)}.{fraction:06d}+00:00'
+    return f'{_second_text(seconds)}+00:00'
+
+
+def pack_vote(vote: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Column values for a ballot that unpack_vote() reproduces exactly.
+
+    Returns None when the vote has other keys, non-integer ids or a
+    timestamp that would not survive the round trip; such votes must be
+    stored some other way wherever exactness matters (block hashes cover
+    the exact data).
+    """
+    if vote.keys() != VOTE_FIELDS:
+        return None
+    ids = (vote['voter_id'], vote['candidate_id'], vote['election_id'])
+    if not all(type(value) is int and 0 <= value < 2 ** 63 for value in ids):
+        return None
+    micros = timestamp_to_micros(vote['timestamp'])
+    if micros is None or micros_to_timestamp(micros) != vote['timestamp']:
+        return None
+    return ids + (micros,)
+
+
+def unpack_vote(voter_id: int, candidate_id: int, election_id: int, cast_at: int) -> Dict[str, Any]:
+    return {
+        'voter_id': voter_id,
+        'candidate_id': candidate_id,
+        'election_id': election_id,
+        'timestamp': micros_to_timestamp(cast_at),
+    }
+
+
+def _column_value(value: Any) -> int:
+    return value if type(value) is int else MISSING
+
+
+class VoteColumns:
+    """
+    Votes as parallel arrays of signed 64-bit integers, one row per vote.
+
+    Holds voter, candidate and election ids and the cast time in
+    microseconds since the epoch; fields a vote does not carry are MISSING.
+    That is 32 bytes per vote, and the arrays are contiguous so scans can
+    run over them directly, or over NumPy arrays from as_numpy().
+    """
+
+    FIELDS = ('voter_id', 'candidate_id', 'election_id', 'cast_at')
+
+    def __init__(self):
+        self.voter_id = array('q')
+        self.candidate_id = array('q')
+        self.election_id = array('q')
+        self.cast_at = array('q')
+
+    @classmethod
+    def from_blocks(cls, blocks: Iterable) -> 'VoteColumns':
+        """Collect the votes of a sequence of blocks, in chain order"""
+        from .blockchain import iter_votes
+        columns = cls()
+        for block in blocks:
+            for vote in iter_votes(block):
+                columns.append(vote)
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.voter_id)
+
+    def append(self, vote: Dict[str, Any]):
+        """Add a vote, recording MISSING for absent or non-integer fields"""
+        cast_at = timestamp_to_micros(vote.get('timestamp'))
+        self.append_row(_column_value(vote.get('voter_id')), _column_value(vote.get('candidate_id')),
+                        _column_value(vote.get('election_id')), MISSING if cast_at is None else cast_at)
+
+    def append_row(self, voter_id: int, candidate_id: int, election_id: int, cast_at: int):
+        self.voter_id.append(voter_id)
+        self.candidate_id.append(candidate_id)
+        self.election_id.append(election_id)
+        self.cast_at.append(cast_at)
+
+    def row(self, index: int) -> Tuple[int, int, int, int]:
+        """One vote's column values"""
+        return (self.voter_id[index], self.candidate_id[index],
+                self.election_id[index], self.cast_at[index])
+
+    def nbytes(self) -> int:
+        """Bytes held by the arrays' buffers"""
+        return sum(len(column) * column.itemsize for column in self.arrays().values())
+
+    def arrays(self) -> Dict[str, array]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def as_numpy(self) -> Dict[str, Any]:
+        """
+        NumPy arrays of the columns as of this call.
+
+        Each column is copied once (a memcpy) and wrapped without further
+        copying: a view straight onto a live array would stop it growing,
+        since arrays cannot resize while they export their buffer. Raises
+        ImportError when NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('VoteColumns.as_numpy() requires NumPy')
+        # cast_at is appended last, so every column has at least this many rows
+        rows = len(self.cast_at)
+        return {field: numpy.frombuffer(column[:rows], dtype=numpy.int64)
+                for field, column in self.arrays().items()}
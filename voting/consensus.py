@@ -0,0 +1,292 @@
+"""
+Block sealing strategies
+
+A sealer finishes a block whose contents and link are fixed, setting its
+nonce and hash and, for an authority, its seal, and checks the seal of a
+stored block. BLOCKCHAIN_CONSENSUS picks one:
+
+- ``pow``: proof of work at a fixed difficulty (the original scheme)
+- ``adaptive-pow``: proof of work retuned towards a target block time
+- ``hmac``: a single authority signs each block's hash with HMAC-SHA256
+- ``ed25519``: a single authority signs each block's hash with Ed25519,
+  so verifiers only need the public key
+
+Authority seals cost one hash and one signature per block instead of a
+nonce search. Sealers are pickled into verification worker processes,
+so they carry keys and settings but not miners.
+"""
+import abc
+import hashlib
+import hmac
+import logging
+from typing import Optional
+
+from .mining import SequentialMiner
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+except ImportError:  # cryptography is only needed for Ed25519 seals
+    Ed25519PrivateKey = Ed25519PublicKey = InvalidSignature = None
+
+logger = logging.getLogger(__name__)
+
+
+def pow_fault(block, difficulty: int) -> Optional[str]:
+    """Why a block's hash misses a proof-of-work target, or None"""
+    if not block.hash.startswith('0' * difficulty):
+        return f'hash does not meet difficulty {difficulty}'
+    return None
+
+
+def work_fault(block, min_difficulty: int) -> Optional[str]:
+    """
+    Why a block's proof of work does not verify, or None.
+
+    Blocks with a recorded target must meet it and carry at least
+    ``min_difficulty``; older blocks are checked against the minimum.
+    """
+    if block.target is None:
+        return pow_fault(block, min_difficulty)
+    if block.target < min_difficulty:
+        return f'target {block.target} is below the minimum difficulty {min_difficulty}'
+    return pow_fault(block, block.target)
+
+
+class ProofOfWork:
+    """
+    Seals a block by searching for a nonce whose hash has ``difficulty`` leading zero hex digits.
+
+    The difficulty is recorded as the block's target in its hashed header
+    and each block is verified against its own target, so raising the
+    difficulty leaves earlier blocks valid. No block may carry less than
+    ``min_difficulty`` (the difficulty itself by default, and never more
+    than the difficulty blocks are sealed at).
+    """
+
+    name = 'pow'
+
+    def __init__(self, difficulty: int = 2, miner=None, min_difficulty: Optional[int] = None):
+        self.min_difficulty = difficulty if min_difficulty is None else min_difficulty
+        self.difficulty = difficulty
+        self.miner = miner if miner is not None else SequentialMiner()
+
+    @property
+    def difficulty(self) -> int:
+        return self._difficulty
+
+    @difficulty.setter
+    def difficulty(self, value: int):
+        self._difficulty = value
+        # Blocks sealed at this difficulty must verify
+        self.min_difficulty = min(self.min_difficulty, value)
+
+    def __getstate__(self):
+        # Verifying workers only need the targets; the miner stays in this process
+        state = self.__dict__.copy()
+        state['miner'] = None
+        return state
+
+    def next_target(self, block, previous) -> int:
+        """The difficulty to seal a new block at"""
+        return self.difficulty
+
+    def seal(self, block, previous=None):
+        """Record the block's target and find its nonce and hash"""
+        from .blockchain import LEGACY_HASH_VERSION
+        if block.version == LEGACY_HASH_VERSION:
+            target = '0' * self.difficulty
+            block.nonce = 0
+            block.hash = block.calculate_hash()
+            while not block.hash.startswith(target):
+                block.nonce += 1
+                block.hash = block.calculate_hash()
+            return block
+
+        difficulty = self.difficulty
+        if block.target is not None:
+            block.target = difficulty = self.next_target(block, previous)
+        # The miner hashes the header once and only feeds nonce bytes per attempt
+        block.nonce, block.hash = self.miner.mine(block.header_prefix(), difficulty)
+        return block
+
+    def fault(self, block, previous=None) -> Optional[str]:
+        """Why a block's seal does not verify, or None; its hash is already known to match"""
+        return work_fault(block, self.min_difficulty)
+
+    def close(self):
+        if self.miner is not None:
+            self.miner.close()
+
+
+class AdaptiveProofOfWork(ProofOfWork):
+    """
+    Proof of work whose difficulty follows a target block time.
+
+    Each block's target follows from its parent's: every extra hex digit
+    multiplies the work by 16, so the target goes up one when the time
+    between the two blocks' timestamps is under twice ``target_seconds``
+    even at sixteen times the work, and down one when it is over twice
+    the target, within [min_difficulty, max_difficulty]. Verifiers
+    recompute the rule from the parent, so a rewritten history cannot
+    drop to the minimum; a block may carry more work than the rule asks,
+    never less.
+    """
+
+    name = 'adaptive-pow'
+
+    def __init__(self, target_seconds: float, difficulty: int = 2, miner=None,
+                 min_difficulty: int = 1, max_difficulty: int = 8):
+        super().__init__(difficulty, miner, min_difficulty)
+        self.target_seconds = target_seconds
+        self.max_difficulty = max(max_difficulty, self.min_difficulty)
+        self.difficulty = min(max(difficulty, self.min_difficulty), self.max_difficulty)
+
+    def required_target(self, previous, timestamp: float) -> int:
+        """The least target the retarget rule allows for a block after ``previous``"""
+        if previous is None or previous.index == 0 or previous.target is None:
+            # Nothing to retarget from: the genesis block or one sealed before targets were recorded
+            return self.min_difficulty
+        target = min(max(previous.target, self.min_difficulty), self.max_difficulty)
+        interval = timestamp - previous.timestamp
+        if interval * 16 < self.target_seconds * 2 and target < self.max_difficulty:
+            return target + 1
+        if interval > self.target_seconds * 2 and target > self.min_difficulty:
+            return target - 1
+        return target
+
+    def next_target(self, block, previous) -> int:
+        if previous is None or previous.index == 0 or previous.target is None:
+            target = self.difficulty
+        else:
+            target = self.required_target(previous, block.timestamp)
+            if target != previous.target:
+                logger.info('Proof-of-work difficulty %d -> %d (block interval %.3fs, target %.3fs)',
+                            previous.target, target, block.timestamp - previous.timestamp,
+                            self.target_seconds)
+        self.difficulty = target
+        return target
+
+    def fault(self, block, previous=None) -> Optional[str]:
+        fault = work_fault(block, self.min_difficulty)
+        if fault is not None or block.target is None or previous is None:
+            return fault
+        if block.timestamp < previous.timestamp:
+            return 'timestamp is earlier than the preceding block'
+        required = self.required_target(previous, block.timestamp)
+        if block.target < required:
+            return f'target {block.target} is below the {required} the retarget rule requires'
+        return None
+
+
+class Authority(abc.ABC):
+    """
+    Base for sealers where one operator signs each block's hash.
+
+    The hash is computed once with a zero nonce and the signature is kept
+    in the block's ``seal`` as ``<scheme>:<hex signature>``; the hash
+    does not cover the seal, the seal covers the hash. Blocks below
+    ``since`` predate the authority and are checked as proof of work of
+    at least ``difficulty``, so an existing chain can switch over.
+    """
+
+    name = 'authority'
+
+    def __init__(self, since: int = 1, difficulty: int = 2):
+        self.since = since
+        self.difficulty = difficulty
+
+    @abc.abstractmethod
+    def sign(self, digest: bytes) -> bytes:
+        """Sign a block hash"""
+
+    @abc.abstractmethod
+    def verify(self, digest: bytes, signature: bytes) -> bool:
+        """Check a signature over a block hash"""
+
+    def seal(self, block, previous=None):
+        """Hash the block once and sign the hash; no work, so a recorded target stays 0"""
+        block.nonce = 0
+        block.hash = block.calculate_hash()
+        block.seal = f'{self.name}:{self.sign(bytes.fromhex(block.hash)).hex()}'
+        return block
+
+    def fault(self, block, previous=None) -> Optional[str]:
+        if block.index < self.since:
+            return work_fault(block, self.difficulty)
+        scheme, _, signature = (block.seal or '').partition(':')
+        if scheme != self.name:
+            return f'block is not sealed by the {self.name} authority'
+        try:
+            valid = self.verify(bytes.fromhex(block.hash), bytes.fromhex(signature))
+        except ValueError:
+            valid = False
+        return None if valid else 'seal does not verify'
+
+    def close(self):
+        """Nothing to release for a signing authority"""
+
+
+class HmacAuthority(Authority):
+    """Seals blocks with HMAC-SHA256 under a key shared by the writer and every verifier"""
+
+    name = 'hmac-sha256'
+
+    def __init__(self, key: bytes, since: int = 1, difficulty: int = 2):
+        super().__init__(since, difficulty)
+        if not key:
+            raise ValueError('HMAC sealing needs a non-empty key')
+        self.key = key
+
+    def sign(self, digest: bytes) -> bytes:
+        return hmac.new(self.key, digest, hashlib.sha256).digest()
+
+    def verify(self, digest: bytes, signature: bytes) -> bool:
+        return hmac.compare_digest(self.sign(digest), signature)
+
+
+class Ed25519Authority(Authority):
+    """
+    Seals blocks with an Ed25519 signature.
+
+    Keys are raw 32-byte values. Verifiers need only the public key; it
+    is derived from the private key when not given. Requires the
+    ``cryptography`` package.
+    """
+
+    name = 'ed25519'
+
+    def __init__(self, private_key: Optional[bytes] = None, public_key: Optional[bytes] = None,
+                 since: int = 1, difficulty: int = 2):
+        super().__init__(since, difficulty)
+        if Ed25519PrivateKey is None:
+            raise ImportError('Ed25519 sealing requires the cryptography package')
+        if private_key is None and public_key is None:
+            raise ValueError('Ed25519 sealing needs a private or a public key')
+        if public_key is None:
+            public_key = Ed25519PrivateKey.from_private_bytes(private_key).public_key().public_bytes_raw()
+        self.private_key = private_key
+        self.public_key = public_key
+        self._signer = self._verifier = None
+
+    def __getstate__(self):
+        # Key objects do not pickle; workers rebuild them from the raw bytes
+        state = self.__dict__.copy()
+        state['_signer'] = state['_verifier'] = None
+        return state
+
+    def sign(self, digest: bytes) -> bytes:
+        if self.private_key is None:
+            raise ValueError('this Ed25519 authority only holds a public key and cannot seal blocks')
+        if self._signer is None:
+            self._signer = Ed25519PrivateKey.from_private_bytes(self.private_key)
+        return self._signer.sign(digest)
+
+    def verify(self, digest: bytes, signature: bytes) -> bool:
+        if self._verifier is None:
+            self._verifier = Ed25519PublicKey.from_public_bytes(self.public_key)
+        try:
+            self._verifier.verify(signature, digest)
+        except InvalidSignature:
+            return False
+        return True
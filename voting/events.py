@@ -0,0 +1,172 @@
+"""
+Publish/subscribe of tally updates for live results
+"""
+import asyncio
+import threading
+from collections import Counter
+from time import monotonic
+from typing import Any, Dict, Set
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import blockchain as chain_module
+from .blockchain import iter_votes
+
+
+def election_channel(election_id: int) -> str:
+    """Channel carrying tally updates for one election"""
+    return f'election:{election_id}'
+
+
+class Subscription:
+    """A subscriber's bounded queue of messages, bound to its event loop"""
+
+    def __init__(self, channel: str, maxsize: int = 100):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def offer(self, message: Dict[str, Any]):
+        """Queue a message from any thread, dropping the oldest when full"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The subscriber's event loop has already shut down
+            pass
+
+    def _put(self, message: Dict[str, Any]):
+        if self.queue.full():
+            # Every message carries the full tally, so a slow reader loses nothing
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self) -> Dict[str, Any]:
+        """Wait for the next message"""
+        return await self.queue.get()
+
+
+class Broker:
+    """Interface for fanning tally updates out to subscribers"""
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        """Deliver a message to every subscriber of a channel; callable from any thread"""
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> Subscription:
+        """Start receiving a channel's messages on the running event loop"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stop delivering messages to a subscription"""
+        raise NotImplementedError
+
+    def has_subscribers(self, channel: str) -> bool:
+        """Whether a message on a channel would reach anyone; brokers that cannot tell say True"""
+        return True
+
+
+class InProcessBroker(Broker):
+    """
+    Delivers messages to subscribers in this process, with no external broker.
+
+    Publishing is thread-safe, so the chain's writer thread can publish
+    straight into the queues of subscribers running on an event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.offer(message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.channel, None)
+
+    def has_subscribers(self, channel: str) -> bool:
+        with self._lock:
+            return bool(self._subscribers.get(channel))
+
+
+_broker = None
+
+
+def get_broker() -> Broker:
+    """The broker class named by VOTING_EVENT_BROKER, created once per process"""
+    global _broker
+    if _broker is None:
+        broker_class = getattr(settings, 'VOTING_EVENT_BROKER', 'voting.events.InProcessBroker')
+        _broker = import_string(broker_class)()
+    return _broker
+
+
+def tally_message(chain, election_id: int, block=None, delta=None) -> Dict[str, Any]:
+    """Build the message sent to results subscribers"""
+    tally = chain.tally(election_id)
+    return {
+        'election_id': election_id,
+        'block_index': block.index if block is not None else None,
+        'block_hash': block.hash if block is not None else None,
+        'delta': {str(candidate_id): votes for candidate_id, votes in (delta or {}).items()},
+        'tally': {str(candidate_id): votes for candidate_id, votes in tally.items()},
+        'total': sum(tally.values()),
+    }
+
+
+def publish_block(block, chain=None):
+    """Publish one tally delta per election with votes in a new block"""
+    chain = chain if chain is not None else chain_module.blockchain
+    deltas: Dict[Any, Counter] = {}
+    for vote in iter_votes(block):
+        if vote.get('election_id') is not None:
+            deltas.setdefault(vote['election_id'], Counter())[vote['candidate_id']] += 1
+
+    broker = get_broker()
+    for election_id, delta in deltas.items():
+        channel = election_channel(election_id)
+        # Reading the tally is the costly part; skip elections nobody is watching
+        if broker.has_subscribers(channel):
+            broker.publish(channel, tally_message(chain, election_id, block, delta))
+
+
+_polled = 0.0
+_poll_lock = threading.Lock()
+
+
+def poll_chain(chain=None, interval: float = 1.0) -> int:
+    """
+    Refresh a read-only view of the writer process's chain, announcing its new blocks.
+
+    Every open results stream polls, but the view is refreshed at most
+    once per interval across them. Returns the number of new blocks.
+    """
+    global _polled
+    chain = chain if chain is not None else chain_module.blockchain
+    with _poll_lock:
+        now = monotonic()
+        if now - _polled < interval:
+            return 0
+        _polled = now
+    return chain.refresh()
+
+
+def install(chain=None):
+    """Publish tally deltas whenever the chain gains a block, if the live results stream is served"""
+    if not getattr(settings, 'VOTING_ASYNC_VIEWS', False):
+        return
+    chain = chain if chain is not None else chain_module.blockchain
+    chain.add_listener(lambda block: publish_block(block, chain))
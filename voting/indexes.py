@@ -0,0 +1,130 @@
+"""
+In-memory lookup structures maintained alongside the blockchain
+"""
+import hashlib
+import math
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter using double hashing over a BLAKE2b digest.
+
+    Membership tests never return a false negative, and return a false
+    positive with roughly ``error_rate`` probability while no more than
+    ``capacity`` keys have been added.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, key: bytes):
+        """Add a key to the filter"""
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def copy(self) -> 'BloomFilter':
+        return BloomFilter.from_bits(self.capacity, self.error_rate, self.bits, self.count)
+
+    @classmethod
+    def from_bits(cls, capacity: int, error_rate: float, bits, count: int) -> 'BloomFilter':
+        """Rebuild a filter from its parameters and bit array"""
+        bloom = cls(capacity, error_rate)
+        if len(bits) != len(bloom.bits):
+            raise ValueError('Bloom filter bit array does not match its parameters')
+        bloom.bits = bytearray(bits)
+        bloom.count = count
+        return bloom
+
+
+class VoterIndex:
+    """
+    Index of who has voted, keyed by (election_id, voter_id).
+
+    A Bloom filter sits in front of the exact sets, so the common case
+    during voting, a voter who has not voted yet, is answered without
+    touching the sets. The filter is rebuilt at twice the size whenever it
+    fills up, keeping its false-positive rate bounded.
+    """
+
+    def __init__(self, capacity: int = 100000):
+        self._ballots: Set[Tuple[Any, Any]] = set()
+        # The same ballots in the order recorded; only ever appended to
+        self._order: List[Tuple[Any, Any]] = []
+        self._voters: Set[Any] = set()
+        self._bloom = BloomFilter(capacity)
+
+    @staticmethod
+    def _key(election_id, voter_id) -> bytes:
+        return f'{election_id}:{voter_id}'.encode()
+
+    def add(self, voter_id, election_id=None):
+        """Record that a voter cast a ballot in an election"""
+        if (election_id, voter_id) in self._ballots:
+            return
+        if self._bloom.count >= self._bloom.capacity:
+            self._grow()
+        self._ballots.add((election_id, voter_id))
+        self._order.append((election_id, voter_id))
+        self._voters.add(voter_id)
+        self._bloom.add(self._key(election_id, voter_id))
+
+    def _grow(self):
+        self._bloom = BloomFilter(self._bloom.capacity * 2, self._bloom.error_rate)
+        for election_id, voter_id in self._ballots:
+            self._bloom.add(self._key(election_id, voter_id))
+
+    def has_voted(self, voter_id, election_id: Optional[Any] = None) -> bool:
+        """Check whether a voter has voted, in one election or in any"""
+        if election_id is None:
+            return voter_id in self._voters
+        if self._key(election_id, voter_id) not in self._bloom:
+            return False
+        return (election_id, voter_id) in self._ballots
+
+    def __len__(self) -> int:
+        return len(self._ballots)
+
+    def capture(self) -> Callable[[], Tuple[Set[Tuple[Any, Any]], BloomFilter]]:
+        """
+        Mark the index as it stands, in constant time; the returned function copies it later.
+
+        The copy holds exactly the ballots recorded up to now, even if more
+        are added in between. The filter's bits are read when copying and
+        may also cover later ballots; a restored index adds those again, and
+        the extra bits only cost false positives that the sets answer.
+        """
+        order, recorded = self._order, len(self._order)
+        bloom, count = self._bloom, self._bloom.count
+
+        def copy():
+            return (set(order[:recorded]),
+                    BloomFilter.from_bits(bloom.capacity, bloom.error_rate, bloom.bits, count))
+        return copy
+
+    @classmethod
+    def restore(cls, ballots: Set[Tuple[Any, Any]], bloom: BloomFilter) -> 'VoterIndex':
+        """Rebuild an index from a captured copy without rehashing every ballot"""
+        index = cls.__new__(cls)
+        index._ballots = ballots
+        index._order = list(ballots)
+        index._voters = {voter_id for _, voter_id in ballots}
+        index._bloom = bloom
+        return index
@@ -0,0 +1,63 @@
+"""
+Synthetic vote load for benchmarking the chain
+"""
+import random
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List
+
+from .blockchain import Blockchain
+
+
+def synthetic_votes(count: int, elections: int = 1, candidates: int = 3,
+                    first_voter: int = 1, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Yield count ballots from distinct voter ids starting at first_voter.
+
+    Elections are numbered from 1 and candidate ids are unique across
+    elections, so tallies of different elections never share a key.
+    Candidates are chosen uniformly from a seeded generator, so the same
+    arguments always produce the same ballots.
+    """
+    rng = random.Random(seed)
+    for offset in range(count):
+        election = offset % elections
+        yield {
+            'voter_id': first_voter + offset,
+            'candidate_id': election * candidates + rng.randrange(candidates) + 1,
+            'election_id': election + 1,
+            'timestamp': str(datetime.now(timezone.utc)),
+        }
+
+
+def fill_chain(chain: Blockchain, count: int, batch_size: int = 100, progress=None,
+               **options) -> int:
+    """
+    Append count synthetic votes to a chain, batch_size votes per block.
+
+    Voter ids continue after the votes already on the chain, so a filled
+    chain can be topped up. Calls progress(votes_written) after each block
+    and returns the number of votes written.
+    """
+    votes = synthetic_votes(count, first_voter=chain.get_total_votes() + 1, **options)
+    written = 0
+    batch: List[Dict[str, Any]] = []
+    for vote in votes:
+        batch.append(vote)
+        if len(batch) == batch_size:
+            written += _seal(chain, batch)
+            batch = []
+            if progress is not None:
+                progress(written)
+    if batch:
+        written += _seal(chain, batch)
+        if progress is not None:
+            progress(written)
+    return written
+
+
+def _seal(chain: Blockchain, batch: List[Dict[str, Any]]) -> int:
+    if len(batch) == 1:
+        chain.add_block(batch[0])
+    else:
+        chain.add_batch(batch)
+    return len(batch)
@@ -0,0 +1,66 @@
+import sys
+import time
+import zlib
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.audit import audit_export, database_tally, tally_differences
+from voting.blockchain import _default_sealer
+from voting.codec import decompress_lines
+from voting.consensus import ProofOfWork
+
+
+class Command(BaseCommand):
+    help = ('Verify an exported blockchain (NDJSON from /blockchain/export/), its election shards and '
+            'their anchors, and diff its tally against the Vote table')
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', help="Path to the exported chain, plain or zlib/zstd-compressed, "
+                                           "or '-' for standard input")
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Verifying processes (default: one per CPU)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Blocks verified per task (default 5000)')
+        parser.add_argument('--difficulty', type=int, default=None,
+                            help='Check proof of work at this difficulty instead of the configured sealer')
+        parser.add_argument('--db-chunk-size', type=int, default=2000,
+                            help='Vote rows fetched per round trip (default 2000)')
+        parser.add_argument('--skip-database', action='store_true',
+                            help='Only verify the chain; do not compare with the Vote table')
+
+    def handle(self, *args, **options):
+        for name in ['chunk_size', 'db_chunk_size']:
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+
+        # Verifying needs no miner; an authority's keys come from settings
+        sealer = ProofOfWork(options['difficulty']) if options['difficulty'] is not None else _default_sealer()
+        started = time.perf_counter()
+        stream = sys.stdin.buffer if options['export'] == '-' else open(options['export'], 'rb')
+        try:
+            result = audit_export(decompress_lines(stream), sealer, options['workers'], options['chunk_size'])
+        except (IOError, zlib.error) as error:
+            raise CommandError(f'Cannot read the export: {error}')
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Verified {result['blocks']} block(s) holding {result['votes']} vote(s) "
+                          f"({result['blocks'] / elapsed:.0f} blocks/sec)")
+        if result['failure'] is not None:
+            shard, index, reason = result['failure']
+            where = f'Block {index}' if shard is None else f'Block {index} of the election {shard} shard'
+            raise CommandError(f'{where} is invalid: {reason}')
+
+        if options['skip_database']:
+            self.stdout.write(self.style.SUCCESS('Chain verified'))
+            return
+        differences = tally_differences(database_tally(options['db_chunk_size']), result['tally'])
+        if not differences:
+            self.stdout.write(self.style.SUCCESS('Chain verified; its tally matches the Vote table'))
+            return
+        election_id, candidate_id, database, chain = differences[0]
+        raise CommandError(
+            f'First divergence: election {election_id}, candidate {candidate_id}: '
+            f'database {database}, blockchain {chain} '
+            f'({len(differences)} differing count(s) in all)')
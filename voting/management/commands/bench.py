@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.benchmarks import SUITES, run_benchmarks
+
+
+def _int_list(value):
+    try:
+        return [int(item) for item in value.split(',') if item]
+    except ValueError:
+        raise CommandError(f'Expected comma-separated integers, got {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hashing, mining, chain operations and the vote/results views; writes JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', action='append', choices=SUITES,
+                            help='Run only this suite (repeatable; default: all)')
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Chain lengths to sweep, e.g. 1000,10000,100000,1000000')
+        parser.add_argument('--candidates', default='3,50', help='Candidate counts to sweep')
+        parser.add_argument('--difficulties', default='1,2,3,4', help='Proof-of-work difficulties to time')
+        parser.add_argument('--store', choices=['file', 'memory', 'compact'], default='file',
+                            help='Block store for the chain sweep (default file)')
+        parser.add_argument('--chain-difficulty', type=int, default=0,
+                            help='Difficulty used while building the sweep chains (default 0)')
+        parser.add_argument('--voters', type=int, default=200, help='Votes cast in the views suite')
+        parser.add_argument('--repeat', type=int, default=5, help='Samples per measurement')
+        parser.add_argument('--output', '-o', default=None,
+                            help='Write the JSON report to this file instead of standard output')
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(
+            suites=options['suite'] or SUITES,
+            sizes=_int_list(options['sizes']),
+            candidates=_int_list(options['candidates']),
+            difficulties=_int_list(options['difficulties']),
+            store=options['store'],
+            chain_difficulty=options['chain_difficulty'],
+            voters=options['voters'],
+            repeat=options['repeat'],
+            progress=lambda suite: self.stderr.write(f'Running {suite} benchmarks...'),
+        )
+        output = json.dumps(report, indent=2)
+        if options['output'] is None:
+            self.stdout.write(output)
+            return
+        with open(options['output'], 'w') as f:
+            f.write(output + '\n')
+        for result in report['results']:
+            params = ', '.join(f'{key}={value}' for key, value in result['params'].items())
+            self.stdout.write(f"{result['name']:<28} {params:<50} {result['median'] * 1e6:>12.1f} us")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['results'])} result(s) to {options['output']}"))
@@ -0,0 +1,54 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from voting import blockchain as chain_module
+from voting.batching import VoteBatcher
+from voting.blockchain import Blockchain
+from voting.pipeline import recover_votes
+from voting.sharding import ShardedBatcher, ShardedLedger
+from voting.storage import FileBlockStore
+from voting.writer import ChainWriterServer
+
+
+class Command(BaseCommand):
+    help = 'Run the process that owns blockchain appends for every web worker (BLOCKCHAIN_WRITER_ADDRESS)'
+
+    def handle(self, *args, **options):
+        address = getattr(settings, 'BLOCKCHAIN_WRITER_ADDRESS', None)
+        storage_dir = getattr(settings, 'BLOCKCHAIN_STORAGE_DIR', None)
+        if address is None or not storage_dir:
+            raise CommandError('Set BLOCKCHAIN_WRITER_ADDRESS and BLOCKCHAIN_STORAGE_DIR to run a chain writer')
+
+        # This process's global chain is a read-only view like every worker's; open the writable one
+        miner = chain_module._default_miner()
+        chain = Blockchain(FileBlockStore(storage_dir, **getattr(settings, 'BLOCKCHAIN_STORAGE_OPTIONS', {})),
+                           miner, checkpoint_key=chain_module._authkey(),
+                           snapshots=chain_module._default_snapshots(),
+                           sealer=chain_module._default_sealer(miner))
+        # With BLOCKCHAIN_SHARDED, a ledger with one writable chain per election
+        chain = chain_module._default_ledger(chain, miner)
+        # Only this process can store the recovered height, so replay crashed ballots here
+        recovered = recover_votes(chain)
+        if recovered:
+            self.stdout.write(f'Recovered {recovered} vote(s) from the blockchain')
+        batch_size = max(getattr(settings, 'BLOCKCHAIN_BATCH_SIZE', 1), 1)
+        max_wait_ms = getattr(settings, 'BLOCKCHAIN_BATCH_MAX_WAIT_MS', 200)
+        if isinstance(chain, ShardedLedger):
+            batcher = ShardedBatcher(chain, batch_size, max_wait_ms)
+        else:
+            batcher = VoteBatcher(chain, batch_size, max_wait_ms)
+        server = ChainWriterServer(batcher, address, chain_module._authkey())
+        signal.signal(signal.SIGTERM, lambda *args: server.close())
+
+        self.stdout.write(f'Chain writer serving {address} with {len(chain.chain)} block(s)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            batcher.close()
+            chain.close()
+        self.stdout.write(self.style.SUCCESS('Chain writer stopped'))
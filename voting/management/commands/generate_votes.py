@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.blockchain import Blockchain, _authkey
+from voting.loadgen import fill_chain
+from voting.snapshots import SnapshotStore
+from voting.storage import FileBlockStore
+
+
+class Command(BaseCommand):
+    help = 'Fill a separate on-disk blockchain with synthetic votes for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory of the benchmark chain; created or extended')
+        parser.add_argument('--count', type=int, default=10000, help='Votes to append (default 10000)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Votes sealed per block (default 100)')
+        parser.add_argument('--elections', type=int, default=1, help='Elections to spread votes over')
+        parser.add_argument('--candidates', type=int, default=3, help='Candidates per election')
+        parser.add_argument('--difficulty', type=int, default=None,
+                            help='Proof-of-work difficulty (default: the chain default)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for candidate choices')
+
+    def handle(self, *args, **options):
+        for name in ['count', 'batch_size', 'elections', 'candidates']:
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+
+        # Snapshot like the served chain does, so reopening a large benchmark chain stays quick
+        interval = getattr(settings, 'BLOCKCHAIN_SNAPSHOT_INTERVAL', 10000)
+        snapshots = SnapshotStore(os.path.join(options['directory'], 'snapshots'), interval) if interval else None
+        chain = Blockchain(FileBlockStore(options['directory']), checkpoint_key=_authkey(), snapshots=snapshots)
+        if options['difficulty'] is not None:
+            chain.difficulty = options['difficulty']
+        report_every = max(options['count'] // 10, options['batch_size'])
+        started = time.perf_counter()
+
+        def progress(written):
+            if written % report_every < options['batch_size'] or written == options['count']:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{written} vote(s), {written / elapsed:.0f} votes/sec')
+
+        try:
+            written = fill_chain(chain, options['count'], options['batch_size'], progress,
+                                 elections=options['elections'], candidates=options['candidates'],
+                                 seed=options['seed'])
+            blocks = len(chain.chain)
+        finally:
+            chain.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Appended {written} vote(s) to a chain of {blocks} block(s) '
+            f'({written / elapsed:.0f} votes/sec)'))
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.registration import VoterImport, read_roll
+
+
+class Command(BaseCommand):
+    help = 'Register voters in bulk from a CSV voter roll (username, voter_id[, password, email, first_name, last_name])'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help="Path to the voter roll, or '-' for standard input")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows inserted per transaction (default 1000)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Password-hashing processes (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        def progress(run):
+            self.stdout.write(f'{run.read} row(s) read, {run.created} registered, '
+                              f'{run.rate:.0f} rows/sec')
+
+        stream = sys.stdin if options['csv_file'] == '-' else open(options['csv_file'], newline='')
+        try:
+            run = VoterImport(options['batch_size'], options['workers']).run(read_roll(stream), progress)
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Registered {run.created} voter(s), skipped {run.skipped} existing or invalid row(s) '
+            f'({run.rate:.0f} rows/sec)'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from voting import blockchain as chain_module
+from voting.cache import invalidate_election
+from voting.models import Candidate, CandidateTally, Election
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized CandidateTally rows from Vote or from the blockchain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['votes', 'chain'], default='votes',
+                            help='Count Vote rows (default) or read the blockchain tally index')
+        parser.add_argument('--election', type=int, action='append',
+                            help='Only rebuild this election (repeatable)')
+
+    def handle(self, *args, **options):
+        elections = Election.objects.all()
+        if options['election']:
+            elections = elections.filter(id__in=options['election'])
+
+        # Attach beside the server's writer instead of opening the chain for writing
+        chain = chain_module.open_chain_reader() if options['source'] == 'chain' else None
+        try:
+            self.rebuild(elections, chain)
+        finally:
+            if chain is not None and chain is not chain_module.blockchain:
+                chain.close()
+        self.stdout.write(self.style.SUCCESS('Tallies rebuilt'))
+
+    def rebuild(self, elections, chain):
+        for election in elections:
+            if chain is not None:
+                counts = chain.tally(election.id)
+            else:
+                counts = election.count_votes()
+            candidate_ids = Candidate.objects.filter(election=election).values_list('id', flat=True)
+
+            with transaction.atomic():
+                CandidateTally.objects.filter(election=election).delete()
+                CandidateTally.objects.bulk_create([
+                    CandidateTally(candidate_id=candidate_id, election=election,
+                                   votes=counts.get(candidate_id, 0))
+                    for candidate_id in candidate_ids
+                ])
+                transaction.on_commit(lambda election_id=election.id: invalidate_election(election_id))
+            self.stdout.write(f'{election}: {sum(counts.get(c, 0) for c in candidate_ids)} vote(s)')
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from voting.blockchain import blockchain, open_chain_reader
+from voting.reconciliation import reconcile_all
+
+
+class Command(BaseCommand):
+    help = 'Cross-check database vote tallies against the blockchain tally'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, reconciling every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        # Attach beside the server's writer instead of opening the chain for writing
+        chain = open_chain_reader()
+        try:
+            self.reconcile(chain, options['interval'])
+        finally:
+            if chain is not blockchain:
+                chain.close()
+
+    def reconcile(self, chain, interval):
+        while True:
+            mismatches = reconcile_all(chain)
+            if mismatches:
+                for election_id, differences in mismatches.items():
+                    for candidate_id, (database, on_chain) in sorted(differences.items()):
+                        self.stdout.write(self.style.ERROR(
+                            f'Election {election_id}, candidate {candidate_id}: '
+                            f'database {database}, blockchain {on_chain}'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Database and blockchain tallies agree'))
+
+            if interval is None:
+                return
+            close_old_connections()
+            time.sleep(interval)
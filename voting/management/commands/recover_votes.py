@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from voting.pipeline import recover_votes
+
+
+class Command(BaseCommand):
+    help = 'Recreate Vote rows for ballots sealed on the blockchain but missing from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rescan the whole chain instead of only blocks since the last run')
+
+    def handle(self, *args, **options):
+        created = recover_votes(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Recovered {created} vote(s) from the blockchain'))
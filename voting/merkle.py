@@ -0,0 +1,87 @@
+"""
+Merkle trees over the votes sealed into a block
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Tuple
+
+
+# Domain separation keeps a leaf from ever being mistaken for an inner node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def hash_leaf(vote: Dict[str, Any]) -> bytes:
+    """Hash a single vote as a Merkle leaf"""
+    encoded = json.dumps(vote, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(LEAF_PREFIX + encoded).digest()
+
+
+def hash_node(left: bytes, right: bytes) -> bytes:
+    """Hash two child nodes into their parent"""
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _levels(votes: List[Dict[str, Any]], legacy: bool = False) -> List[List[bytes]]:
+    """
+    Build every level of the tree, leaves first.
+
+    An odd node out is promoted to the next level unchanged. Legacy trees
+    paired it with itself, which gives [a, b, c] and [a, b, c, c] the same
+    root (CVE-2012-2459); they are still built to verify older blocks.
+    """
+    level = [hash_leaf(vote) for vote in votes]
+    levels = [level]
+    while len(level) > 1:
+        if legacy and len(level) % 2:
+            level = level + [level[-1]]
+            levels[-1] = level
+        parents = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+        levels.append(level)
+    return levels
+
+
+def merkle_root(votes: List[Dict[str, Any]], legacy: bool = False) -> str:
+    """Compute the hex Merkle root of a list of votes; legacy pairs an odd node with itself"""
+    if not votes:
+        return hashlib.sha256(b'').hexdigest()
+    return _levels(votes, legacy)[-1][0].hex()
+
+
+def _proof(levels: List[List[bytes]], index: int) -> List[Tuple[str, str]]:
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        # A promoted node has no sibling at this level
+        if sibling < len(level):
+            proof.append(('left' if sibling < index else 'right', level[sibling].hex()))
+        index //= 2
+    return proof
+
+
+def merkle_proof(votes: List[Dict[str, Any]], index: int) -> List[Tuple[str, str]]:
+    """
+    Build the inclusion proof for the vote at ``index``.
+
+    The proof is a list of ``(side, sibling_hash)`` pairs from the leaf up,
+    where ``side`` says whether the sibling sits to the 'left' or 'right'.
+    """
+    return _proof(_levels(votes), index)
+
+
+def merkle_proofs(votes: List[Dict[str, Any]]) -> List[List[Tuple[str, str]]]:
+    """Build the inclusion proof of every vote, hashing the tree only once"""
+    levels = _levels(votes)
+    return [_proof(levels, index) for index in range(len(votes))]
+
+
+def verify_proof(vote: Dict[str, Any], proof: List[Tuple[str, str]], root: str) -> bool:
+    """Check that a vote is included under a Merkle root"""
+    node = hash_leaf(vote)
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        node = hash_node(sibling, node) if side == 'left' else hash_node(node, sibling)
+    return node.hex() == root
@@ -0,0 +1,201 @@
+"""
+In-process counters and histograms exported in the Prometheus text format
+
+Metrics are per process, like the chain's indexes. Set VOTING_METRICS =
+False to switch instrumentation off: the timed() decorator then returns
+functions untouched and the middleware removes itself, so nothing is
+measured or recorded.
+"""
+import functools
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+def _enabled() -> bool:
+    """Read VOTING_METRICS, defaulting to on when settings are not configured"""
+    try:
+        from django.conf import settings
+    except ImportError:
+        return True
+    return bool(getattr(settings, 'VOTING_METRICS', True)) if settings.configured else True
+
+
+ENABLED = _enabled()
+
+# Seconds; spans a cache hit to a slow proof of work
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Nonce attempts; difficulty d needs 16**d on average
+ATTEMPT_BUCKETS = tuple(16 ** power for power in range(1, 8))
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Metric:
+    """A named metric with optional labels; each label combination is a child"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], 'Metric'] = {}
+
+    def labels(self, *values) -> 'Metric':
+        """The child metric for one combination of label values"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def _child(self) -> 'Metric':
+        raise NotImplementedError
+
+    def _samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def collect(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """Every sample as (name, labels, value)"""
+        if not self.labelnames:
+            return self._samples()
+        samples = []
+        for values, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            samples.extend((name, {**labels, **extra}, value) for name, extra, value in child._samples())
+        return samples
+
+
+class Counter(Metric):
+    """A monotonically increasing count"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str = '', labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def _child(self) -> 'Counter':
+        return Counter(self.name)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self):
+        return [(f'{self.name}_total', {}, self.value)]
+
+
+class Histogram(Metric):
+    """Counts of observations falling under each bucket bound, plus their sum"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str = '', labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+
+    def _child(self) -> 'Histogram':
+        return Histogram(self.name, buckets=self.buckets)
+
+    def observe(self, value: float):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+
+    def _samples(self):
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket', {'le': _format_value(bound)}, cumulative))
+        samples.append((f'{self.name}_sum', {}, self.sum))
+        samples.append((f'{self.name}_count', {}, cumulative))
+        return samples
+
+
+class Registry:
+    """The metrics exported by this process"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.collect():
+                if labels:
+                    pairs = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                    name = f'{name}{{{pairs}}}'
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+registry = Registry()
+
+ADD_BLOCK_SECONDS = registry.register(Histogram(
+    'voting_add_block_seconds', 'Time to mine, append and index a block'))
+POW_SECONDS = registry.register(Histogram(
+    'voting_proof_of_work_seconds', 'Time spent sealing a block: a nonce search or a signature'))
+POW_ATTEMPTS = registry.register(Histogram(
+    'voting_proof_of_work_attempts', 'Nonces tried before a block met the difficulty target (1 when signed)',
+    buckets=ATTEMPT_BUCKETS))
+VALIDATION_SECONDS = registry.register(Histogram(
+    'voting_chain_validation_seconds', 'Time to validate the chain'))
+TALLY_SECONDS = registry.register(Histogram(
+    'voting_tally_seconds', 'Time to read an election tally', ['source']))
+REQUESTS = registry.register(Counter(
+    'voting_http_requests', 'HTTP requests served', ['view', 'method', 'status']))
+REQUEST_SECONDS = registry.register(Histogram(
+    'voting_http_request_seconds', 'Time to serve an HTTP request', ['view']))
+REQUEST_QUERIES = registry.register(Histogram(
+    'voting_http_request_queries', 'Database queries run while serving a request', ['view'],
+    buckets=QUERY_BUCKETS))
+
+
+def timed(histogram: Histogram, result: Optional[Callable] = None):
+    """
+    Decorator recording each call's wall time in a histogram.
+
+    result, if given, is called with the return value. With metrics
+    switched off the function is returned unwrapped.
+    """
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                value = func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - started)
+            if result is not None:
+                result(value)
+            return value
+        return wrapper
+    return decorate
@@ -0,0 +1,95 @@
+"""
+Request instrumentation for the /metrics endpoint
+"""
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """
+    Records each request's latency and database query count per view.
+
+    Removes itself from the stack when VOTING_METRICS is off. Works in
+    front of both sync and async views without forcing an adapter. Queries
+    are counted on whichever thread's connection runs them, so async views
+    handing work to sync_to_async are counted too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryCounter()
+        token = _current_counter.set(queries)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        self._record(request, response, perf_counter() - started, queries.count)
+        return response
+
+    async def __acall__(self, request):
+        # sync_to_async copies this context into its worker thread, so the
+        # counter follows the request to whichever connection runs the query
+        queries = QueryCounter()
+        token = _current_counter.set(queries)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        self._record(request, response, perf_counter() - started, queries.count)
+        return response
+
+    def _record(self, request, response, elapsed: float, query_count: int):
+        match = request.resolver_match
+        view = match.view_name if match is not None else '<unresolved>'
+        metrics.REQUESTS.labels(view, request.method, response.status_code).inc()
+        metrics.REQUEST_SECONDS.labels(view).observe(elapsed)
+        metrics.REQUEST_QUERIES.labels(view).observe(query_count)
+
+
+class QueryCounter:
+    """Number of queries run on behalf of one request"""
+
+    def __init__(self):
+        self.count = 0
+
+
+_current_counter: ContextVar = ContextVar('voting_query_counter', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    queries = _current_counter.get()
+    if queries is not None:
+        queries.count += 1
+    return execute(sql, params, many, context)
+
+
+def _wrap_connection(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def install():
+    """Count queries on every connection, including any already open in this thread"""
+    connection_created.connect(_wrap_connection, dispatch_uid='voting-count-queries')
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='merkle_receipt',
+            field=models.JSONField(blank=True, help_text='Merkle inclusion proof when the vote was sealed in a batch', null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0002_vote_merkle_receipt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'candidate'], name='vote_election_candidate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'timestamp'], name='vote_election_time_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_tallies(apps, schema_editor):
+    """Materialize tallies for votes cast before the table existed"""
+    Vote = apps.get_model('voting', 'Vote')
+    CandidateTally = apps.get_model('voting', 'CandidateTally')
+    counts = (Vote.objects.order_by().values('candidate', 'election')
+              .annotate(votes=models.Count('id')))
+    CandidateTally.objects.bulk_create([
+        CandidateTally(candidate_id=row['candidate'], election_id=row['election'], votes=row['votes'])
+        for row in counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0003_vote_tally_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandidateTally',
+            fields=[
+                ('candidate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tally', serialize=False, to='voting.candidate')),
+                ('votes', models.PositiveBigIntegerField(default=0)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='voting.election')),
+            ],
+        ),
+        migrations.RunPython(populate_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0004_candidate_tally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='candidatetally',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,113 @@
+"""
+Proof-of-work nonce search engines
+"""
+import hashlib
+import itertools
+import multiprocessing
+import os
+import struct
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Optional, Tuple
+
+# Nonces are appended to the block header as unsigned 64-bit integers
+NONCE = struct.Struct('<Q')
+
+# Workers start as fresh interpreters: forking a threaded web or writer
+# process would copy locks other threads hold into every child
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def mine_range(prefix: bytes, target: str, start: int = 0, stop: Optional[int] = None) -> Optional[Tuple[int, str]]:
+    """
+    Search nonces in ``[start, stop)`` for the first hash starting with ``target``.
+
+    The header prefix is hashed once; each attempt copies that state and
+    feeds only the packed nonce. Returns ``(nonce, hexdigest)`` or None.
+    """
+    pack = NONCE.pack
+    base = hashlib.sha256(prefix)
+    nonces = itertools.count(start) if stop is None else range(start, stop)
+    for nonce in nonces:
+        attempt = base.copy()
+        attempt.update(pack(nonce))
+        digest = attempt.hexdigest()
+        if digest.startswith(target):
+            return nonce, digest
+    return None
+
+
+class SequentialMiner:
+    """Searches nonces one at a time in the calling thread"""
+
+    def mine(self, prefix: bytes, difficulty: int) -> Tuple[int, str]:
+        """Find the lowest nonce meeting the difficulty target"""
+        return mine_range(prefix, '0' * difficulty)
+
+    def close(self):
+        """Nothing to release for the sequential miner"""
+
+
+class ParallelMiner:
+    """
+    Splits the nonce space into chunks searched by a persistent process pool.
+
+    Chunks are handed out in ascending order and a hit is only accepted
+    once every lower chunk has finished, so the result is always the
+    lowest qualifying nonce, identical to what SequentialMiner finds and
+    verifiable with a single hash. Chunks above an accepted hit are
+    cancelled; chunks already running finish their (bounded) range.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 20000):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(START_METHOD))
+        return self._executor
+
+    def mine(self, prefix: bytes, difficulty: int) -> Tuple[int, str]:
+        """Find the lowest nonce meeting the difficulty target"""
+        target = '0' * difficulty
+        pool = self._pool()
+        in_flight = {}
+        next_start = 0
+        done_below = 0  # every chunk starting below this has been searched
+
+        def submit():
+            nonlocal next_start
+            future = pool.submit(mine_range, prefix, target, next_start, next_start + self.chunk_size)
+            in_flight[future] = next_start
+            next_start += self.chunk_size
+
+        for _ in range(self.workers * 2):
+            submit()
+
+        finished = {}
+        best = None
+        while True:
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                start = in_flight.pop(future)
+                finished[start] = future.result()
+            while done_below in finished:
+                result = finished.pop(done_below)
+                done_below += self.chunk_size
+                if result is not None:
+                    best = result
+                    break
+            if best is not None:
+                for future in in_flight:
+                    future.cancel()
+                return best
+            while len(in_flight) < self.workers * 2:
+                submit()
+
+    def close(self):
+        """Shut down the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
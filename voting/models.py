@@ -1,7 +1,10 @@
 from django.db import models
+from django.db.models import Count
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .metrics import TALLY_SECONDS, timed
+
 
 class Election(models.Model):
     """Represents an election event"""
@@ -20,6 +23,20 @@ class Election(models.Model):
         now = timezone.now()
         return self.is_active and self.start_date <= now <= self.end_date
     
+    @timed(TALLY_SECONDS.labels('database'))
+    def get_tally(self):
+        """Get every candidate's vote count from the materialized tally rows"""
+        return dict(self.tallies.values_list('candidate_id', 'votes'))
+    
+    def count_votes(self):
+        """Count every candidate's votes with one grouped query over Vote"""
+        return dict(
+            self.vote_set.order_by()
+            .values('candidate')
+            .annotate(votes=Count('id'))
+            .values_list('candidate', 'votes')
+        )
+    
     class Meta:
         ordering = ['-created_at']
 
@@ -35,9 +52,11 @@ class Candidate(models.Model):
         return f"{self.name} - {self.election.title}"
     
     def get_vote_count(self):
-        """Get vote count from blockchain"""
-        from .blockchain import blockchain
-        return blockchain.get_votes_for_candidate(self.id)
+        """Get vote count from the materialized tally row"""
+        try:
+            return self.tally.votes
+        except CandidateTally.DoesNotExist:
+            return 0
     
     class Meta:
         ordering = ['name']
@@ -53,10 +72,10 @@ class Voter(models.Model):
     def __str__(self):
         return f"{self.user.username} ({self.voter_id})"
     
-    def has_voted_in_blockchain(self):
-        """Verify if voter has voted by checking blockchain"""
+    def has_voted_in_blockchain(self, election=None):
+        """Verify if voter has voted, optionally in one election, by checking blockchain"""
         from .blockchain import blockchain
-        return blockchain.verify_vote(self.id)
+        return blockchain.verify_vote(self.id, election.id if election else None)
     
     class Meta:
         ordering = ['voter_id']
@@ -72,6 +91,8 @@ class Vote(models.Model):
     election = models.ForeignKey(Election, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_now_add=True)
     blockchain_hash = models.CharField(max_length=64)
+    merkle_receipt = models.JSONField(null=True, blank=True,
+                                      help_text="Merkle inclusion proof when the vote was sealed in a batch")
     
     def __str__(self):
         return f"Vote by {self.voter.voter_id} at {self.timestamp}"
@@ -80,3 +101,37 @@ class Vote(models.Model):
         ordering = ['-timestamp']
         # Ensure one vote per voter per election
         unique_together = ['voter', 'election']
+        indexes = [
+            models.Index(fields=['election', 'candidate'], name='vote_election_candidate_idx'),
+            models.Index(fields=['election', 'timestamp'], name='vote_election_time_idx'),
+        ]
+
+
+class CandidateTally(models.Model):
+    """
+    Materialized vote count for a candidate
+    Incremented in the same transaction as each Vote insert, so results
+    read one row per candidate instead of counting Vote rows
+    """
+    candidate = models.OneToOneField(Candidate, on_delete=models.CASCADE, primary_key=True,
+                                     related_name='tally')
+    election = models.ForeignKey(Election, on_delete=models.CASCADE, related_name='tallies')
+    votes = models.PositiveBigIntegerField(default=0)
+    # Set on every change, so results pages can tell which count they show
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.candidate.name}: {self.votes}"
+    
+    @classmethod
+    def increment(cls, candidate, count=1):
+        """Atomically add votes to a candidate's tally, creating the row if needed"""
+        # update() skips auto_now, so the change time is set explicitly
+        updated = cls.objects.filter(candidate=candidate).update(
+            votes=models.F('votes') + count, updated_at=timezone.now())
+        if not updated:
+            tally, created = cls.objects.get_or_create(
+                candidate=candidate, defaults={'election_id': candidate.election_id, 'votes': count})
+            if not created:
+                cls.objects.filter(pk=tally.pk).update(
+                    votes=models.F('votes') + count, updated_at=timezone.now())
@@ -0,0 +1,144 @@
+"""
+Vote ingestion: one path from a ballot to a sealed block and a Vote row
+"""
+import asyncio
+import logging
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import blockchain as chain_module
+from .blockchain import iter_votes
+from .cache import invalidate_election
+from .models import Candidate, CandidateTally, Vote, Voter
+
+logger = logging.getLogger(__name__)
+
+
+def record_vote(voter: Voter, candidate: Candidate, election) -> Vote:
+    """
+    Seal a ballot on the chain, then record it in the database.
+
+    The chain is the source of truth and its single writer rejects a second
+    ballot from the same voter, so concurrent submissions cannot fork the
+    chain or double-vote. The Vote row, the voter's flag and the candidate's
+    materialized tally are written in one transaction after the block is
+    sealed; if the process dies in between, recover_votes() recreates the
+    missing rows from the chain.
+    Raises batching.DuplicateVoteError when the voter has already voted.
+    """
+    # Wait for the single writer to seal the vote into a block
+    receipt = submit_ballot(voter, candidate, election).result()
+    return store_vote(voter, candidate, election, receipt)
+
+
+async def arecord_vote(voter: Voter, candidate: Candidate, election) -> Vote:
+    """
+    Async record_vote: awaits the sealed block without holding a thread.
+
+    Mining runs on the single writer thread; the database transaction runs
+    through sync_to_async because Django transactions are synchronous.
+    """
+    receipt = await asyncio.wrap_future(submit_ballot(voter, candidate, election))
+    return await sync_to_async(store_vote)(voter, candidate, election, receipt)
+
+
+def submit_ballot(voter: Voter, candidate: Candidate, election) -> Future:
+    """Queue a ballot with the single writer; the future resolves to its receipt"""
+    vote_data = {
+        'voter_id': voter.id,
+        'candidate_id': candidate.id,
+        'election_id': election.id,
+        'timestamp': str(timezone.now())
+    }
+    return chain_module.vote_batcher.submit(vote_data)
+
+
+def store_vote(voter: Voter, candidate: Candidate, election, receipt) -> Vote:
+    """Write the Vote row, voter flag and tally for a sealed ballot in one transaction"""
+    # When another process sealed the block, bring this process's view up to it
+    chain_module.blockchain.refresh()
+    try:
+        with transaction.atomic():
+            vote_record = Vote.objects.create(
+                voter=voter,
+                candidate=candidate,
+                election=election,
+                blockchain_hash=receipt['block_hash'],
+                merkle_receipt=receipt if 'merkle_root' in receipt else None
+            )
+            Voter.objects.filter(pk=voter.pk).update(has_voted=True)
+            CandidateTally.increment(candidate)
+            # Database tallies may have been cached between the append and this commit
+            transaction.on_commit(lambda: invalidate_election(election.id))
+    except IntegrityError:
+        # Recovery already replayed this ballot from the chain
+        vote_record = Vote.objects.get(voter=voter, election=election)
+    voter.has_voted = True
+    return vote_record
+
+
+def recover_votes(chain=None, full: bool = False) -> int:
+    """
+    Recreate Vote rows for ballots sealed on the chain but never recorded.
+
+    Only blocks after the last recovered height are scanned unless full is
+    set. Returns the number of rows created.
+
+    The recovered height is stored beside the chain, but a read-only chain
+    (every worker's view in writer mode) only keeps it in memory. Runs beside
+    a chain writer therefore rescan from the height it last stored; the
+    chain_writer command recovers, and stores the height, as it starts.
+    """
+    chain = chain if chain is not None else chain_module.blockchain
+    if hasattr(chain, 'chains'):
+        # A sharded ledger: every shard keeps its own recovered height
+        return sum(recover_votes(part, full) for part in chain.chains())
+    marker = None if full else chain.chain.read_meta('recovered')
+    start = marker['height'] + 1 if marker else 1
+    stop = len(chain.chain)
+
+    created = 0
+    touched = set()
+    for block in chain.iter_blocks(start, stop):
+        votes = [vote for vote in iter_votes(block)
+                 if vote.get('voter_id') is not None and vote.get('election_id') is not None]
+        if not votes:
+            continue
+        recorded = set(Vote.objects.filter(
+            voter_id__in=[vote['voter_id'] for vote in votes],
+            election_id__in={vote['election_id'] for vote in votes},
+        ).values_list('voter_id', 'election_id'))
+        missing = [vote for vote in votes if (vote['voter_id'], vote['election_id']) not in recorded]
+        if not missing:
+            continue
+        candidates = set(Candidate.objects.filter(
+            id__in=[vote['candidate_id'] for vote in missing]
+        ).values_list('id', flat=True))
+        voters = set(Voter.objects.filter(
+            id__in=[vote['voter_id'] for vote in missing]
+        ).values_list('id', flat=True))
+        with transaction.atomic():
+            for vote in missing:
+                if vote['candidate_id'] not in candidates or vote['voter_id'] not in voters:
+                    logger.warning('Block %s holds a vote for an unknown voter or candidate: %s',
+                                   block.index, vote)
+                    continue
+                vote_record, was_created = Vote.objects.get_or_create(
+                    voter_id=vote['voter_id'],
+                    election_id=vote['election_id'],
+                    defaults={'candidate_id': vote['candidate_id'], 'blockchain_hash': block.hash},
+                )
+                Voter.objects.filter(pk=vote['voter_id']).update(has_voted=True)
+                if was_created:
+                    CandidateTally.increment(vote_record.candidate)
+                created += was_created
+                touched.add(vote['election_id'])
+
+    if stop > start:
+        chain.chain.write_meta('recovered', {'height': stop - 1})
+    for election_id in touched:
+        invalidate_election(election_id)
+    return created
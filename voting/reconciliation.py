@@ -0,0 +1,42 @@
+"""
+Cross-checks of database tallies against the blockchain tally index
+"""
+import logging
+from typing import Dict, Tuple
+
+from . import blockchain as chain_module
+from .models import Election
+
+logger = logging.getLogger(__name__)
+
+
+def reconcile_election(election: Election, chain=None) -> Dict[int, Tuple[int, int]]:
+    """
+    Compare an election's database tally with the chain's.
+
+    Returns ``{candidate_id: (database_votes, chain_votes)}`` for every
+    candidate whose counts differ; an empty dict means they agree. The
+    chain side comes from its tally index, so no blocks are scanned.
+    """
+    chain = chain if chain is not None else chain_module.blockchain
+    database = election.get_tally()
+    on_chain = chain.tally(election.id)
+    return {
+        candidate_id: (database.get(candidate_id, 0), on_chain.get(candidate_id, 0))
+        for candidate_id in set(database) | set(on_chain)
+        if database.get(candidate_id, 0) != on_chain.get(candidate_id, 0)
+    }
+
+
+def reconcile_all(chain=None) -> Dict[int, Dict[int, Tuple[int, int]]]:
+    """Reconcile every election, logging and returning the ones that disagree"""
+    chain = chain if chain is not None else chain_module.blockchain
+    # A read-only view only sees blocks appended elsewhere once it refreshes
+    chain.refresh()
+    mismatches = {}
+    for election in Election.objects.all():
+        differences = reconcile_election(election, chain)
+        if differences:
+            logger.warning('Tally mismatch in election %s: %s', election.id, differences)
+            mismatches[election.id] = differences
+    return mismatches
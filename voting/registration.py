@@ -0,0 +1,146 @@
+"""
+Bulk voter registration from CSV voter rolls
+"""
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Voter
+
+# Columns read from a voter roll; only username and voter_id are required
+ROLL_COLUMNS = ['username', 'voter_id', 'password', 'email', 'first_name', 'last_name']
+
+
+def read_roll(stream) -> Iterator[Dict[str, str]]:
+    """Stream voter rows from a CSV file with a header line"""
+    reader = csv.DictReader(stream)
+    missing = {'username', 'voter_id'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f'Voter roll is missing column(s): {", ".join(sorted(missing))}')
+    for row in reader:
+        yield {column: (row.get(column) or '').strip() for column in ROLL_COLUMNS}
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[List]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _hash_password(password: str) -> str:
+    # A blank password leaves the account unusable until it is reset
+    return make_password(password or None)
+
+
+class VoterImport:
+    """
+    Registers voters in batches: one transaction, one password-hashing
+    round and two bulk INSERTs per batch.
+
+    Password hashing dominates the cost of a registration, so it runs in a
+    process pool when workers is above one. Rows whose username or voter ID
+    is already registered are skipped, so an interrupted import can simply
+    be re-run.
+    """
+
+    def __init__(self, batch_size: int = 1000, workers: Optional[int] = 1):
+        self.batch_size = batch_size
+        # None hashes on every core
+        self.workers = workers or os.cpu_count() or 1
+        self.read = 0
+        self.created = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+        self._executor = None
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup)
+
+    @property
+    def rate(self) -> float:
+        """Rows read per second since the import started"""
+        elapsed = time.perf_counter() - self.started
+        return self.read / elapsed if elapsed else 0.0
+
+    def run(self, rows: Iterable[Dict[str, str]], progress=None):
+        """Import every row, calling progress(self) after each batch"""
+        try:
+            for chunk in _chunks(rows, self.batch_size):
+                self.import_batch(chunk)
+                if progress is not None:
+                    progress(self)
+        finally:
+            self.close()
+        return self
+
+    def import_batch(self, rows: List[Dict[str, str]]):
+        """Register one batch of voters in a single transaction"""
+        self.read += len(rows)
+        rows = self._dedupe(rows)
+
+        existing_users = dict(User.objects.filter(
+            username__in=[row['username'] for row in rows]).values_list('username', 'id'))
+        taken_voter_ids = set(Voter.objects.filter(
+            voter_id__in=[row['voter_id'] for row in rows]).values_list('voter_id', flat=True))
+        registered_users = set(Voter.objects.filter(
+            user_id__in=existing_users.values()).values_list('user_id', flat=True))
+        rows = [row for row in rows
+                if row['voter_id'] not in taken_voter_ids
+                and existing_users.get(row['username']) not in registered_users]
+        new_rows = [row for row in rows if row['username'] not in existing_users]
+
+        passwords = self._hash([row['password'] for row in new_rows])
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=row['username'], password=password, email=row['email'],
+                     first_name=row['first_name'], last_name=row['last_name'])
+                for row, password in zip(new_rows, passwords)
+            ], ignore_conflicts=True)
+            # Conflicting inserts come back without ids, so read them all back
+            user_ids = dict(User.objects.filter(
+                username__in=[row['username'] for row in rows]).values_list('username', 'id'))
+            Voter.objects.bulk_create([
+                Voter(user_id=user_ids[row['username']], voter_id=row['voter_id'])
+                for row in rows
+            ], ignore_conflicts=True)
+            # A concurrent import may have taken a voter ID since the checks above; count only ours
+            registered = set(Voter.objects.filter(
+                voter_id__in=[row['voter_id'] for row in rows]).values_list('user_id', 'voter_id'))
+
+        self.created += sum((user_ids[row['username']], row['voter_id']) in registered for row in rows)
+        self.skipped = self.read - self.created
+
+    def _dedupe(self, rows: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Drop rows without keys and repeats of a username or voter ID within the batch"""
+        seen_usernames, seen_voter_ids, unique = set(), set(), []
+        for row in rows:
+            if not row['username'] or not row['voter_id']:
+                continue
+            if row['username'] in seen_usernames or row['voter_id'] in seen_voter_ids:
+                continue
+            seen_usernames.add(row['username'])
+            seen_voter_ids.add(row['voter_id'])
+            unique.append(row)
+        return unique
+
+    def _hash(self, passwords: List[str]) -> List[str]:
+        if self._executor is None:
+            return [_hash_password(password) for password in passwords]
+        chunksize = max(len(passwords) // (self.workers * 4), 1)
+        return list(self._executor.map(_hash_password, passwords, chunksize=chunksize))
+
+    def close(self):
+        """Shut down the hashing processes"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,288 @@
+"""
+Per-election ledger shards with an anchor chain
+
+With BLOCKCHAIN_SHARDED set, every election's ballots go to a chain of its
+own, with its own tip, lock, indexes and single writer, so elections
+running side by side never wait on each other's appends or validation.
+The original global chain stays as the base: it keeps any ballots sealed
+before sharding was enabled and periodically gains an anchor block that
+commits the tip hash of every shard that has grown since the last one,
+so rewriting a shard's history also means rewriting the base chain.
+
+ShardedLedger answers the same questions as a Blockchain (tallies,
+election tips, whether a voter has voted) by combining the base chain
+with the election's shard, so callers need not know which they hold.
+The explorer and its API show the base chain unless ``?election=`` picks
+a shard; the export holds every chain, each line naming its shard.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from time import monotonic
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .batching import DuplicateVoteError, VoteBatcher
+from .blockchain import Block, Blockchain
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedLedger:
+    """
+    The base chain plus one Blockchain per election, opened on first use.
+
+    ``open_shard(election_id, create)`` returns the election's chain, or
+    None when it does not exist and must not be created (a read-only
+    view before the writer has made it). Every ``anchor_interval``
+    seconds at most, a shard append commits the shards' tips to the base
+    chain; None turns anchoring off.
+    """
+
+    def __init__(self, base: Blockchain, open_shard: Callable[[Any, bool], Optional[Blockchain]],
+                 existing=(), anchor_interval: Optional[float] = None):
+        self.base = base
+        self.anchor_interval = anchor_interval
+        self._open_shard = open_shard
+        self._shards: Dict[Any, Blockchain] = {}
+        self._lock = threading.Lock()  # Guards opening shards; each shard has its own append lock
+        self._listeners: List[Callable[[Block], None]] = []
+        self._anchored: Dict[Any, int] = {}  # height of each shard's last anchored block
+        self._anchor_lock = threading.Lock()
+        self._last_anchor = monotonic()
+        for election_id in existing:
+            self.shard(election_id, create=False)
+
+    @property
+    def readonly(self) -> bool:
+        return getattr(self.base.chain, 'readonly', False)
+
+    def shard(self, election_id, create: bool = True) -> Optional[Blockchain]:
+        """The chain holding an election's ballots; the base chain for ballots without one"""
+        if election_id is None:
+            return self.base
+        shard = self._shards.get(election_id)
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard = self._shards.get(election_id)
+            if shard is None:
+                shard = self._open_shard(election_id, create and not self.readonly)
+                if shard is None:
+                    return None
+                for callback in self._listeners:
+                    shard.add_listener(callback)
+                shard.add_listener(self._shard_appended)
+                self._shards[election_id] = shard
+        return shard
+
+    def shards(self) -> Dict[Any, Blockchain]:
+        """The shards opened so far, by election id"""
+        with self._lock:
+            return dict(self._shards)
+
+    def chains(self) -> List[Blockchain]:
+        """The base chain followed by every open shard"""
+        return [self.base, *self.shards().values()]
+
+    def chains_for(self, election_id) -> List[Blockchain]:
+        """The chains that may hold an election's ballots"""
+        shard = self.shard(election_id, create=False)
+        return [self.base] if shard is None or shard is self.base else [self.base, shard]
+
+    # -- reads, combined across the base chain and the election's shard --------
+
+    def tally(self, election_id: int) -> Dict[int, int]:
+        """Get the vote count of every candidate in an election"""
+        tally: Dict[int, int] = {}
+        for chain in self.chains_for(election_id):
+            for candidate_id, votes in chain.tally(election_id).items():
+                tally[candidate_id] = tally.get(candidate_id, 0) + votes
+        return tally
+
+    def election_tip(self, election_id: int) -> Optional[Block]:
+        """Get the latest block holding a vote for an election"""
+        for chain in reversed(self.chains_for(election_id)):
+            tip = chain.election_tip(election_id)
+            if tip is not None:
+                return tip
+        return None
+
+    def get_total_votes(self, election_id: int = None) -> int:
+        """Get the number of votes cast in an election, or across every chain"""
+        if election_id is None:
+            return sum(chain.get_total_votes() for chain in self.chains())
+        return sum(self.tally(election_id).values())
+
+    def get_votes_for_candidate(self, candidate_id: int) -> int:
+        """Count votes for a specific candidate across every chain"""
+        return sum(chain.get_votes_for_candidate(candidate_id) for chain in self.chains())
+
+    def verify_vote(self, voter_id: int, election_id: int = None) -> bool:
+        """Check if a voter has already voted, optionally in one election"""
+        chains = self.chains() if election_id is None else self.chains_for(election_id)
+        return any(chain.verify_vote(voter_id, election_id) for chain in chains)
+
+    # -- the base chain, as the explorer shows it without ?election= ----------
+
+    @property
+    def chain(self):
+        return self.base.chain
+
+    @property
+    def difficulty(self) -> int:
+        return self.base.difficulty
+
+    @difficulty.setter
+    def difficulty(self, value: int):
+        for chain in self.chains():
+            chain.difficulty = value
+
+    def get_latest_block(self) -> Block:
+        return self.base.get_latest_block()
+
+    def get_chain(self) -> List[Dict[str, Any]]:
+        return self.base.get_chain()
+
+    def iter_blocks(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Block]:
+        return self.base.iter_blocks(start, stop)
+
+    # -- writes ---------------------------------------------------------------
+
+    def add_block(self, data: Dict[str, Any]) -> Block:
+        """Append a vote to its election's shard"""
+        return self.shard(data.get('election_id')).add_block(data)
+
+    def add_batch(self, votes: List[Dict[str, Any]]) -> Block:
+        """Seal several votes of one election into a block of its shard"""
+        elections = {vote.get('election_id') for vote in votes}
+        if len(elections) != 1:
+            raise ValueError('a batch must hold votes of exactly one election')
+        return self.shard(elections.pop()).add_batch(votes)
+
+    def add_listener(self, callback: Callable[[Block], None]):
+        """Call ``callback(block)`` after any chain, including shards opened later, gains a block"""
+        with self._lock:
+            self._listeners.append(callback)
+            for chain in [self.base, *self._shards.values()]:
+                chain.add_listener(callback)
+
+    def remove_listener(self, callback: Callable[[Block], None]):
+        with self._lock:
+            self._listeners.remove(callback)
+            for chain in [self.base, *self._shards.values()]:
+                chain.remove_listener(callback)
+
+    def refresh(self) -> int:
+        """Pick up blocks another process appended to any open chain"""
+        return sum(chain.refresh() for chain in self.chains())
+
+    # -- anchoring ------------------------------------------------------------
+
+    def _shard_appended(self, block: Block):
+        if self.anchor_interval is not None and monotonic() - self._last_anchor >= self.anchor_interval:
+            self.anchor()
+
+    def anchor(self) -> Optional[Block]:
+        """
+        Commit the tip of every shard that grew since the last anchor to the base chain.
+
+        The anchor block holds ``[election_id, height, hash]`` per shard.
+        Returns it, or None when no shard has grown.
+        """
+        if self.readonly:
+            return None
+        with self._anchor_lock:
+            self._last_anchor = monotonic()
+            tips = []
+            for election_id, shard in sorted(self.shards().items()):
+                with shard._lock:
+                    height = len(shard.chain) - 1
+                    block_hash = shard.get_latest_block().hash
+                if height > self._anchored.get(election_id, 0):
+                    tips.append([election_id, height, block_hash])
+            if not tips:
+                return None
+            block = self.base.add_block({'anchor': tips})
+            for election_id, height, _ in tips:
+                self._anchored[election_id] = height
+            return block
+
+    def verify_anchors(self) -> bool:
+        """Check every anchored tip against the shard's block at that height"""
+        for block in self.base.iter_blocks():
+            if not isinstance(block.data, dict) or 'anchor' not in block.data:
+                continue
+            for election_id, height, block_hash in block.data['anchor']:
+                shard = self.shard(election_id, create=False)
+                if shard is None or height >= len(shard.chain) or shard.chain[height].hash != block_hash:
+                    logger.warning('Anchor in block %d does not match election %s at height %d',
+                                   block.index, election_id, height)
+                    return False
+        return True
+
+    # -- validation and shutdown ----------------------------------------------
+
+    def is_chain_valid(self, full: bool = False, workers: int = 1) -> bool:
+        """Validate every chain; a full check also confirms the anchored shard tips"""
+        if not all(chain.is_chain_valid(full, workers) for chain in self.chains()):
+            return False
+        return not full or self.verify_anchors()
+
+    def audit(self, workers: Optional[int] = None) -> bool:
+        """Verify every block of every chain and the anchors"""
+        return all(chain.audit(workers) for chain in self.chains()) and self.verify_anchors()
+
+    def close(self):
+        """Anchor the final shard tips, then close every chain"""
+        if self.anchor_interval is not None:
+            self.anchor()
+        for chain in self.chains():
+            chain.close()
+
+
+class ShardedBatcher:
+    """
+    One VoteBatcher, and so one writer thread, per election shard.
+
+    Ballots are routed by election id; a voter who already has a ballot on
+    the base chain, from before sharding, is rejected here since the
+    shard's batcher only knows its own chain.
+    """
+
+    def __init__(self, ledger: ShardedLedger, batch_size: int = 100, max_wait_ms: float = 200):
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self._batchers: Dict[Any, VoteBatcher] = {}
+        self._lock = threading.Lock()
+
+    def _batcher(self, election_id) -> VoteBatcher:
+        with self._lock:
+            batcher = self._batchers.get(election_id)
+            if batcher is None:
+                batcher = self._batchers[election_id] = VoteBatcher(
+                    self.ledger.shard(election_id), self.batch_size, self.max_wait_ms)
+            return batcher
+
+    def submit(self, vote: Dict[str, Any]) -> Future:
+        """Queue a vote with its election's writer; the returned future resolves to its receipt"""
+        election_id = vote.get('election_id')
+        if election_id is not None and self.ledger.base.verify_vote(vote.get('voter_id'), election_id):
+            future = Future()
+            future.set_exception(DuplicateVoteError(f"voter {vote.get('voter_id')} has already voted"))
+            return future
+        return self._batcher(election_id).submit(vote)
+
+    def flush(self):
+        """Seal every pending vote immediately"""
+        with self._lock:
+            batchers = list(self._batchers.values())
+        for batcher in batchers:
+            batcher.flush()
+
+    def close(self):
+        """Stop accepting votes and seal whatever is still pending"""
+        with self._lock:
+            batchers = list(self._batchers.values())
+        for batcher in batchers:
+            batcher.close()
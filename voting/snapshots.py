@@ -0,0 +1,209 @@
+"""
+Index snapshots for fast chain bootstrap
+
+Rebuilding the tally and voter indexes replays every block, so start-up
+time grows with the chain. Every BLOCKCHAIN_SNAPSHOT_INTERVAL blocks the
+writer saves the indexes as they stand at that height; on start-up the
+newest snapshot that checks out is loaded and only the blocks after it
+are replayed.
+
+A snapshot file is a header (magic, format version, height and the raw
+hash of the block at that height), a zlib-compressed body of int64
+columns, and an HMAC-SHA256 of both under the chain's checkpoint key.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .columns import MISSING
+from .indexes import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VSNAP'
+VERSION = 1
+
+# magic, version, height, hash of the block at that height
+HEADER = struct.Struct('<5sBQ32s')
+# Bloom filter capacity, error rate and key count
+BLOOM = struct.Struct('<QdQ')
+COUNT = struct.Struct('<Q')
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+FILENAME = re.compile(r'^snapshot-(\d+)\.bin$')
+
+# Index state as captured by Blockchain: height, hash, candidate_votes,
+# election_votes, election_tips (block indexes), ballots and bloom
+State = Dict[str, Any]
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is corrupt, unsigned or cannot hold the indexes"""
+
+
+def _is_id(value: Any) -> bool:
+    return type(value) is int and 0 <= value < 2 ** 63
+
+
+def _pack_rows(rows: Sequence[Tuple[int, ...]]) -> bytes:
+    values = array('q', (value for row in rows for value in row))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return COUNT.pack(len(rows)) + values.tobytes()
+
+
+def _unpack_rows(body: bytes, offset: int, width: int) -> Tuple[List[Tuple[int, ...]], int]:
+    if offset + COUNT.size > len(body):
+        raise SnapshotError('snapshot body is truncated')
+    (count,) = COUNT.unpack_from(body, offset)
+    offset += COUNT.size
+    end = offset + count * width * 8
+    if end > len(body):
+        raise SnapshotError('snapshot body is truncated')
+    values = array('q', body[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return list(zip(*(values[column::width] for column in range(width)))), end
+
+
+def encode_snapshot(state: State, key: bytes) -> bytes:
+    """
+    Serialize and sign an index state.
+
+    Raises SnapshotError when an id is not a non-negative integer, which
+    the int64 columns cannot hold (votes submitted outside the pipeline
+    may carry anything).
+    """
+    ids = [*state['candidate_votes'], *state['election_votes'], *state['election_tips'],
+           *(voter_id for _, voter_id in state['ballots']),
+           *(election_id for election_id, _ in state['ballots'] if election_id is not None),
+           *(candidate_id for tally in state['election_votes'].values() for candidate_id in tally)]
+    if not all(_is_id(value) for value in ids):
+        raise SnapshotError('only non-negative integer ids can be snapshotted')
+    bloom: BloomFilter = state['bloom']
+    body = b''.join([
+        _pack_rows(list(state['candidate_votes'].items())),
+        _pack_rows([(election_id, candidate_id, count)
+                    for election_id, tally in state['election_votes'].items()
+                    for candidate_id, count in tally.items()]),
+        _pack_rows(list(state['election_tips'].items())),
+        _pack_rows([(MISSING if election_id is None else election_id, voter_id)
+                    for election_id, voter_id in state['ballots']]),
+        BLOOM.pack(bloom.capacity, bloom.error_rate, bloom.count),
+        COUNT.pack(len(bloom.bits)), bytes(bloom.bits),
+    ])
+    payload = HEADER.pack(MAGIC, VERSION, state['height'], bytes.fromhex(state['hash'])) + zlib.compress(body)
+    return payload + hmac.new(key, payload, hashlib.sha256).digest()
+
+
+def decode_snapshot(data: bytes, key: bytes) -> State:
+    """Verify and deserialize a snapshot; raises SnapshotError when it cannot be trusted"""
+    if len(data) < HEADER.size + DIGEST_SIZE:
+        raise SnapshotError('snapshot is truncated')
+    payload, digest = data[:-DIGEST_SIZE], data[-DIGEST_SIZE:]
+    if not hmac.compare_digest(digest, hmac.new(key, payload, hashlib.sha256).digest()):
+        raise SnapshotError('snapshot signature does not match')
+    magic, version, height, block_hash = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f'unsupported snapshot format {magic!r} version {version}')
+    try:
+        body = zlib.decompress(payload[HEADER.size:])
+    except zlib.error as error:
+        raise SnapshotError(f'snapshot body is corrupt: {error}') from error
+
+    candidate_votes, offset = _unpack_rows(body, 0, 2)
+    election_rows, offset = _unpack_rows(body, offset, 3)
+    election_tips, offset = _unpack_rows(body, offset, 2)
+    ballots, offset = _unpack_rows(body, offset, 2)
+    if offset + BLOOM.size + COUNT.size > len(body):
+        raise SnapshotError('snapshot body is truncated')
+    capacity, error_rate, count = BLOOM.unpack_from(body, offset)
+    (size,) = COUNT.unpack_from(body, offset + BLOOM.size)
+    offset += BLOOM.size + COUNT.size
+    if offset + size != len(body):
+        raise SnapshotError('snapshot body has the wrong length')
+    try:
+        bloom = BloomFilter.from_bits(capacity, error_rate, body[offset:], count)
+    except ValueError as error:
+        raise SnapshotError(str(error)) from error
+
+    election_votes: Dict[int, Dict[int, int]] = {}
+    for election_id, candidate_id, votes in election_rows:
+        election_votes.setdefault(election_id, {})[candidate_id] = votes
+    return {
+        'height': height,
+        'hash': block_hash.hex(),
+        'candidate_votes': dict(candidate_votes),
+        'election_votes': election_votes,
+        'election_tips': dict(election_tips),
+        'ballots': {(None if election_id == MISSING else election_id, voter_id)
+                    for election_id, voter_id in ballots},
+        'bloom': bloom,
+    }
+
+
+class SnapshotStore:
+    """
+    A directory of index snapshots, one file per height.
+
+    Files are written to a temporary name, synced and renamed into place,
+    so readers in other processes never see a partial snapshot; only the
+    newest ``keep`` are kept.
+    """
+
+    def __init__(self, directory, interval: int = 10000, keep: int = 2):
+        self.directory = os.fspath(directory)
+        self.interval = interval
+        self.keep = max(keep, 1)
+
+    def due(self, height: int) -> bool:
+        """Whether a snapshot should be taken once the block at this height is indexed"""
+        return bool(self.interval) and height > 0 and height % self.interval == 0
+
+    def _path(self, height: int) -> str:
+        return os.path.join(self.directory, f'snapshot-{height:012d}.bin')
+
+    def heights(self) -> List[int]:
+        """Heights of the stored snapshots, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((int(match.group(1)) for match in map(FILENAME.match, names) if match), reverse=True)
+
+    def save(self, state: State, key: bytes) -> str:
+        """Write a snapshot of an index state and drop the oldest beyond ``keep``"""
+        data = encode_snapshot(state, key)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(state['height'])
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        for height in self.heights()[self.keep:]:
+            try:
+                os.unlink(self._path(height))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def load(self, height: int, key: bytes) -> State:
+        with open(self._path(height), 'rb') as f:
+            return decode_snapshot(f.read(), key)
+
+    def states(self, key: bytes) -> Iterator[State]:
+        """Decoded snapshots, newest first, skipping any that cannot be read or verified"""
+        for height in self.heights():
+            try:
+                yield self.load(height, key)
+            except (OSError, SnapshotError) as error:
+                logger.warning('Skipping snapshot at height %d: %s', height, error)
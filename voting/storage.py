@@ -0,0 +1,609 @@
+"""
+Block storage backends for the blockchain
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Dict, Iterator, List, Optional
+
+from .codec import (CODEC_BINARY, CODEC_JSON, COMPRESSION_MASK, ENCODING_MASK, _digest_bytes, _seal_bytes,
+                    _seal_text, check_compression, compress, decode_block, decompress, encode_block)
+from .columns import VoteColumns, pack_vote, unpack_vote
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the single-writer lock is POSIX-only
+    fcntl = None
+
+# Record header: payload length, CRC32 of the payload, payload codec
+RECORD_HEADER = struct.Struct('<IIB')
+
+# Number of committed blocks, published by the writer for read-only openers
+TIP = struct.Struct('<Q')
+
+
+class StoreLockedError(IOError):
+    """Raised when another process already has a block store open for writing"""
+
+
+class MemoryBlockStore(list):
+    """Keeps every block in process memory (the original behaviour)"""
+
+    def read_meta(self, name: str) -> Optional[Dict[str, Any]]:
+        """Read a small metadata record kept beside the chain"""
+        return self.__dict__.get('_meta', {}).get(name)
+
+    def write_meta(self, name: str, value: Dict[str, Any]):
+        """Replace a small metadata record kept beside the chain"""
+        self.__dict__.setdefault('_meta', {})[name] = value
+
+    def flush(self):
+        """Nothing to flush for an in-memory store"""
+
+    def close(self):
+        """Nothing to release for an in-memory store"""
+
+
+class CompactBlockStore:
+    """
+    Keeps blocks in process memory as packed columns instead of objects.
+
+    Hashes are stored as raw 32-byte digests in a contiguous byte array,
+    header fields in typed arrays and ballots in a VoteColumns table, so a
+    single-vote block costs under 100 bytes instead of a Block object, its
+    data dict and three strings. A block's previous hash is only stored
+    when it is not the hash of the block before it. Block objects are
+    rebuilt on access.
+    Blocks whose data does not fit the ballot layout (the genesis block,
+    ad hoc data) are kept as encoded JSON, so every block reads back
+    exactly as appended and its hash still verifies.
+    """
+
+    KIND_ENCODED = 0  # kept as JSON in _encoded
+    KIND_VOTE = 1  # one ballot
+    KIND_BATCH = 2  # several ballots under a Merkle root
+
+    def __init__(self):
+        self.votes = VoteColumns()
+        self._hashes = bytearray()
+        self._timestamps = array('d')
+        self._nonces = array('Q')
+        self._versions = array('B')
+        self._targets = array('B')  # proof-of-work targets; 0 where a block records none
+        self._vote_starts = array('Q')  # first row of each block in self.votes
+        self._vote_counts = array('I')
+        self._kinds = array('B')  # appended last; its length is the chain length
+        self._merkle_roots: Dict[int, bytes] = {}
+        self._unlinked: Dict[int, bytes] = {}  # previous hashes that differ from the prior block's
+        self._seals: Dict[int, bytes] = {}  # authority seals as b'<scheme>:' + raw signature
+        self._encoded: Dict[int, bytes] = {}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._kinds)
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        length = len(self)
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(length))]
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('block index out of range')
+
+        from .blockchain import Block
+        kind = self._kinds[index]
+        if kind == self.KIND_ENCODED:
+            return Block.from_dict(json.loads(self._encoded[index]))
+
+        start = self._vote_starts[index]
+        votes = [unpack_vote(*self.votes.row(row))
+                 for row in range(start, start + self._vote_counts[index])]
+        if kind == self.KIND_VOTE:
+            data = votes[0]
+        else:
+            data = {'votes': votes, 'merkle_root': self._merkle_roots[index].hex()}
+        block = Block.from_dict({
+            'index': index,
+            'timestamp': self._timestamps[index],
+            'data': data,
+            'previous_hash': self._previous_hash(index).hex(),
+            'nonce': self._nonces[index],
+            'version': self._versions[index],
+            'target': self._targets[index],
+            'hash': self._hashes[index * 32:index * 32 + 32].hex(),
+        })
+        seal = self._seals.get(index)
+        if seal is not None:
+            block.seal = _seal_text(seal)
+        return block
+
+    def append(self, block):
+        """Append a block, packing it into the columns when its fields allow"""
+        index = len(self)
+        packed = self._pack(block, index)
+        if packed is None:
+            self._encoded[index] = json.dumps(block.to_dict(), separators=(',', ':')).encode()
+            kind, rows, header = self.KIND_ENCODED, [], (b'\0' * 32, 0.0, 0, 0, 0)
+        else:
+            kind, rows, header = packed
+
+        self._vote_starts.append(len(self.votes))
+        self._vote_counts.append(len(rows))
+        for row in rows:
+            self.votes.append_row(*row)
+        digest, timestamp, nonce, version, target = header
+        self._hashes += digest
+        self._timestamps.append(timestamp)
+        self._nonces.append(nonce)
+        self._versions.append(version)
+        self._targets.append(target)
+        self._kinds.append(kind)
+
+    def _pack(self, block, index: int):
+        """Column values for a block, or None when it must be kept encoded"""
+        digest = _digest_bytes(block.hash)
+        previous = _digest_bytes(block.previous_hash)
+        if (digest is None or previous is None or block.index != index
+                or type(block.timestamp) is not float
+                or type(block.nonce) is not int or not 0 <= block.nonce < 2 ** 64
+                or type(block.version) is not int or not 0 <= block.version < 256
+                or block.target is not None and (type(block.target) is not int
+                                                 or not 0 <= block.target < 256)):
+            return None
+        seal = None
+        if block.seal is not None:
+            seal = _seal_bytes(block.seal)
+            if seal is None:
+                return None
+
+        data = block.data
+        if data.keys() == {'votes', 'merkle_root'} and isinstance(data['votes'], list):
+            merkle_root = _digest_bytes(data['merkle_root'])
+            rows = [pack_vote(vote) if isinstance(vote, dict) else None for vote in data['votes']]
+            if merkle_root is None or not rows or None in rows:
+                return None
+            kind = self.KIND_BATCH
+        else:
+            rows = [pack_vote(data)]
+            if rows[0] is None:
+                return None
+            kind = self.KIND_VOTE
+
+        if kind == self.KIND_BATCH:
+            self._merkle_roots[index] = merkle_root
+        if seal is not None:
+            self._seals[index] = seal
+        if index == 0 or previous != self._hashes[index * 32 - 32:index * 32]:
+            self._unlinked[index] = previous
+        return kind, rows, (digest, block.timestamp, block.nonce, block.version, block.target or 0)
+
+    def _previous_hash(self, index: int) -> bytes:
+        previous = self._unlinked.get(index)
+        if previous is None:
+            previous = bytes(self._hashes[index * 32 - 32:index * 32])
+        return previous
+
+    def nbytes(self) -> int:
+        """Approximate bytes held by the columns and encoded blocks"""
+        arrays = [self._timestamps, self._nonces, self._versions, self._targets, self._vote_starts,
+                  self._vote_counts, self._kinds]
+        return (len(self._hashes) + self.votes.nbytes()
+                + sum(len(column) * column.itemsize for column in arrays)
+                + 32 * (len(self._merkle_roots) + len(self._unlinked))
+                + sum(map(len, self._encoded.values())) + sum(map(len, self._seals.values())))
+
+    def read_meta(self, name: str) -> Optional[Dict[str, Any]]:
+        """Read a small metadata record kept beside the chain"""
+        return self._meta.get(name)
+
+    def write_meta(self, name: str, value: Dict[str, Any]):
+        """Replace a small metadata record kept beside the chain"""
+        self._meta[name] = value
+
+    def flush(self):
+        """Nothing to flush for an in-memory store"""
+
+    def close(self):
+        """Nothing to release for an in-memory store"""
+
+
+class FileBlockStore:
+    """
+    Append-only, segmented on-disk block log.
+
+    Blocks are appended to ``segment-NNNNNN.log`` files as length-prefixed,
+    CRC-checked records. Each segment has a companion ``.idx`` file holding
+    the byte offset of every record, so opening the store only loads the
+    offset tables and maps the logs instead of replaying the chain. Writes
+    reach the OS on every append and are fsynced in batches of
+    ``sync_every`` appends or every ``sync_interval`` seconds, whichever
+    comes first. Ballot blocks are written as binary records (see
+    codec.py) unless ``codec='json'``, and any record may be compressed
+    with ``compression='zlib'`` or ``'zstd'``; the codec byte in each
+    record header says how to read it back. Decoded blocks are
+    kept in a bounded LRU cache, so resident memory does not grow with the
+    length of the chain beyond eight bytes of offset per block.
+
+    After every append the writer stores the block count in a memory-mapped
+    ``tip`` file. Other processes open the same directory with
+    ``readonly=True`` and call refresh() to pick up new blocks: an unchanged
+    tip costs one read from shared memory, a changed one reads only the new
+    index entries. Read-only stores never modify the files; metadata they
+    write stays in process memory.
+    """
+
+    def __init__(self, directory, segment_size: int = 64 * 1024 * 1024,
+                 sync_every: int = 64, sync_interval: float = 0.05,
+                 cache_size: int = 1024, readonly: bool = False, codec: str = 'binary',
+                 compression: Optional[str] = None):
+        if codec not in ('binary', 'json'):
+            raise ValueError(f"unknown block codec {codec!r}; use 'binary' or 'json'")
+        check_compression(compression)
+        self.directory = str(directory)
+        self.codec = codec
+        self.compression = compression
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.cache_size = cache_size
+        self.readonly = readonly
+        self._lock_file = None
+        if not readonly:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock()
+
+        self._segments: List[Dict[str, Any]] = []
+        self._starts: List[int] = []  # global index of each segment's first block
+        self._length = 0
+        self._cache: 'OrderedDict[int, Any]' = OrderedDict()
+        self._log = None
+        self._idx = None
+        self._unsynced = 0
+        self._last_sync = monotonic()
+        self._tip = None
+        self._local_meta: Dict[str, Dict[str, Any]] = {}
+        if readonly:
+            self._attach()
+        else:
+            self._open_segments()
+            self._open_tip()
+
+    # -- opening and recovery -------------------------------------------------
+
+    def _lock(self):
+        """Hold an exclusive lock on the directory for as long as the store is open for writing"""
+        if fcntl is None:
+            return
+        lock_file = open(os.path.join(self.directory, 'LOCK'), 'a+b')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise StoreLockedError(
+                f'{self.directory} is already open for writing in another process; '
+                f'share it through a writer process (BLOCKCHAIN_WRITER_ADDRESS and '
+                f'manage.py chain_writer) or open it read-only') from None
+        self._lock_file = lock_file
+
+    def _segment_path(self, number: int, suffix: str) -> str:
+        return os.path.join(self.directory, f'segment-{number:06d}.{suffix}')
+
+    def _open_segments(self):
+        numbers = sorted(
+            int(name[len('segment-'):-len('.log')])
+            for name in os.listdir(self.directory)
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+        if not numbers:
+            numbers = [0]
+            open(self._segment_path(0, 'log'), 'ab').close()
+
+        for number in numbers:
+            offsets = self._recover_segment(number)
+            self._starts.append(self._length)
+            self._segments.append({'number': number, 'offsets': offsets, 'map': None, 'mapped': 0})
+            self._length += len(offsets)
+
+        active = self._segments[-1]['number']
+        self._log = open(self._segment_path(active, 'log'), 'ab')
+        self._idx = open(self._segment_path(active, 'idx'), 'ab')
+
+    def _recover_segment(self, number: int) -> array:
+        """
+        Load a segment's offset table and reconcile it with the log.
+
+        Index entries pointing at incomplete records are dropped, complete
+        records written after the last index entry are re-indexed, and a
+        torn record at the tail of the log is truncated away.
+        """
+        log_path = self._segment_path(number, 'log')
+        idx_path = self._segment_path(number, 'idx')
+        log_size = os.path.getsize(log_path)
+        idx_size = os.path.getsize(idx_path) if os.path.exists(idx_path) else -1
+
+        offsets = array('Q')
+        if idx_size > 0:
+            with open(idx_path, 'rb') as f:
+                raw = f.read()
+            offsets.frombytes(raw[:len(raw) - len(raw) % offsets.itemsize])
+
+        position = 0
+        with open(log_path, 'rb') as f:
+            while offsets:
+                end = self._record_end(f, offsets[-1], log_size)
+                if end is not None:
+                    position = end
+                    break
+                offsets.pop()
+            while True:
+                end = self._record_end(f, position, log_size)
+                if end is None:
+                    break
+                offsets.append(position)
+                position = end
+
+        if position < log_size:
+            with open(log_path, 'r+b') as f:
+                f.truncate(position)
+        if idx_size != len(offsets) * offsets.itemsize:
+            with open(idx_path, 'wb') as f:
+                f.write(offsets.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return offsets
+
+    def _open_tip(self):
+        path = os.path.join(self.directory, 'tip')
+        with open(path, 'ab') as f:
+            if f.tell() < TIP.size:
+                f.write(b'\0' * (TIP.size - f.tell()))
+        with open(path, 'r+b') as f:
+            self._tip = mmap.mmap(f.fileno(), TIP.size)
+        TIP.pack_into(self._tip, 0, self._length)
+
+    # -- read-only attachment -------------------------------------------------
+
+    def _attach(self):
+        """Open another process's store without recovering or writing anything"""
+        names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        numbers = sorted(
+            int(name[len('segment-'):-len('.log')])
+            for name in names
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+        # refresh() walks forward from the first segment as blocks are committed
+        self._starts.append(0)
+        self._segments.append({'number': numbers[0] if numbers else 0, 'offsets': array('Q'),
+                               'map': None, 'mapped': 0})
+        self.refresh()
+
+    def _read_tip(self) -> int:
+        if self._tip is None:
+            # The writer may not have started yet
+            try:
+                with open(os.path.join(self.directory, 'tip'), 'rb') as f:
+                    self._tip = mmap.mmap(f.fileno(), TIP.size, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return 0
+        return TIP.unpack_from(self._tip, 0)[0]
+
+    def refresh(self) -> int:
+        """Pick up blocks the writer has committed since the last call; returns the length"""
+        if not self.readonly:
+            return self._length
+        tip = self._read_tip()
+        while self._length < tip:
+            segment = self._segments[-1]
+            offsets = segment['offsets']
+            wanted = tip - self._length
+            try:
+                with open(self._segment_path(segment['number'], 'idx'), 'rb') as f:
+                    f.seek(len(offsets) * offsets.itemsize)
+                    raw = f.read(wanted * offsets.itemsize)
+            except FileNotFoundError:
+                break
+            loaded = array('Q')
+            loaded.frombytes(raw[:len(raw) - len(raw) % loaded.itemsize])
+            offsets.extend(loaded)
+            self._length += len(loaded)
+            if len(loaded) < wanted:
+                # The rest of the committed blocks are in the next segment
+                number = segment['number'] + 1
+                if not os.path.exists(self._segment_path(number, 'idx')):
+                    break
+                self._starts.append(self._length)
+                self._segments.append({'number': number, 'offsets': array('Q'), 'map': None, 'mapped': 0})
+        return self._length
+
+    @staticmethod
+    def _record_end(f, offset: int, log_size: int) -> Optional[int]:
+        """Return the end offset of a complete, intact record, or None"""
+        if offset + RECORD_HEADER.size > log_size:
+            return None
+        f.seek(offset)
+        length, crc, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        end = offset + RECORD_HEADER.size + length
+        if end > log_size or zlib.crc32(f.read(length)) != crc:
+            return None
+        return end
+
+    # -- sequence protocol ----------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(self._length):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('block index out of range')
+
+        block = self._cache.get(index)
+        if block is not None:
+            self._cache.move_to_end(index)
+            return block
+
+        block = self._decode(*self._read_record(index))
+        self._cache[index] = block
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return block
+
+    def _locate(self, index: int):
+        position = bisect_right(self._starts, index) - 1
+        segment = self._segments[position]
+        return segment, segment['offsets'][index - self._starts[position]]
+
+    def _read_record(self, index: int):
+        """A record's codec byte and payload"""
+        segment, offset = self._locate(index)
+        view = self._mapping(segment, offset + RECORD_HEADER.size)
+        length, crc, codec = RECORD_HEADER.unpack_from(view, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > segment['mapped']:
+            view = self._mapping(segment, start + length)
+        payload = view[start:start + length]
+        if zlib.crc32(payload) != crc:
+            raise IOError(f'corrupt block record at index {index}')
+        return codec, payload
+
+    def _mapping(self, segment: Dict[str, Any], needed: int) -> mmap.mmap:
+        if segment['map'] is None or segment['mapped'] < needed:
+            if segment['map'] is not None:
+                segment['map'].close()
+            with open(self._segment_path(segment['number'], 'log'), 'rb') as f:
+                segment['map'] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            segment['mapped'] = len(segment['map'])
+        return segment['map']
+
+    # -- encoding -------------------------------------------------------------
+
+    def _encode(self, block):
+        """Codec byte and payload for a block: binary when it fits and is enabled, else JSON"""
+        payload = encode_block(block) if self.codec == 'binary' else None
+        codec = CODEC_BINARY
+        if payload is None:
+            payload = json.dumps(block.to_dict(), sort_keys=True, separators=(',', ':')).encode()
+            codec = CODEC_JSON
+        flag, payload = compress(payload, self.compression)
+        return codec | flag, payload
+
+    @staticmethod
+    def _decode(codec: int, payload: bytes):
+        from .blockchain import Block
+        payload = decompress(payload, codec & COMPRESSION_MASK)
+        if codec & ENCODING_MASK == CODEC_BINARY:
+            return decode_block(payload)
+        if codec & ENCODING_MASK != CODEC_JSON:
+            raise IOError(f'unknown block record codec {codec:#x}')
+        return Block.from_dict(json.loads(payload))
+
+    # -- metadata -------------------------------------------------------------
+
+    def read_meta(self, name: str) -> Optional[Dict[str, Any]]:
+        """Read a small JSON metadata record kept beside the segments"""
+        if name in self._local_meta:
+            return self._local_meta[name]
+        try:
+            with open(os.path.join(self.directory, f'{name}.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_meta(self, name: str, value: Dict[str, Any]):
+        """Atomically replace a small JSON metadata record"""
+        if self.readonly:
+            self._local_meta[name] = value
+            return
+        path = os.path.join(self.directory, f'{name}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(value, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    # -- writing --------------------------------------------------------------
+
+    def append(self, block):
+        """Append a block to the active segment"""
+        if self.readonly:
+            raise IOError('cannot append to a read-only block store')
+        codec, payload = self._encode(block)
+        if self._log.tell() + RECORD_HEADER.size + len(payload) > self.segment_size and self._log.tell():
+            self._roll_segment()
+
+        offset = self._log.tell()
+        self._log.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload), codec))
+        self._log.write(payload)
+        self._idx.write(struct.pack('<Q', offset))
+        self._segments[-1]['offsets'].append(offset)
+
+        self._cache[self._length] = block
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        self._length += 1
+
+        # Hand every record to the OS so a process crash loses nothing;
+        # only the fsync that guards against power loss is batched
+        self._log.flush()
+        self._idx.flush()
+        TIP.pack_into(self._tip, 0, self._length)
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every or monotonic() - self._last_sync >= self.sync_interval:
+            self.flush()
+
+    def _roll_segment(self):
+        self.flush()
+        self._log.close()
+        self._idx.close()
+        number = self._segments[-1]['number'] + 1
+        self._log = open(self._segment_path(number, 'log'), 'ab')
+        self._idx = open(self._segment_path(number, 'idx'), 'ab')
+        self._starts.append(self._length)
+        self._segments.append({'number': number, 'offsets': array('Q'), 'map': None, 'mapped': 0})
+
+    def flush(self):
+        """Write buffered records and fsync the log before its index"""
+        if self._log is None:
+            return
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._idx.flush()
+        os.fsync(self._idx.fileno())
+        self._unsynced = 0
+        self._last_sync = monotonic()
+
+    def close(self):
+        """Flush pending writes and release file handles and mappings"""
+        if self._log is not None:
+            self.flush()
+            self._log.close()
+            self._idx.close()
+            self._log = self._idx = None
+        if self._tip is not None:
+            self._tip.close()
+            self._tip = None
+        for segment in self._segments:
+            if segment['map'] is not None:
+                segment['map'].close()
+                segment['map'] = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
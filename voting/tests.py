@@ -1,9 +1,59 @@
 """
 Tests for the blockchain implementation
 """
-from django.test import TestCase
-from voting.blockchain import Block, Blockchain
-from time import time
+import asyncio
+import gc
+import json
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+import zlib
+from unittest import mock, skipIf
+from datetime import timedelta
+from contextlib import ExitStack
+from io import StringIO
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from voting.models import Candidate, CandidateTally, Election, Vote, Voter
+from voting import async_views
+from voting.analytics import VoteAnalytics, analytics_for
+from voting.audit import audit_export
+from voting.batching import DuplicateVoteError, VoteBatcher
+from voting.blockchain import (HASH_VERSION, LEGACY_HASH_VERSION, TARGET_HASH_VERSION, Block, Blockchain,
+                               block_fault, open_chain_reader)
+from voting.merkle import merkle_proofs, merkle_root, verify_proof
+from voting import metrics
+from voting.metrics import Counter, Histogram, Registry
+from voting.middleware import MetricsMiddleware
+from voting.cache import results_cache, results_version
+from voting.codec import CODEC_BINARY, CODEC_JSON, COMPRESSION_FLAGS, decode_block, encode_block
+from voting import consensus
+from voting.consensus import AdaptiveProofOfWork, Ed25519Authority, HmacAuthority, ProofOfWork
+from voting.events import InProcessBroker, publish_block
+from voting.pipeline import recover_votes, store_vote
+from voting.reconciliation import reconcile_all, reconcile_election
+from voting.registration import VoterImport, read_roll
+from voting.mining import START_METHOD, ParallelMiner, SequentialMiner
+from voting import blockchain as blockchain_module
+from voting.sharding import ShardedBatcher
+from voting.snapshots import SnapshotError, SnapshotStore, decode_snapshot, encode_snapshot
+from voting.indexes import BloomFilter, VoterIndex
+from voting import storage
+from voting.storage import CompactBlockStore, FileBlockStore, MemoryBlockStore, StoreLockedError
+from voting.writer import ChainWriterServer, RemoteBatcher, WriterUnavailableError
+from time import sleep, time
 
 
 class BlockTestCase(TestCase):
@@ -31,6 +81,23 @@ class BlockTestCase(TestCase):
         calculated_hash = block.calculate_hash()
         self.assertEqual(block.hash, calculated_hash)
     
+    def test_legacy_json_hash_still_verifies(self):
+        """Test that blocks hashed before binary headers remain valid"""
+        block = Block(
+            index=1,
+            timestamp=time(),
+            data={'test': 'data'},
+            previous_hash='0',
+            version=LEGACY_HASH_VERSION
+        )
+        stored = block.to_dict()
+        del stored['version']
+        
+        restored = Block.from_dict(stored)
+        self.assertEqual(restored.version, LEGACY_HASH_VERSION)
+        self.assertEqual(restored.calculate_hash(), block.hash)
+        self.assertNotEqual(Block(1, block.timestamp, {'test': 'data'}, '0').hash, block.hash)
+    
     def test_block_to_dict(self):
         """Test block serialization to dictionary"""
         block = Block(
@@ -92,6 +159,33 @@ class BlockchainTestCase(TestCase):
         # Chain should now be invalid
         self.assertFalse(self.blockchain.is_chain_valid())
     
+    def test_incremental_validation_uses_checkpoint(self):
+        """Test that later checks only verify blocks after the checkpoint"""
+        self.blockchain.add_block({'voter_id': 1, 'candidate_id': 1})
+        self.blockchain.add_block({'voter_id': 2, 'candidate_id': 1})
+        self.assertTrue(self.blockchain.is_chain_valid())
+        
+        # Blocks below the checkpoint are only re-verified by a full audit
+        self.blockchain.chain[1].data = {'voter_id': 999, 'candidate_id': 999}
+        self.blockchain.add_block({'voter_id': 3, 'candidate_id': 1})
+        self.assertTrue(self.blockchain.is_chain_valid())
+        self.assertFalse(self.blockchain.is_chain_valid(full=True))
+        self.assertFalse(self.blockchain.audit(workers=2))
+    
+    def test_tampered_checkpoint_block_forces_full_check(self):
+        """Test that tampering with the checkpointed block is detected"""
+        self.blockchain.add_block({'voter_id': 1, 'candidate_id': 1})
+        self.assertTrue(self.blockchain.is_chain_valid())
+        
+        self.blockchain.chain[1].data = {'voter_id': 999, 'candidate_id': 999}
+        self.assertFalse(self.blockchain.is_chain_valid())
+    
+    def test_parallel_audit(self):
+        """Test that a valid chain passes the multi-process audit"""
+        for voter_id in range(5):
+            self.blockchain.add_block({'voter_id': voter_id, 'candidate_id': 1})
+        self.assertTrue(self.blockchain.audit(workers=2))
+    
     def test_get_votes_for_candidate(self):
         """Test counting votes for a candidate"""
         # Add votes for different candidates
@@ -104,6 +198,43 @@ class BlockchainTestCase(TestCase):
         self.assertEqual(self.blockchain.get_votes_for_candidate(2), 1)
         self.assertEqual(self.blockchain.get_votes_for_candidate(3), 0)
     
+    def test_tally(self):
+        """Test the per-election tally index"""
+        self.blockchain.add_block({'voter_id': 1, 'candidate_id': 1, 'election_id': 1})
+        self.blockchain.add_block({'voter_id': 2, 'candidate_id': 1, 'election_id': 1})
+        self.blockchain.add_block({'voter_id': 3, 'candidate_id': 2, 'election_id': 1})
+        self.blockchain.add_block({'voter_id': 1, 'candidate_id': 5, 'election_id': 2})
+        
+        self.assertEqual(self.blockchain.tally(1), {1: 2, 2: 1})
+        self.assertEqual(self.blockchain.tally(2), {5: 1})
+        self.assertEqual(self.blockchain.tally(3), {})
+        self.assertEqual(self.blockchain.get_total_votes(1), 3)
+        
+        # The index is rebuilt identically from the stored chain
+        self.blockchain.rebuild_indexes()
+        self.assertEqual(self.blockchain.tally(1), {1: 2, 2: 1})
+    
+    def test_deferred_chain_opens_on_first_use(self):
+        """Test that the global chain stand-in opens lazily and keeps earlier listeners"""
+        opened = []
+        deferred = blockchain_module.DeferredChain(lambda: opened.append(Blockchain()) or opened[0])
+        seen = []
+        deferred.add_listener(seen.append)
+        deferred.close()
+        self.assertEqual(opened, [])
+        
+        block = deferred.add_block({'voter_id': 1, 'candidate_id': 1, 'election_id': 1})
+        deferred.difficulty = 1
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(seen, [block])
+        self.assertEqual(opened[0].difficulty, 1)
+        self.assertIs(deferred._lock, opened[0]._lock)
+        
+        substitute = Blockchain()
+        with deferred.substitute(substitute):
+            self.assertIs(deferred.chain, substitute.chain)
+        self.assertIs(deferred.chain, opened[0].chain)
+    
     def test_verify_vote(self):
         """Test checking if a voter has voted"""
         # Initially no votes
@@ -116,6 +247,14 @@ class BlockchainTestCase(TestCase):
         self.assertTrue(self.blockchain.verify_vote(1))
         self.assertFalse(self.blockchain.verify_vote(2))
     
+    def test_verify_vote_in_election(self):
+        """Test that vote checks can be scoped to an election"""
+        self.blockchain.add_block({'voter_id': 1, 'candidate_id': 1, 'election_id': 1})
+        
+        self.assertTrue(self.blockchain.verify_vote(1, election_id=1))
+        self.assertFalse(self.blockchain.verify_vote(1, election_id=2))
+        self.assertFalse(self.blockchain.verify_vote(2, election_id=1))
+    
     def test_proof_of_work(self):
         """Test that proof of work is applied"""
         vote_data = {'voter_id': 1, 'candidate_id': 1}
@@ -127,6 +266,18 @@ class BlockchainTestCase(TestCase):
         # Check that nonce was incremented
         self.assertGreater(block.nonce, 0)
     
+    def test_mixed_hash_versions_are_valid(self):
+        """Test that a legacy chain can be extended with header-hashed blocks"""
+        legacy = Blockchain()
+        legacy.chain[0] = Block(0, time(), {'vote': 'Genesis Block'}, '0', version=LEGACY_HASH_VERSION)
+        old = Block(1, time(), {'voter_id': 1, 'candidate_id': 1}, legacy.chain[0].hash,
+                    version=LEGACY_HASH_VERSION)
+        legacy.chain.append(legacy.proof_of_work(old))
+        legacy.add_block({'voter_id': 2, 'candidate_id': 1})
+        
+        self.assertEqual(legacy.chain[2].version, HASH_VERSION)
+        self.assertTrue(legacy.is_chain_valid())
+    
     def test_get_chain(self):
         """Test getting the entire blockchain"""
         self.blockchain.add_block({'voter_id': 1, 'candidate_id': 1})
@@ -135,3 +286,1208 @@ class BlockchainTestCase(TestCase):
         self.assertEqual(len(chain), 2)
         self.assertIsInstance(chain[0], dict)
         self.assertIn('hash', chain[0])
+
+
+class ParallelMinerTestCase(TestCase):
+    """Test cases for the multi-process miner"""
+    
+    def test_parallel_miner_matches_sequential(self):
+        """Test that the parallel miner finds the same lowest nonce"""
+        miner = ParallelMiner(workers=2, chunk_size=64)
+        self.addCleanup(miner.close)
+        prefix = Block(1, time(), {'voter_id': 1}, '0').header_prefix()
+        
+        self.assertEqual(miner.mine(prefix, 3), SequentialMiner().mine(prefix, 3))
+        # Workers never fork the test runner's threads
+        self.assertEqual(miner._executor._mp_context.get_start_method(), START_METHOD)
+    
+    def test_blockchain_with_parallel_miner(self):
+        """Test that blocks mined in parallel validate"""
+        chain = Blockchain(miner=ParallelMiner(workers=2, chunk_size=64))
+        self.addCleanup(chain.close)
+        chain.add_block({'voter_id': 1, 'candidate_id': 1})
+        chain.add_block({'voter_id': 2, 'candidate_id': 1})
+        self.assertTrue(chain.is_chain_valid())
+
+
+class ConsensusTestCase(TestCase):
+    """Test cases for the block sealing strategies"""
+    
+    def ballot(self, voter_id):
+        return {'voter_id': voter_id, 'candidate_id': 1, 'election_id': 1, 'timestamp': str(timezone.now())}
+    
+    def test_hmac_authority_seals_without_mining(self):
+        """Test that signed blocks verify in every store and a forged seal does not"""
+        for store in [MemoryBlockStore(), CompactBlockStore()]:
+            chain = Blockchain(store, sealer=HmacAuthority(b'authority-key'))
+            block = chain.add_block(self.ballot(1))
+            chain.add_batch([self.ballot(2), self.ballot(3)])
+            self.assertEqual(block.nonce, 0)
+            self.assertTrue(chain.chain[1].seal.startswith('hmac-sha256:'))
+            self.assertEqual(chain.chain[2].seal, chain.get_latest_block().seal)
+            self.assertTrue(chain.is_chain_valid(full=True))
+            self.assertFalse(Blockchain(store, sealer=HmacAuthority(b'other-key')).is_chain_valid(full=True))
+        
+        forged = Block.from_dict(dict(block.to_dict(), seal='hmac-sha256:' + '00' * 32))
+        self.assertIn('does not verify', HmacAuthority(b'authority-key').fault(forged))
+        unsealed = Block.from_dict(dict(block.to_dict(), seal=None))
+        self.assertIn('not sealed', HmacAuthority(b'authority-key').fault(unsealed))
+    
+    def test_authority_takes_over_a_mined_chain(self):
+        """Test that blocks below the switch height stay checked as proof of work"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        chain = Blockchain(FileBlockStore(directory))
+        chain.add_block(self.ballot(1))
+        chain.close()
+        
+        chain = Blockchain(FileBlockStore(directory), sealer=HmacAuthority(b'key', since=2))
+        chain.add_block(self.ballot(2))
+        self.assertIsNone(chain.chain[1].seal)
+        self.assertTrue(chain.is_chain_valid(full=True, workers=2))
+        chain.close()
+        chain = Blockchain(FileBlockStore(directory), sealer=HmacAuthority(b'key', since=1))
+        self.assertFalse(chain.is_chain_valid(full=True))
+        chain.close()
+    
+    def test_adaptive_difficulty_follows_target(self):
+        """Test that each block's target follows from its parent's and a cheaper rewrite fails"""
+        sealer = AdaptiveProofOfWork(target_seconds=1.0, difficulty=1, max_difficulty=3)
+        parent = Block(1, 100.0, self.ballot(1), '0', target=2)
+        self.assertEqual(sealer.required_target(parent, 100.01), 3)
+        self.assertEqual(sealer.required_target(parent, 105.0), 1)
+        self.assertEqual(sealer.required_target(parent, 100.5), 2)
+        
+        chain = Blockchain(sealer=AdaptiveProofOfWork(target_seconds=60, difficulty=1))
+        for voter_id in range(3):
+            chain.add_block(self.ballot(voter_id))
+        self.assertEqual([block.target for block in chain.chain[1:]], [1, 2, 3])
+        self.assertEqual(chain.difficulty, 3)
+        self.assertTrue(chain.is_chain_valid(full=True))
+        
+        tip = chain.get_latest_block()
+        rewrite = ProofOfWork(1).seal(Block(tip.index, tip.timestamp, tip.data, tip.previous_hash))
+        self.assertIn('retarget rule', chain.sealer.fault(rewrite, chain.chain[2]))
+    
+    def test_blocks_verify_against_their_own_target(self):
+        """Test that raising the difficulty keeps earlier blocks valid"""
+        chain = Blockchain(sealer=ProofOfWork(1))
+        chain.add_block(self.ballot(1))
+        chain.difficulty = 2
+        chain.add_block(self.ballot(2))
+        self.assertEqual([block.target for block in chain.chain[1:]], [1, 2])
+        self.assertTrue(chain.is_chain_valid(full=True))
+        self.assertTrue(Blockchain(chain.chain, sealer=ProofOfWork(3, min_difficulty=1)).is_chain_valid(full=True))
+        self.assertIn('below the minimum', ProofOfWork(2).fault(chain.chain[1]))
+    
+    def test_default_sealer_from_settings(self):
+        """Test that BLOCKCHAIN_CONSENSUS and BLOCKCHAIN_DIFFICULTY pick the sealer"""
+        from voting.blockchain import _default_sealer
+        with self.settings(BLOCKCHAIN_CONSENSUS='pow', BLOCKCHAIN_DIFFICULTY=3):
+            self.assertEqual(_default_sealer().difficulty, 3)
+        with self.settings(BLOCKCHAIN_CONSENSUS='hmac', BLOCKCHAIN_SEAL_KEY='seal'):
+            self.assertEqual(_default_sealer().key, b'seal')
+        with self.settings(BLOCKCHAIN_CONSENSUS='raft'):
+            with self.assertRaises(ValueError):
+                _default_sealer()
+    
+    @skipIf(consensus.Ed25519PrivateKey is None, 'cryptography is not installed')
+    def test_ed25519_authority(self):
+        """Test that Ed25519 seals verify with the public key alone"""
+        private_key = bytes(range(32))
+        chain = Blockchain(sealer=Ed25519Authority(private_key))
+        chain.add_block(self.ballot(1))
+        verifier = Ed25519Authority(public_key=chain.sealer.public_key)
+        self.assertIsNone(verifier.fault(chain.get_latest_block()))
+        self.assertTrue(chain.is_chain_valid(full=True, workers=2))
+        with self.assertRaises(ValueError):
+            verifier.seal(Block(2, time(), self.ballot(2), chain.get_latest_block().hash))
+
+
+class VoterIndexTestCase(TestCase):
+    """Test cases for the voter index and its Bloom filter"""
+    
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Test that every added key is reported as present"""
+        bloom = BloomFilter(capacity=1000)
+        for i in range(1000):
+            bloom.add(str(i).encode())
+        self.assertTrue(all(str(i).encode() in bloom for i in range(1000)))
+        false_positives = sum(str(i).encode() in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 100)
+    
+    def test_index_grows_past_capacity(self):
+        """Test that lookups stay exact after the filter is resized"""
+        index = VoterIndex(capacity=4)
+        for voter_id in range(50):
+            index.add(voter_id, election_id=1)
+        self.assertEqual(len(index), 50)
+        self.assertTrue(all(index.has_voted(v, 1) for v in range(50)))
+        self.assertFalse(index.has_voted(50, 1))
+        self.assertTrue(index.has_voted(10))
+
+
+class VoteBatcherTestCase(TestCase):
+    """Test cases for batched vote blocks"""
+    
+    def setUp(self):
+        self.blockchain = Blockchain()
+        self.batcher = VoteBatcher(self.blockchain, batch_size=3, max_wait_ms=20)
+        self.addCleanup(self.batcher.close)
+    
+    def test_odd_merkle_node_is_not_duplicated(self):
+        """Test that repeating the last vote changes the root, and every proof still verifies"""
+        votes = [{'voter_id': i, 'candidate_id': 1, 'election_id': 1} for i in range(7)]
+        self.assertNotEqual(merkle_root(votes[:3]), merkle_root(votes[:3] + votes[2:3]))
+        self.assertEqual(merkle_root(votes[:3], legacy=True), merkle_root(votes[:3] + votes[2:3], legacy=True))
+        for count in range(1, 8):
+            root = merkle_root(votes[:count])
+            for vote, proof in zip(votes, merkle_proofs(votes[:count])):
+                self.assertTrue(verify_proof(vote, proof, root))
+    
+    def test_blocks_before_promoted_merkle_nodes_still_verify(self):
+        """Test that an odd batch sealed under the duplicating tree keeps its root"""
+        votes = [{'voter_id': i, 'candidate_id': 1, 'election_id': 1} for i in range(3)]
+        genesis = self.blockchain.chain[0]
+        for root, fault in [(merkle_root(votes, legacy=True), None),
+                            (merkle_root(votes), 'Merkle root does not cover the votes')]:
+            block = self.blockchain.seal_block(Block(1, time(), {'votes': votes, 'merkle_root': root},
+                                                     genesis.hash, version=TARGET_HASH_VERSION), genesis)
+            self.assertEqual(block_fault(block, genesis, self.blockchain.sealer), fault)
+    
+    def test_votes_are_sealed_in_one_block(self):
+        """Test that a full batch becomes a single block with valid receipts"""
+        votes = [{'voter_id': i, 'candidate_id': i % 2, 'election_id': 1} for i in range(3)]
+        futures = [self.batcher.submit(vote) for vote in votes]
+        receipts = [future.result(timeout=5) for future in futures]
+        
+        self.assertEqual(len(self.blockchain.chain), 2)
+        self.assertEqual({r['block_hash'] for r in receipts}, {self.blockchain.chain[1].hash})
+        for vote, receipt in zip(votes, receipts):
+            self.assertTrue(verify_proof(vote, receipt['proof'], receipt['merkle_root']))
+        self.assertFalse(verify_proof(votes[0], receipts[1]['proof'], receipts[1]['merkle_root']))
+        self.assertEqual(self.blockchain.tally(1), {0: 2, 1: 1})
+        self.assertTrue(self.blockchain.verify_vote(2, election_id=1))
+        self.assertTrue(self.blockchain.is_chain_valid())
+    
+    def test_partial_batch_is_sealed_after_timeout(self):
+        """Test that a vote is not held back waiting for a full batch"""
+        receipt = self.batcher.submit({'voter_id': 1, 'candidate_id': 1, 'election_id': 1}).result(timeout=5)
+        self.assertEqual(receipt['block_index'], 1)
+        self.assertEqual(receipt['proof'], [])
+    
+    def test_duplicate_ballot_is_rejected(self):
+        """Test that a voter cannot queue two ballots in one election"""
+        self.batcher.submit({'voter_id': 1, 'candidate_id': 1, 'election_id': 1})
+        duplicate = self.batcher.submit({'voter_id': 1, 'candidate_id': 2, 'election_id': 1})
+        with self.assertRaises(DuplicateVoteError):
+            duplicate.result(timeout=5)
+    
+    def test_tampered_batch_is_invalid(self):
+        """Test that editing a vote inside a batch is detected"""
+        self.batcher.submit({'voter_id': 1, 'candidate_id': 1, 'election_id': 1}).result(timeout=5)
+        self.blockchain.chain[1].data['votes'][0]['candidate_id'] = 2
+        self.assertFalse(self.blockchain.is_chain_valid())
+
+
+class FileBlockStoreTestCase(TestCase):
+    """Test cases for the on-disk block store"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+    
+    def open_chain(self, **options):
+        chain = Blockchain(FileBlockStore(self.directory, **options))
+        self.addCleanup(chain.close)
+        return chain
+    
+    def test_chain_survives_reopen(self):
+        """Test that blocks are reloaded from disk"""
+        chain = self.open_chain()
+        chain.add_block({'voter_id': 1, 'candidate_id': 1})
+        chain.add_block({'voter_id': 2, 'candidate_id': 2})
+        tip = chain.get_latest_block().hash
+        chain.close()
+        
+        reopened = self.open_chain()
+        self.assertEqual(len(reopened.chain), 3)
+        self.assertEqual(reopened.get_latest_block().hash, tip)
+        self.assertTrue(reopened.is_chain_valid())
+        self.assertEqual(reopened.get_votes_for_candidate(2), 1)
+
+    @skipIf(storage.fcntl is None, 'the writer lock needs fcntl')
+    def test_single_writer_lock(self):
+        """Test that only one store can have a directory open for writing"""
+        chain = self.open_chain()
+        with self.assertRaises(StoreLockedError):
+            FileBlockStore(self.directory)
+        reader = FileBlockStore(self.directory, readonly=True)
+        self.assertEqual(len(reader), 1)
+        reader.close()
+        chain.close()
+        self.open_chain()
+
+    def test_binary_and_compressed_records(self):
+        """Test that binary, compressed and older JSON records read back as the same blocks"""
+        ballot = {'voter_id': 1, 'candidate_id': 2, 'election_id': 3, 'timestamp': str(timezone.now())}
+        chain = self.open_chain(codec='json')
+        chain.add_block(dict(ballot))
+        chain.chain.close()
+        chain.chain = FileBlockStore(self.directory, compression='zlib')
+        chain.add_batch([dict(ballot, voter_id=voter_id) for voter_id in range(2, 40)])
+        chain.add_block({'voter_id': 40, 'candidate_id': 'write-in'})
+        expected = [block.to_dict() for block in chain.chain]
+        chain.close()
+        
+        reopened = FileBlockStore(self.directory, cache_size=1)
+        self.addCleanup(reopened.close)
+        self.assertEqual([block.to_dict() for block in reopened], expected)
+        codecs = [reopened._read_record(index)[0] for index in range(len(reopened))]
+        zipped = COMPRESSION_FLAGS['zlib']
+        self.assertEqual(codecs, [CODEC_JSON, CODEC_JSON, CODEC_BINARY | zipped, CODEC_JSON | zipped])
+        self.assertTrue(Blockchain(reopened).is_chain_valid(full=True))
+        
+        sealed = Block(1, 1.5, ballot, '0' * 64)
+        sealed.seal = 'hmac-sha256:' + 'ab' * 32
+        self.assertEqual(decode_block(encode_block(sealed)).to_dict(), sealed.to_dict())
+        self.assertLess(len(encode_block(sealed)), len(json.dumps(sealed.to_dict())) / 2)
+    
+    def test_segments_roll_over(self):
+        """Test that the log is split across segments"""
+        chain = self.open_chain(segment_size=512, cache_size=2)
+        for voter_id in range(10):
+            chain.add_block({'voter_id': voter_id, 'candidate_id': 1})
+        chain.close()
+        
+        logs = [name for name in os.listdir(self.directory) if name.endswith('.log')]
+        self.assertGreater(len(logs), 1)
+        reopened = self.open_chain(cache_size=2)
+        self.assertEqual(len(reopened.chain), 11)
+        self.assertEqual(reopened.chain[5].data['voter_id'], 4)
+        self.assertTrue(reopened.is_chain_valid())
+    
+    def test_readonly_view_follows_writer(self):
+        """Test that a read-only store picks up committed blocks, across segments"""
+        writer = self.open_chain(segment_size=512)
+        reader = Blockchain(FileBlockStore(self.directory, readonly=True))
+        self.addCleanup(reader.close)
+        seen = []
+        reader.add_listener(seen.append)
+        self.assertEqual(len(reader.chain), 1)
+        
+        for voter_id in range(10):
+            writer.add_block({'voter_id': voter_id, 'candidate_id': 1, 'election_id': 1})
+        self.assertEqual(reader.refresh(), 10)
+        self.assertEqual(reader.refresh(), 0)
+        self.assertEqual(reader.get_latest_block().hash, writer.get_latest_block().hash)
+        self.assertEqual(reader.tally(1), writer.tally(1))
+        self.assertTrue(reader.verify_vote(9, 1))
+        self.assertEqual([block.index for block in seen], list(range(1, 11)))
+        self.assertTrue(reader.is_chain_valid())
+        with self.assertRaises(IOError):
+            reader.chain.append(writer.get_latest_block())
+    
+    def test_writer_process_seals_remote_ballots(self):
+        """Test that ballots sent to a writer server are sealed on its chain"""
+        chain = self.open_chain()
+        batcher = VoteBatcher(chain, batch_size=1)
+        address = os.path.join(self.directory, 'writer.sock')
+        server = ChainWriterServer(batcher, address, b'secret')
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(batcher.close)
+        self.addCleanup(server.close)
+        while not os.path.exists(address):
+            sleep(0.01)
+        
+        remote = RemoteBatcher(address, b'secret')
+        self.addCleanup(remote.close)
+        receipt = remote.submit({'voter_id': 1, 'candidate_id': 2, 'election_id': 1}).result(timeout=10)
+        self.assertEqual(receipt['block_hash'], chain.get_latest_block().hash)
+        with self.assertRaises(DuplicateVoteError):
+            remote.submit({'voter_id': 1, 'candidate_id': 3, 'election_id': 1}).result(timeout=10)
+    
+    def test_resent_ballot_returns_its_receipt(self):
+        """Test that a ballot sealed before the writer went down resolves to its receipt when resent"""
+        chain = self.open_chain()
+        batcher = VoteBatcher(chain, batch_size=1)
+        self.addCleanup(batcher.close)
+        ballot = {'voter_id': 1, 'candidate_id': 2, 'election_id': 1, 'timestamp': str(timezone.now())}
+        sealed = batcher.submit(ballot).result(timeout=10)
+        reader = Blockchain(FileBlockStore(self.directory, readonly=True))
+        self.addCleanup(reader.close)
+        
+        remote = RemoteBatcher(os.path.join(self.directory, 'writer.sock'), b'secret', chain=reader)
+        self.addCleanup(remote.close)
+        with mock.patch.object(remote, '_send', side_effect=[EOFError(), ('duplicate', 'voter 1 has already voted')]):
+            self.assertEqual(remote.submit(ballot).result(timeout=10), sealed)
+        with mock.patch.object(remote, '_send', side_effect=[EOFError(), ('duplicate', 'voter 1 has already voted')]):
+            with self.assertRaises(DuplicateVoteError):
+                remote.submit(dict(ballot, candidate_id=3)).result(timeout=10)
+        with self.assertRaises(WriterUnavailableError):
+            remote.submit(ballot).result(timeout=10)
+    
+    def test_torn_tail_is_recovered(self):
+        """Test that a partially written record is discarded on open"""
+        chain = self.open_chain()
+        chain.add_block({'voter_id': 1, 'candidate_id': 1})
+        chain.close()
+        
+        log_path = os.path.join(self.directory, 'segment-000000.log')
+        with open(log_path, 'ab') as f:
+            f.write(b'\x40\x00\x00\x00partial')
+        os.remove(os.path.join(self.directory, 'segment-000000.idx'))
+        
+        reopened = self.open_chain()
+        self.assertEqual(len(reopened.chain), 2)
+        reopened.add_block({'voter_id': 2, 'candidate_id': 1})
+        self.assertTrue(reopened.is_chain_valid())
+
+
+class CompactBlockStoreTestCase(TestCase):
+    """Test cases for the columnar in-memory block store"""
+    
+    def ballot(self, voter_id, candidate_id=1):
+        return {'voter_id': voter_id, 'candidate_id': candidate_id, 'election_id': 1,
+                'timestamp': str(timezone.now())}
+    
+    def test_blocks_read_back_exactly(self):
+        """Test that packed and encoded blocks alike rebuild with verifying hashes"""
+        chain = Blockchain(CompactBlockStore())
+        ballots = [self.ballot(1), {'voter_id': 2, 'candidate_id': 1}, self.ballot(3, 2)]
+        for data in ballots:
+            chain.add_block(data)
+        chain.add_batch([self.ballot(4), self.ballot(5, 2)])
+        
+        self.assertEqual(len(chain.chain), 5)
+        self.assertEqual([block.data for block in chain.chain[1:4]], ballots)
+        self.assertEqual(chain.chain[-1].data['votes'][1]['candidate_id'], 2)
+        self.assertTrue(chain.is_chain_valid(full=True))
+        self.assertEqual(chain.tally(1), {1: 2, 2: 2})
+        # Only the genesis block and the ad hoc vote need encoding
+        self.assertEqual(sorted(chain.chain._encoded), [0, 2])
+        self.assertEqual(list(chain.chain.votes.candidate_id), [1, 2, 1, 2])
+    
+    def test_previous_hash_is_kept_when_not_linked(self):
+        """Test that a block not pointing at its predecessor keeps its own previous hash"""
+        store = CompactBlockStore()
+        store.append(Block(0, 0.0, self.ballot(1), '0' * 64))
+        store.append(Block(1, 1.0, self.ballot(2), store[0].hash))
+        store.append(Block(2, 2.0, self.ballot(3), 'ab' * 32))
+        self.assertEqual(store[1].previous_hash, store[0].hash)
+        self.assertEqual(store[2].previous_hash, 'ab' * 32)
+        self.assertEqual(store[2].hash, store[2].calculate_hash())
+    
+    def test_smaller_than_block_objects(self):
+        """Test that packed blocks take a fraction of the memory of Block objects"""
+        store = CompactBlockStore()
+        previous_hash = '0' * 64
+        for index in range(1000):
+            block = Block(index, float(index), self.ballot(index), previous_hash)
+            store.append(block)
+            previous_hash = block.hash
+        self.assertFalse(store._encoded)
+        self.assertLess(store.nbytes() / len(store), 100)
+
+
+class SnapshotTestCase(TestCase):
+    """Test cases for index snapshots and fast start-up"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+    
+    def open_chain(self):
+        chain = Blockchain(FileBlockStore(self.directory), checkpoint_key=b'secret',
+                           snapshots=SnapshotStore(os.path.join(self.directory, 'snapshots'), interval=4))
+        chain.difficulty = 1
+        return chain
+    
+    def fill(self, chain, first, last):
+        for voter_id in range(first, last + 1):
+            chain.add_block({'voter_id': voter_id, 'candidate_id': voter_id % 2 + 1,
+                             'election_id': voter_id % 3 or None, 'timestamp': str(timezone.now())})
+    
+    def indexes(self, chain):
+        return (dict(chain._candidate_votes), {key: dict(value) for key, value in chain._election_votes.items()},
+                chain._voters._ballots, {key: block.hash for key, block in chain._election_tips.items()})
+    
+    def test_round_trip(self):
+        """Test that a snapshot decodes to the state it was made from, and only under its key"""
+        chain = self.open_chain()
+        self.fill(chain, 1, 6)
+        state = chain._index_state(chain.get_latest_block())()
+        data = encode_snapshot(state, b'secret')
+        restored = decode_snapshot(data, b'secret')
+        for field in ['height', 'hash', 'candidate_votes', 'election_votes', 'election_tips', 'ballots']:
+            self.assertEqual(restored[field], state[field])
+        self.assertEqual(restored['bloom'].bits, state['bloom'].bits)
+        with self.assertRaises(SnapshotError):
+            decode_snapshot(data, b'other')
+        with self.assertRaises(SnapshotError):
+            encode_snapshot(dict(state, candidate_votes={'a': 1}), b'secret')
+        chain.close()
+    
+    def test_capture_is_unaffected_by_later_blocks(self):
+        """Test that a state captured at a block and copied later holds only the ballots up to it"""
+        chain = self.open_chain()
+        self.fill(chain, 1, 6)
+        state = chain._index_state(chain.get_latest_block())
+        ballots, candidate_votes = set(chain._voters._ballots), dict(chain._candidate_votes)
+        self.fill(chain, 7, 9)
+        
+        captured = state()
+        self.assertEqual(captured['height'], 6)
+        self.assertEqual(captured['ballots'], ballots)
+        self.assertEqual(captured['candidate_votes'], candidate_votes)
+        self.assertEqual(captured['bloom'].count, 6)
+        chain.close()
+    
+    def test_start_up_replays_only_later_blocks(self):
+        """Test that reopening a chain loads the newest snapshot and indexes the blocks after it"""
+        chain = self.open_chain()
+        self.fill(chain, 1, 10)
+        expected = self.indexes(chain)
+        chain.close()
+        self.assertEqual(SnapshotStore(os.path.join(self.directory, 'snapshots')).heights(), [8, 4])
+        
+        with mock.patch.object(Blockchain, '_index_block', autospec=True,
+                               side_effect=Blockchain._index_block) as index_block:
+            chain = self.open_chain()
+        self.assertEqual([call.args[1].index for call in index_block.call_args_list], [9, 10])
+        self.assertEqual(self.indexes(chain), expected)
+        self.assertTrue(chain.verify_vote(3, None))
+        self.assertFalse(chain.verify_vote(11, 2))
+        chain.close()
+    
+    def test_mismatched_snapshot_falls_back(self):
+        """Test that a tampered snapshot is skipped for an older one or a full replay"""
+        chain = self.open_chain()
+        self.fill(chain, 1, 10)
+        expected = self.indexes(chain)
+        chain.close()
+        snapshots = SnapshotStore(os.path.join(self.directory, 'snapshots'))
+        with open(snapshots._path(8), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'\x00')
+        
+        chain = self.open_chain()
+        self.assertEqual(self.indexes(chain), expected)
+        chain.close()
+        
+        os.unlink(snapshots._path(4))
+        chain = Blockchain(FileBlockStore(self.directory), checkpoint_key=b'other',
+                           snapshots=snapshots)
+        self.assertEqual(self.indexes(chain), expected)
+        chain.close()
+
+
+class ShardedLedgerTestCase(TestCase):
+    """Test cases for per-election shards and the anchor chain"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_ledger(self, storage_dir=None, readonly=False):
+        with self.settings(BLOCKCHAIN_SHARDED=True, BLOCKCHAIN_STORAGE_DIR=storage_dir,
+                           BLOCKCHAIN_DIFFICULTY=1, BLOCKCHAIN_SNAPSHOT_INTERVAL=4,
+                           BLOCKCHAIN_ANCHOR_INTERVAL=None):
+            store = MemoryBlockStore() if storage_dir is None else FileBlockStore(storage_dir, readonly=readonly)
+            base = Blockchain(store, sealer=blockchain_module._default_sealer())
+            return blockchain_module._default_ledger(base)
+
+    def vote(self, voter_id, candidate_id, election_id):
+        return {'voter_id': voter_id, 'candidate_id': candidate_id, 'election_id': election_id,
+                'timestamp': str(timezone.now())}
+
+    def test_votes_route_to_their_election(self):
+        """Test that each election gets its own chain and reads combine it with the base chain"""
+        ledger = self.open_ledger()
+        # A ballot sealed before sharding stays on the base chain
+        ledger.base.add_block(self.vote(1, 1, 1))
+        first = ledger.add_block(self.vote(2, 2, 1))
+        second = ledger.add_batch([self.vote(1, 3, 2), self.vote(2, 4, 2)])
+
+        shards = ledger.shards()
+        self.assertEqual(set(shards), {1, 2})
+        self.assertEqual((first.index, second.index), (1, 1))
+        self.assertEqual(len(ledger.base.chain), 2)
+        self.assertIs(ledger.election_tip(1), first)
+        self.assertEqual(ledger.tally(1), {1: 1, 2: 1})
+        self.assertEqual(ledger.get_total_votes(2), 2)
+        self.assertTrue(ledger.verify_vote(1, 1))
+        self.assertTrue(ledger.verify_vote(2, 2))
+        self.assertFalse(ledger.verify_vote(3))
+        with self.assertRaises(ValueError):
+            ledger.add_batch([self.vote(3, 1, 1), self.vote(3, 3, 2)])
+
+        seen = []
+        ledger.add_listener(seen.append)
+        third = ledger.add_block(self.vote(3, 5, 3))
+        self.assertEqual(seen, [third])
+        self.assertTrue(ledger.is_chain_valid(full=True))
+        ledger.close()
+
+    def test_anchors_commit_shard_tips(self):
+        """Test that anchors record grown shard tips and catch a rewritten shard"""
+        ledger = self.open_ledger(self.directory)
+        for voter_id in range(1, 4):
+            ledger.add_block(self.vote(voter_id, 1, 1))
+        ledger.add_block(self.vote(1, 2, 2))
+        anchor = ledger.anchor()
+        tips = {election_id: shard.get_latest_block().hash for election_id, shard in ledger.shards().items()}
+        self.assertEqual(anchor.data, {'anchor': [[1, 3, tips[1]], [2, 1, tips[2]]]})
+        self.assertIsNone(ledger.anchor())
+        ledger.add_block(self.vote(4, 1, 1))
+        self.assertEqual(ledger.anchor().data['anchor'], [[1, 4, ledger.shard(1).get_latest_block().hash]])
+        self.assertTrue(ledger.verify_anchors())
+        self.assertEqual(ledger.get_total_votes(1), 4)
+        ledger.close()
+        self.assertTrue(os.path.isdir(os.path.join(self.directory, 'shards', 'election-1', 'snapshots')))
+
+        # Existing shards are found on disk, also by a read-only view
+        reader = self.open_ledger(self.directory, readonly=True)
+        self.assertEqual(set(reader.shards()), {1, 2})
+        self.assertEqual(reader.tally(1), {1: 4})
+        self.assertIsNone(reader.shard(3))
+        self.assertIsNone(reader.anchor())
+        self.assertTrue(reader.audit(workers=1))
+        reader.close()
+
+        # An anchor that no shard block matches fails verification
+        ledger = self.open_ledger(self.directory)
+        self.assertTrue(ledger.is_chain_valid(full=True))
+        ledger.base.add_block({'anchor': [[2, 1, 'f' * 64]]})
+        self.assertFalse(ledger.verify_anchors())
+        self.assertFalse(ledger.is_chain_valid(full=True))
+        ledger.close()
+
+    def test_export_and_audit_cover_every_shard(self):
+        """Test that ?election= selects a shard and the audit checks each shard against its anchor"""
+        ledger = self.open_ledger()
+        self.addCleanup(ledger.close)
+        ledger.add_block(self.vote(1, 1, 1))
+        ledger.add_block(self.vote(2, 2, 2))
+        ledger.anchor()
+        with blockchain_module.blockchain.substitute(ledger):
+            page = self.client.get(reverse('blockchain_api'), {'election': 2}).json()
+            self.assertEqual((page['shard'], page['blocks'][1]['data']['voter_id']), (2, 2))
+            self.assertEqual(self.client.get(reverse('blockchain_api'), {'election': 9}).status_code, 404)
+            self.assertEqual(self.client.get(reverse('blockchain'), {'election': 1}).context['chain_length'], 2)
+            response = self.client.get(reverse('blockchain_export'))
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['shard'] for line in lines], [None, None, 1, 1, 2, 2])
+        sealer = ledger.base.sealer
+        result = audit_export(lines, sealer, workers=1, chunk_size=3)
+        self.assertEqual((result['failure'], result['votes']), (None, 2))
+
+        # A shard rewritten after its tip was anchored, or left out, fails the audit
+        original = Block.from_dict(json.loads(lines[3]))
+        rewrite = sealer.seal(Block(1, original.timestamp, dict(original.data, candidate_id=9),
+                                    original.previous_hash), Block.from_dict(json.loads(lines[2])))
+        tampered = lines[:3] + [json.dumps(dict(rewrite.to_dict(), shard=1))] + lines[4:]
+        self.assertIn('anchored', audit_export(tampered, sealer, workers=1, chunk_size=3)['failure'][2])
+        self.assertEqual(audit_export(lines[:4], sealer, workers=1)['failure'][:2], (2, 1))
+
+    def test_batcher_writes_each_election_to_its_shard(self):
+        """Test that the sharded batcher keeps one writer per election and rejects earlier ballots"""
+        ledger = self.open_ledger()
+        ledger.base.add_block(self.vote(1, 1, 1))
+        batcher = ShardedBatcher(ledger, batch_size=2, max_wait_ms=20)
+        futures = [batcher.submit(self.vote(2, 1, 1)), batcher.submit(self.vote(3, 2, 1)),
+                   batcher.submit(self.vote(2, 3, 2))]
+        receipts = [future.result(timeout=10) for future in futures]
+        with self.assertRaises(DuplicateVoteError):
+            batcher.submit(self.vote(1, 2, 1)).result(timeout=10)
+        batcher.close()
+
+        self.assertEqual(receipts[0]['block_hash'], receipts[1]['block_hash'])
+        self.assertEqual(receipts[0]['block_hash'], ledger.shard(1).get_latest_block().hash)
+        self.assertEqual(receipts[2]['block_hash'], ledger.shard(2).get_latest_block().hash)
+        self.assertEqual(ledger.tally(1), {1: 2, 2: 1})
+        self.assertEqual(len(ledger.base.chain), 2)
+        ledger.close()
+
+
+class VoteAnalyticsTestCase(TestCase):
+    """Test cases for columnar tallies, timelines and turnout"""
+    
+    def setUp(self):
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.chain = Blockchain()
+        # Cast out of time order to exercise the sorted snapshot
+        for voter_id, candidate_id, election_id, minutes in [
+                (1, 1, 1, 5), (2, 2, 1, 70), (3, 1, 1, 10), (4, 3, 2, 15), (5, 1, 1, 130)]:
+            self.chain.add_block({'voter_id': voter_id, 'candidate_id': candidate_id,
+                                  'election_id': election_id,
+                                  'timestamp': str(self.start + timedelta(minutes=minutes))})
+    
+    def check_analytics(self):
+        analytics = VoteAnalytics(self.chain)
+        self.assertEqual(analytics.tallies(), {1: {1: 3, 2: 1}, 2: {3: 1}})
+        self.assertEqual(analytics.tally(1), self.chain.tally(1))
+        hour = timedelta(hours=1)
+        self.assertEqual(analytics.tally(1, self.start, self.start + hour), {1: 2})
+        self.assertEqual(analytics.tallies(start=self.start + hour), {1: {1: 1, 2: 1}})
+        self.assertEqual(analytics.votes_over_time(1, hour),
+                         [(self.start, 2), (self.start + hour, 1), (self.start + 2 * hour, 1)])
+        self.assertEqual(analytics.votes_over_time(1, hour, self.start, self.start + 4 * hour)[3],
+                         (self.start + 3 * hour, 0))
+        self.assertEqual(analytics.turnout(1, eligible=8)['turnout'], 50.0)
+        
+        # New blocks reach the analytics through the chain listener
+        self.chain.add_block({'voter_id': 6, 'candidate_id': 2, 'election_id': 1,
+                              'timestamp': str(self.start)})
+        self.assertEqual(analytics.tally(1), {1: 3, 2: 2})
+    
+    def test_analytics(self):
+        """Test tallies, time filters, timelines and turnout"""
+        self.check_analytics()
+    
+    def test_analytics_without_numpy(self):
+        """Test that the pure-Python path gives the same answers"""
+        with mock.patch('voting.analytics.numpy', None):
+            self.check_analytics()
+    
+    def test_blocks_are_collected_once(self):
+        """Test that blocks missed by the listener are caught up and repeats are ignored"""
+        analytics = VoteAnalytics(self.chain)
+        with mock.patch.object(self.chain, '_notify'):
+            self.chain.add_block({'voter_id': 6, 'candidate_id': 2, 'election_id': 1})
+        block = self.chain.add_block({'voter_id': 7, 'candidate_id': 2, 'election_id': 1})
+        analytics._add_block(block)
+        self.assertEqual(len(analytics.columns), 7)
+        self.assertEqual(analytics.tally(1), {1: 3, 2: 3})
+
+    def test_compact_store_columns_are_shared(self):
+        """Test that a compact chain's own columns back its analytics"""
+        chain = Blockchain(CompactBlockStore())
+        chain.add_block({'voter_id': 1, 'candidate_id': 4, 'election_id': 1,
+                         'timestamp': str(self.start)})
+        analytics = analytics_for(chain)
+        self.assertIs(analytics.columns, chain.chain.votes)
+        self.assertIs(analytics_for(chain), analytics)
+        self.assertEqual(analytics.tally(1), {4: 1})
+
+    
+    def test_analytics_follow_the_resolved_chain(self):
+        """Test that a substituted global chain gets its own analytics, and dropped chains free theirs"""
+        deferred = blockchain_module.DeferredChain(lambda: self.chain)
+        analytics = analytics_for(deferred)
+        self.assertIs(analytics_for(self.chain), analytics)
+        
+        other = Blockchain()
+        with deferred.substitute(other):
+            self.assertIsNot(analytics_for(deferred), analytics)
+            self.assertEqual(analytics_for(deferred).tally(1), {})
+        
+        # Neither the analytics nor the chain's listener keep the chain alive
+        dropped = weakref.ref(other)
+        del other
+        gc.collect()
+        self.assertIsNone(dropped())
+
+class BlockchainExplorerTestCase(TestCase):
+    """Test cases for the paginated explorer and export views"""
+    
+    def setUp(self):
+        self.blockchain = Blockchain()
+        for voter_id in range(5):
+            self.blockchain.add_block({'voter_id': voter_id, 'candidate_id': 1})
+        substitution = ExitStack()
+        self.addCleanup(substitution.close)
+        substitution.enter_context(blockchain_module.blockchain.substitute(self.blockchain))
+    
+    def test_explorer_is_paginated(self):
+        """Test that the explorer renders one page with a next cursor"""
+        response = self.client.get(reverse('blockchain'), {'limit': 2})
+        self.assertEqual([b['index'] for b in response.context['chain']], [0, 1])
+        self.assertEqual(response.context['next_cursor'], 1)
+        self.assertEqual(response.context['chain_length'], 6)
+        
+        response = self.client.get(reverse('blockchain'), {'after': 3, 'limit': 2})
+        self.assertEqual([b['index'] for b in response.context['chain']], [4, 5])
+        self.assertIsNone(response.context['next_cursor'])
+    
+    def test_api_returns_cursor(self):
+        """Test the JSON block API"""
+        data = self.client.get(reverse('blockchain_api'), {'after': 0, 'limit': 3}).json()
+        self.assertEqual([b['index'] for b in data['blocks']], [1, 2, 3])
+        self.assertEqual(data['next'], 3)
+    
+    def test_export_streams_ndjson(self):
+        """Test that the export streams one block per line"""
+        response = self.client.get(reverse('blockchain_export'))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[-1])['hash'], self.blockchain.get_latest_block().hash)
+
+
+class VotingFixturesMixin:
+    """An ongoing election, a candidate and a logged-in voter on a fresh chain"""
+    
+    def setUp(self):
+        self.blockchain = Blockchain()
+        self.batcher = VoteBatcher(self.blockchain, batch_size=1)
+        self.addCleanup(self.batcher.close)
+        # Every module importing the global chain and mempool sees these instead
+        substitutions = ExitStack()
+        self.addCleanup(substitutions.close)
+        substitutions.enter_context(blockchain_module.blockchain.substitute(self.blockchain))
+        substitutions.enter_context(blockchain_module.vote_batcher.substitute(self.batcher))
+        
+        now = timezone.now()
+        self.election = Election.objects.create(
+            title='Test Election', description='', is_active=True,
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1))
+        self.candidate = Candidate.objects.create(election=self.election, name='Alice')
+        self.user = User.objects.create_user('voter', password='voter123')
+        self.voter = Voter.objects.create(user=self.user, voter_id='V1')
+        self.client.force_login(self.user)
+        results_cache().clear()
+
+
+class VotingPipelineTestCase(VotingFixturesMixin, TestCase):
+    """Test cases for vote submission through the single writer"""
+    
+    def test_vote_is_sealed_and_recorded(self):
+        """Test that a ballot reaches both the chain and the database"""
+        url = reverse('vote', args=[self.election.id])
+        self.client.post(url, {'candidate_id': self.candidate.id})
+        
+        vote = Vote.objects.get(voter=self.voter, election=self.election)
+        self.assertEqual(vote.blockchain_hash, self.blockchain.get_latest_block().hash)
+        self.assertEqual(self.blockchain.tally(self.election.id), {self.candidate.id: 1})
+        self.voter.refresh_from_db()
+        self.assertTrue(self.voter.has_voted)
+        
+        # A second ballot is rejected and never reaches the chain
+        self.client.post(url, {'candidate_id': self.candidate.id})
+        self.assertEqual(len(self.blockchain.chain), 2)
+    
+    def test_results_are_cached_until_next_vote(self):
+        """Test that results return 304 until a vote block lands for the election"""
+        url = reverse('results', args=[self.election.id])
+        response = self.client.get(url)
+        self.assertEqual(response.context['total_votes'], 0)
+        self.assertEqual(response.context['activity']['turnout']['voters'], 0)
+        self.assertIsNotNone(results_cache().get(
+            f'results:activity:{self.election.id}:{results_version(self.election.id)}'))
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        
+        self.client.post(reverse('vote', args=[self.election.id]), {'candidate_id': self.candidate.id})
+        self.client.get(reverse('election_detail', args=[self.election.id]))  # consume flash message
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_votes'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_results_version_is_read_once_per_request(self):
+        """Test that a cached results page reads the tally state in one query"""
+        url = reverse('results', args=[self.election.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        tally_queries = [query for query in queries if 'voting_candidatetally' in query['sql']]
+        self.assertEqual(len(tally_queries), 1)
+    
+    def test_results_etag_follows_the_database_commit(self):
+        """Test that a page rendered between the block append and the commit is not reused"""
+        url = reverse('results', args=[self.election.id])
+        receipt = self.batcher.submit({
+            'voter_id': self.voter.id,
+            'candidate_id': self.candidate.id,
+            'election_id': self.election.id,
+        }).result(timeout=5)
+        response = self.client.get(url)
+        self.assertEqual(response.context['total_votes'], 0)
+        etag = response['ETag']
+        
+        store_vote(self.voter, self.candidate, self.election, receipt)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_votes'], 1)
+    
+    def test_database_tally_and_reconciliation(self):
+        """Test the grouped Vote query and its cross-check against the chain"""
+        self.client.post(reverse('vote', args=[self.election.id]), {'candidate_id': self.candidate.id})
+        self.assertEqual(self.election.count_votes(), {self.candidate.id: 1})
+        self.assertEqual(self.election.get_tally(), {self.candidate.id: 1})
+        self.assertEqual(self.candidate.get_vote_count(), 1)
+        self.assertEqual(reconcile_election(self.election), {})
+        
+        CandidateTally.objects.update(votes=0)
+        self.assertEqual(reconcile_election(self.election), {self.candidate.id: (0, 1)})
+        call_command('rebuild_tallies', stdout=StringIO())
+        self.assertEqual(reconcile_election(self.election), {})
+        
+        CandidateTally.objects.all().delete()
+        with self.settings(BLOCKCHAIN_STORAGE_DIR=None):
+            call_command('rebuild_tallies', source='chain', stdout=StringIO())
+        self.assertEqual(self.election.get_tally(), {self.candidate.id: 1})
+    
+    def test_rebuild_from_chain_beside_its_writer(self):
+        """Test that rebuilding from the chain reads it while another process holds it for writing"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        writer = Blockchain(FileBlockStore(directory))
+        self.addCleanup(writer.close)
+        writer.add_block({'voter_id': self.voter.id, 'candidate_id': self.candidate.id,
+                          'election_id': self.election.id})
+        
+        with self.settings(BLOCKCHAIN_STORAGE_DIR=directory):
+            call_command('rebuild_tallies', source='chain', stdout=StringIO())
+        self.assertEqual(self.election.get_tally(), {self.candidate.id: 1})
+    
+    def test_unreachable_writer_asks_to_try_again(self):
+        """Test that a vote sent while the writer is down is turned back without a server error"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        remote = RemoteBatcher(os.path.join(directory, 'writer.sock'), b'secret')
+        self.addCleanup(remote.close)
+        url = reverse('vote', args=[self.election.id])
+        with blockchain_module.vote_batcher.substitute(remote):
+            response = self.client.post(url, {'candidate_id': self.candidate.id})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertFalse(Vote.objects.exists())
+    
+    def test_reconcile_refreshes_a_reader(self):
+        """Test that reconciling beside the writer sees blocks appended after it attached"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        writer = Blockchain(FileBlockStore(directory))
+        self.addCleanup(writer.close)
+        with self.settings(BLOCKCHAIN_STORAGE_DIR=directory):
+            reader = open_chain_reader()
+        self.addCleanup(reader.close)
+        self.assertEqual(reconcile_all(reader), {})
+        
+        writer.add_block({'voter_id': self.voter.id, 'candidate_id': self.candidate.id,
+                          'election_id': self.election.id})
+        self.assertEqual(reconcile_all(reader), {self.election.id: {self.candidate.id: (0, 1)}})
+    
+    def test_reader_on_an_empty_store(self):
+        """Test that a reader attached before the writer stored a block sees an empty, valid chain"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(BLOCKCHAIN_STORAGE_DIR=directory):
+            reader = open_chain_reader()
+        self.addCleanup(reader.close)
+        self.assertEqual(len(reader.chain), 0)
+        self.assertIsNone(reader.get_latest_block())
+        self.assertTrue(reader.is_chain_valid())
+        self.assertTrue(reader.is_chain_valid(full=True))
+    
+    def test_recover_votes_missing_from_database(self):
+        """Test that a ballot sealed before a crash is replayed into the database"""
+        self.batcher.submit({
+            'voter_id': self.voter.id,
+            'candidate_id': self.candidate.id,
+            'election_id': self.election.id,
+        }).result(timeout=5)
+        self.assertFalse(Vote.objects.exists())
+        
+        self.assertEqual(recover_votes(self.blockchain), 1)
+        vote = Vote.objects.get(voter=self.voter, election=self.election)
+        self.assertEqual(vote.blockchain_hash, self.blockchain.get_latest_block().hash)
+        self.assertEqual(recover_votes(self.blockchain, full=True), 0)
+
+
+class AuditChainTestCase(VotingFixturesMixin, TestCase):
+    """Test cases for the offline audit of exported chains"""
+    
+    def export(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'blockchain.ndjson')
+        with open(path, 'wb') as f:
+            f.write(b''.join(self.client.get(reverse('blockchain_export')).streaming_content))
+        return path
+    
+    def test_export_matches_votes(self):
+        """Test that a served chain verifies and agrees with the Vote table"""
+        self.client.post(reverse('vote', args=[self.election.id]), {'candidate_id': self.candidate.id})
+        self.blockchain.add_batch([{'voter_id': 90 + i, 'candidate_id': 7, 'timestamp': '0'} for i in range(3)])
+        path = self.export()
+        for workers in [1, 2]:
+            out = StringIO()
+            call_command('audit_chain', path, workers=workers, chunk_size=1, stdout=out)
+            self.assertIn('Verified 3 block(s) holding 4 vote(s)', out.getvalue())
+            self.assertIn('matches the Vote table', out.getvalue())
+    
+    def test_compressed_export(self):
+        """Test that a zlib-compressed export streams and audits like a plain one"""
+        self.client.post(reverse('vote', args=[self.election.id]), {'candidate_id': self.candidate.id})
+        response = self.client.get(reverse('blockchain_export'), {'compress': 'zlib'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="blockchain.ndjson.zz"')
+        lines = zlib.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['hash'] for line in lines],
+                         [block.hash for block in self.blockchain.chain])
+        self.assertEqual(self.client.get(reverse('blockchain_export'), {'compress': 'lzma'}).status_code, 400)
+        
+        path = self.export() + '.zz'
+        with open(path, 'wb') as f:
+            f.write(zlib.compress('\n'.join(lines).encode()))
+        out = StringIO()
+        call_command('audit_chain', path, workers=1, stdout=out)
+        self.assertIn('matches the Vote table', out.getvalue())
+    
+    def test_reports_first_divergence(self):
+        """Test that a tampered block and a missing Vote row are both reported"""
+        self.client.post(reverse('vote', args=[self.election.id]), {'candidate_id': self.candidate.id})
+        path = self.export()
+        Vote.objects.all().delete()
+        with self.assertRaisesMessage(CommandError, f'election {self.election.id}, candidate {self.candidate.id}: '
+                                                    'database 0, blockchain 1'):
+            call_command('audit_chain', path, workers=1, stdout=StringIO())
+        
+        with open(path) as f:
+            lines = f.readlines()
+        block = json.loads(lines[1])
+        block['data']['candidate_id'] += 1
+        lines[1] = json.dumps(block) + '\n'
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        with self.assertRaisesMessage(CommandError, 'Block 1 is invalid: hash does not match'):
+            call_command('audit_chain', path, workers=1, skip_database=True, stdout=StringIO())
+
+
+class AsyncViewsTestCase(VotingFixturesMixin, TestCase):
+    """Test cases for the ASGI vote, results and explorer views"""
+    
+    def make_request(self, method, url, data=None):
+        request = getattr(AsyncRequestFactory(), method)(url, data or {})
+        request.user = self.user
+        request.session = SessionStore()
+        request._messages = FallbackStorage(request)
+        return request
+    
+    async def test_chain_check_runs_off_the_event_loop(self):
+        """Test that the async vote page asks the chain about the voter from a worker thread"""
+        threads = []
+        verify_vote = self.blockchain.verify_vote
+        
+        def record_thread(*args):
+            threads.append(threading.current_thread())
+            return verify_vote(*args)
+        
+        with mock.patch.object(self.blockchain, 'verify_vote', side_effect=record_thread):
+            await async_views.vote(self.make_request('get', reverse('vote', args=[self.election.id])),
+                                   self.election.id)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+    
+    async def test_async_vote_and_results(self):
+        """Test that an async vote is sealed, recorded and reflected in results"""
+        url = reverse('vote', args=[self.election.id])
+        request = self.make_request('post', url, {'candidate_id': self.candidate.id})
+        response = await async_views.vote(request, self.election.id)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Vote.objects.filter(voter=self.voter).aexists())
+        self.assertEqual(self.blockchain.tally(self.election.id), {self.candidate.id: 1})
+        
+        request = self.make_request('get', reverse('results', args=[self.election.id]))
+        response = await async_views.results(request, self.election.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Alice', response.content)
+        
+        request = self.make_request('get', reverse('results', args=[self.election.id]))
+        request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+        response = await async_views.results(request, self.election.id)
+        self.assertEqual(response.status_code, 304)
+    
+    async def test_async_explorer(self):
+        """Test the async explorer page"""
+        response = await async_views.blockchain_view(self.make_request('get', reverse('blockchain')))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Chain Length', response.content)
+    
+    async def test_results_stream(self):
+        """Test that the results stream sends a snapshot, then a delta per vote block"""
+        broker = InProcessBroker()
+        request = self.make_request('get', f'/election/{self.election.id}/results/stream/')
+        with mock.patch('voting.events._broker', broker):
+            response = await async_views.results_stream(request, self.election.id)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = response.streaming_content
+            first = await stream.__anext__()
+            self.assertTrue(first.startswith(b'event: tally\n'))
+            self.assertEqual(json.loads(first.split(b'data: ')[1])['total'], 0)
+            
+            block = self.blockchain.add_block({'voter_id': self.voter.id, 'candidate_id': self.candidate.id,
+                                               'election_id': self.election.id})
+            publish_block(block, self.blockchain)
+            second = await asyncio.wait_for(stream.__anext__(), 5)
+            await stream.aclose()
+        self.assertTrue(second.startswith(b'event: delta\n'))
+        message = json.loads(second.split(b'data: ')[1])
+        self.assertEqual(message['block_hash'], block.hash)
+        self.assertEqual(message['delta'], {str(self.candidate.id): 1})
+        self.assertEqual(message['total'], 1)
+
+    async def test_results_stream_polls_the_writer(self):
+        """Test that in writer mode the stream picks up blocks sealed by another process"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        writer = Blockchain(FileBlockStore(directory))
+        self.addCleanup(writer.close)
+        with self.settings(BLOCKCHAIN_STORAGE_DIR=directory):
+            reader = open_chain_reader()
+        self.addCleanup(reader.close)
+        broker = InProcessBroker()
+        reader.add_listener(lambda block: publish_block(block, reader))
+        
+        request = self.make_request('get', f'/election/{self.election.id}/results/stream/')
+        with self.settings(BLOCKCHAIN_WRITER_ADDRESS='writer.sock'), \
+                blockchain_module.blockchain.substitute(reader), \
+                mock.patch('voting.async_views.SSE_POLL_SECONDS', 0.05), \
+                mock.patch('voting.events._broker', broker):
+            stream = (await async_views.results_stream(request, self.election.id)).streaming_content
+            await stream.__anext__()
+            block = writer.add_block({'voter_id': self.voter.id, 'candidate_id': self.candidate.id,
+                                      'election_id': self.election.id})
+            delta = await asyncio.wait_for(stream.__anext__(), 5)
+            await stream.aclose()
+        self.assertEqual(json.loads(delta.split(b'data: ')[1])['block_hash'], block.hash)
+    
+    def test_unwatched_elections_are_not_published(self):
+        """Test that a block for an election without subscribers never reads its tally"""
+        block = self.blockchain.add_block({'voter_id': self.voter.id, 'candidate_id': self.candidate.id,
+                                           'election_id': self.election.id})
+        with mock.patch('voting.events._broker', InProcessBroker()), \
+                mock.patch.object(self.blockchain, 'tally') as tally:
+            publish_block(block, self.blockchain)
+        tally.assert_not_called()
+    
+    def test_results_stream_needs_async_views(self):
+        """Test that the never-ending stream is not served to WSGI deployments"""
+        response = self.client.get(f'/election/{self.election.id}/results/stream/')
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkCommandsTestCase(TestCase):
+    """Test cases for bulk voter registration and synthetic vote generation"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.roll = os.path.join(self.directory, 'roll.csv')
+        with open(self.roll, 'w') as f:
+            f.write('username,voter_id,password,email\n'
+                    'ann,V1,secret,ann@example.com\n'
+                    'ben,V2,,\n'
+                    'ann,V3,again,\n'
+                    ',V4,,\n')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_import_voters_is_idempotent(self):
+        """Test that voters are registered once however often the roll is imported"""
+        for _ in range(2):
+            call_command('import_voters', self.roll, batch_size=2, workers=1, stdout=StringIO())
+        self.assertEqual(sorted(Voter.objects.values_list('voter_id', flat=True)), ['V1', 'V2'])
+        ann = User.objects.get(username='ann')
+        self.assertTrue(ann.check_password('secret'))
+        self.assertEqual(ann.email, 'ann@example.com')
+        self.assertFalse(User.objects.get(username='ben').has_usable_password())
+    
+    def test_import_counts_only_inserted_voters(self):
+        """Test that a voter ID taken by another import mid-batch is counted as skipped"""
+        importer = VoterImport(workers=1)
+        hash_passwords = importer._hash
+        
+        def race(passwords):
+            Voter.objects.create(user=User.objects.create_user('rival'), voter_id='V2')
+            return hash_passwords(passwords)
+        
+        with mock.patch.object(importer, '_hash', side_effect=race), open(self.roll) as f:
+            importer.run(read_roll(f))
+        self.assertEqual((importer.created, importer.skipped), (1, 3))
+    
+    def test_generate_votes(self):
+        """Test that generated votes form a valid chain that can be extended"""
+        chain_dir = os.path.join(self.directory, 'chain')
+        options = {'batch_size': 4, 'elections': 2, 'difficulty': 1, 'stdout': StringIO()}
+        call_command('generate_votes', chain_dir, count=10, **options)
+        call_command('generate_votes', chain_dir, count=5, **options)
+        
+        chain = Blockchain(FileBlockStore(chain_dir))
+        chain.difficulty = 1
+        self.assertEqual(len(chain.chain), 1 + 3 + 2)
+        self.assertEqual(chain.get_total_votes(1) + chain.get_total_votes(2), 15)
+        self.assertTrue(chain.verify_vote(15, 1))
+        self.assertTrue(chain.is_chain_valid(full=True))
+        chain.close()
+    
+    def test_bench_writes_json(self):
+        """Test that the benchmark command writes a machine-readable report"""
+        output = os.path.join(self.directory, 'bench.json')
+        call_command('bench', suite=['hash', 'pow', 'chain'], sizes='20', candidates='2,5',
+                     difficulties='1', store='memory', repeat=2, output=output,
+                     stdout=StringIO(), stderr=StringIO())
+        with open(output) as f:
+            report = json.load(f)
+        names = [result['name'] for result in report['results']]
+        self.assertEqual(names.count('is_chain_valid_full'), 2)
+        self.assertIn('calculate_hash', names)
+        self.assertIn({'difficulty': 1}, [result['params'] for result in report['results']])
+        self.assertTrue(all(result['median'] >= 0 for result in report['results']))
+
+
+class MetricsTestCase(VotingFixturesMixin, TestCase):
+    """Test cases for hot-path instrumentation and the /metrics endpoint"""
+    
+    def test_histogram_and_counter_exposition(self):
+        """Test the Prometheus text rendering of labelled metrics"""
+        registry = Registry()
+        requests = registry.register(Counter('demo_requests', 'Requests', ['view']))
+        latency = registry.register(Histogram('demo_seconds', 'Latency', buckets=[0.1, 1]))
+        requests.labels('home').inc()
+        requests.labels('home').inc(2)
+        latency.observe(0.05)
+        latency.observe(5)
+        text = registry.render()
+        self.assertIn('# TYPE demo_requests counter', text)
+        self.assertIn('demo_requests_total{view="home"} 3', text)
+        self.assertIn('demo_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('demo_seconds_count 2', text)
+    
+    def test_metrics_endpoint_reports_votes_and_requests(self):
+        """Test that a vote shows up in block, mining and request metrics"""
+        before = metrics.POW_SECONDS.counts[:]
+        self.client.post(reverse('vote', args=[self.election.id]), {'candidate_id': self.candidate.id})
+        self.assertEqual(sum(metrics.POW_SECONDS.counts), sum(before) + 1)
+        
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('voting_proof_of_work_attempts_bucket', text)
+        self.assertIn('voting_http_requests_total{view="vote",method="POST",status="302"}', text)
+        self.assertIn('voting_http_request_queries_count{view="vote"}', text)
+    
+    def test_metrics_endpoint_is_restricted(self):
+        """Test that /metrics is refused to unlisted addresses unless signed in as staff"""
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9').status_code, 403)
+        
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9').status_code, 200)
+    
+    async def test_async_request_queries_are_counted(self):
+        """Test that queries run through sync_to_async count towards the async request"""
+        async def view(request):
+            await sync_to_async(list)(Election.objects.all())
+            return HttpResponse()
+        
+        request = AsyncRequestFactory().get('/')
+        request.resolver_match = None
+        before = metrics.REQUEST_QUERIES.labels('<unresolved>').sum
+        await MetricsMiddleware(view)(request)
+        self.assertEqual(metrics.REQUEST_QUERIES.labels('<unresolved>').sum, before + 1)
@@ -1,12 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, metrics, views
+
+# The vote, results and explorer pages can be served by their async versions
+if getattr(settings, 'VOTING_ASYNC_VIEWS', False):
+    hot_views = async_views
+else:
+    hot_views = views
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('elections/', views.election_list, name='election_list'),
     path('election/<int:election_id>/', views.election_detail, name='election_detail'),
-    path('election/<int:election_id>/vote/', views.vote, name='vote'),
+    path('election/<int:election_id>/vote/', hot_views.vote, name='vote'),
     path('vote/<int:vote_id>/confirmation/', views.vote_confirmation, name='vote_confirmation'),
-    path('election/<int:election_id>/results/', views.results, name='results'),
-    path('blockchain/', views.blockchain_view, name='blockchain'),
+    path('election/<int:election_id>/results/', hot_views.results, name='results'),
+    path('blockchain/', hot_views.blockchain_view, name='blockchain'),
+    path('blockchain/api/blocks/', views.blockchain_api, name='blockchain_api'),
+    path('blockchain/export/', views.blockchain_export, name='blockchain_export'),
 ]
+
+# Server-Sent Events hold their connection open indefinitely, which only an
+# ASGI server can do cheaply; under WSGI each subscriber would pin a worker
+if getattr(settings, 'VOTING_ASYNC_VIEWS', False):
+    urlpatterns.append(path('election/<int:election_id>/results/stream/', async_views.results_stream,
+                            name='results_stream'))
+
+if metrics.ENABLED:
+    urlpatterns.append(path('metrics', views.metrics, name='metrics'))
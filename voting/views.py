@@ -1,10 +1,21 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.utils import timezone
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
 from .models import Election, Candidate, Voter, Vote
+from .batching import DuplicateVoteError
 from .blockchain import blockchain
+from .cache import (get_activity, get_results, get_tally, results_etag, results_last_modified,
+                    results_version)
+from .codec import COMPRESSION_FLAGS, compress_stream
+from .metrics import registry
+from .pipeline import record_vote
+from .writer import WriterUnavailableError
 
 
 def home(request):
@@ -30,9 +41,10 @@ def election_detail(request, election_id):
     election = get_object_or_404(Election, id=election_id)
     candidates = election.candidates.all()
     
-    # Get vote counts from blockchain
+    # Get vote counts from the cached blockchain tally
+    tally = get_tally(election.id)
     for candidate in candidates:
-        candidate.vote_count = candidate.get_vote_count()
+        candidate.vote_count = tally.get(candidate.id, 0)
     
     context = {
         'election': election,
@@ -60,7 +72,8 @@ def vote(request, election_id):
         return redirect('election_detail', election_id=election_id)
     
     # Check if already voted
-    if Vote.objects.filter(voter=voter, election=election).exists():
+    if (voter.has_voted_in_blockchain(election)
+            or Vote.objects.filter(voter=voter, election=election).exists()):
         messages.error(request, 'You have already voted in this election.')
         return redirect('election_detail', election_id=election_id)
     
@@ -72,27 +85,15 @@ def vote(request, election_id):
         
         candidate = get_object_or_404(Candidate, id=candidate_id, election=election)
         
-        # Add vote to blockchain
-        vote_data = {
-            'voter_id': voter.id,
-            'candidate_id': candidate.id,
-            'election_id': election.id,
-            'timestamp': str(timezone.now())
-        }
-        
-        block = blockchain.add_block(vote_data)
-        
-        # Save vote record in database
-        vote_record = Vote.objects.create(
-            voter=voter,
-            candidate=candidate,
-            election=election,
-            blockchain_hash=block.hash
-        )
-        
-        # Mark voter as voted
-        voter.has_voted = True
-        voter.save()
+        # Seal the vote on the blockchain and record it in the database
+        try:
+            vote_record = record_vote(voter, candidate, election)
+        except DuplicateVoteError:
+            messages.error(request, 'You have already voted in this election.')
+            return redirect('election_detail', election_id=election_id)
+        except WriterUnavailableError:
+            messages.error(request, 'Your vote could not be recorded right now. Please try again in a moment.')
+            return redirect('vote', election_id=election_id)
         
         messages.success(request, f'Your vote for {candidate.name} has been recorded successfully!')
         return redirect('vote_confirmation', vote_id=vote_record.id)
@@ -121,48 +122,143 @@ def vote_confirmation(request, vote_id):
     return render(request, 'voting/vote_confirmation.html', context)
 
 
+EXPLORER_PAGE_SIZE = 50
+EXPLORER_MAX_PAGE_SIZE = 500
+
+
+def block_page(chain, request, default_size=EXPLORER_PAGE_SIZE):
+    """Read one page of blocks using the ?after= cursor and ?limit= page size"""
+    try:
+        after = int(request.GET.get('after', -1))
+        limit = int(request.GET.get('limit', default_size))
+    except ValueError:
+        after, limit = -1, default_size
+    limit = max(1, min(limit, EXPLORER_MAX_PAGE_SIZE))
+    start = max(after + 1, 0)
+    blocks = [block.to_dict() for block in chain.iter_blocks(start, start + limit)]
+    chain_length = len(chain.chain)
+    next_cursor = blocks[-1]['index'] if blocks and blocks[-1]['index'] < chain_length - 1 else None
+    previous_cursor = max(start - limit, 0) - 1 if start > 0 else None
+    return blocks, next_cursor, previous_cursor, chain_length
+
+
+def selected_chain(request):
+    """
+    ``(shard, chain)`` for the chain ``?election=`` picks.
+
+    With a sharded ledger that is the election's shard, or the base chain
+    (shard None) without the parameter; an unsharded chain holds every
+    election, so the parameter makes no difference.
+    """
+    election_id = request.GET.get('election')
+    open_shard = getattr(blockchain, 'shard', None)
+    if not election_id or open_shard is None:
+        return None, blockchain
+    try:
+        shard = int(election_id)
+    except ValueError:
+        raise Http404('election must be an election id')
+    chain = open_shard(shard, create=False)
+    if chain is None:
+        raise Http404(f'No chain holds election {shard}')
+    return shard, chain
+
+
+def ledger_chains():
+    """``(shard, chain)`` for the base chain, shard None, then every election's shard"""
+    shards = getattr(blockchain, 'shards', None)
+    if shards is None:
+        return [(None, blockchain)]
+    return [(None, blockchain.base), *sorted(shards().items())]
+
+
 def blockchain_view(request):
-    """View the blockchain"""
-    chain = blockchain.get_chain()
-    is_valid = blockchain.is_chain_valid()
+    """View one page of the blockchain, or of one election's shard with ?election="""
+    shard, chain = selected_chain(request)
+    blocks, next_cursor, previous_cursor, chain_length = block_page(chain, request)
+    is_valid = chain.is_chain_valid()
     
     context = {
-        'chain': chain,
+        'shard': shard,
+        'chain': blocks,
         'is_valid': is_valid,
-        'chain_length': len(chain),
+        'chain_length': chain_length,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
     }
     return render(request, 'voting/blockchain.html', context)
 
 
+def blockchain_api(request):
+    """Return one page of blocks as JSON, with the cursor for the next page"""
+    shard, chain = selected_chain(request)
+    blocks, next_cursor, _, chain_length = block_page(chain, request)
+    return JsonResponse({
+        'shard': shard,
+        'blocks': blocks,
+        'next': next_cursor,
+        'chain_length': chain_length,
+    })
+
+
+EXPORT_SUFFIXES = {'zlib': '.zz', 'zstd': '.zst'}
+
+
+def blockchain_export(request):
+    """
+    Stream the blockchain as newline-delimited JSON, compressed with ?compress=zlib or zstd.
+
+    Every line carries the ``shard`` its block belongs to: None for the
+    base chain, which comes first, then each election's shard in turn.
+    ?election= exports one election's shard alone.
+    """
+    method = request.GET.get('compress') or None
+    if method not in COMPRESSION_FLAGS:
+        return HttpResponse('compress must be zlib or zstd', status=400)
+    chains = [selected_chain(request)] if request.GET.get('election') else ledger_chains()
+    # Stop at the tips as of the request so the export is a consistent prefix of each chain
+    sections = [(shard, chain, len(chain.chain)) for shard, chain in chains]
+    lines = (json.dumps(dict(block.to_dict(), shard=shard), sort_keys=True) + '\n'
+             for shard, chain, stop in sections
+             for block in chain.iter_blocks(0, stop))
+    if method is None:
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="blockchain.ndjson"'
+        return response
+    try:
+        chunks = compress_stream((line.encode() for line in lines), method)
+    except ImportError as error:
+        return HttpResponse(str(error), status=400)
+    response = StreamingHttpResponse(chunks, content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="blockchain.ndjson{EXPORT_SUFFIXES[method]}"'
+    return response
+
+
+@condition(etag_func=results_etag, last_modified_func=results_last_modified)
 def results(request, election_id):
     """Show election results"""
     election = get_object_or_404(Election, id=election_id)
-    candidates = election.candidates.all()
-    
-    # Get vote counts from blockchain
-    results_data = []
-    total_votes = 0
-    for candidate in candidates:
-        vote_count = candidate.get_vote_count()
-        total_votes += vote_count
-        results_data.append({
-            'candidate': candidate,
-            'votes': vote_count,
-        })
     
-    # Calculate percentages
-    for result in results_data:
-        if total_votes > 0:
-            result['percentage'] = (result['votes'] / total_votes) * 100
-        else:
-            result['percentage'] = 0
-    
-    # Sort by votes (descending)
-    results_data.sort(key=lambda x: x['votes'], reverse=True)
+    # Tallies and ranked rows are cached until the election's results change;
+    # the version was already read for the ETag and is reused for every entry
+    version = results_version(election.id, request)
+    results_data, total_votes = get_results(election, version)
     
     context = {
         'election': election,
         'results': results_data,
         'total_votes': total_votes,
+        'results_version': version,
+        'cache_alias': getattr(settings, 'RESULTS_CACHE_ALIAS', 'default'),
+        'cache_timeout': getattr(settings, 'RESULTS_CACHE_TIMEOUT', None),
+        'activity': get_activity(election, blockchain, version),
     }
     return render(request, 'voting/results.html', context)
+
+
+def metrics(request):
+    """Expose this process's metrics in the Prometheus text format"""
+    allowed = getattr(settings, 'VOTING_METRICS_ALLOWED_IPS', ())
+    if request.META.get('REMOTE_ADDR') not in allowed and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
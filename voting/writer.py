@@ -0,0 +1,192 @@
+"""
+Chain writer process: one process appends, every worker reads
+
+With BLOCKCHAIN_WRITER_ADDRESS set, web workers open the chain's storage
+directory read-only and forward ballots to the writer process started by
+``manage.py chain_writer``. The writer owns the only VoteBatcher, so
+appends stay single-writer across the whole deployment. Workers pick up
+sealed blocks through the store's shared tip counter; reads never talk
+to the writer.
+
+A worker that loses its connection resends the ballot once. If the
+writer had sealed it before going down, the resend comes back as a
+duplicate, and the worker finds the ballot on its read-only chain and
+returns its receipt. A writer that cannot be reached raises
+WriterUnavailableError, which callers treat as "try again".
+"""
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, Optional
+
+from .batching import DuplicateVoteError
+from .blockchain import iter_votes
+from .merkle import merkle_proof
+
+logger = logging.getLogger(__name__)
+
+
+class ChainWriterServer:
+    """Accepts ballots from worker processes and seals them with a VoteBatcher"""
+
+    def __init__(self, batcher, address, authkey: bytes):
+        self.batcher = batcher
+        self.address = address
+        self.authkey = authkey
+        self._listener = None
+
+    def serve_forever(self):
+        """Accept connections until close(); each is served by its own thread"""
+        self._remove_stale_socket()
+        self._listener = Listener(self.address, authkey=self.authkey)
+        logger.info('Chain writer listening on %s', self._listener.address)
+        while True:
+            try:
+                connection = self._listener.accept()
+            except (OSError, AuthenticationError):
+                if self._listener is None:
+                    return
+                # A client that fails authentication should not stop the writer
+                logger.exception('Rejected a chain writer connection')
+                continue
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _remove_stale_socket(self):
+        """Delete a Unix socket left behind by a writer that did not shut down cleanly"""
+        if not isinstance(self.address, str) or not os.path.exists(self.address):
+            return
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except ConnectionRefusedError:
+            os.unlink(self.address)
+        except (OSError, AuthenticationError):
+            return
+        else:
+            raise RuntimeError(f'another chain writer is serving {self.address}')
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    vote = connection.recv()
+                except (EOFError, OSError):
+                    return
+                connection.send(self._handle(vote))
+
+    def _handle(self, vote: Dict[str, Any]):
+        try:
+            return 'ok', self.batcher.submit(vote).result()
+        except DuplicateVoteError as error:
+            return 'duplicate', str(error)
+        except Exception as error:
+            logger.exception('Failed to seal ballot %s', vote)
+            return 'error', repr(error)
+
+    def close(self):
+        """Stop accepting connections"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+
+
+class ChainWriterError(Exception):
+    """Raised when the writer process fails to seal a ballot"""
+
+
+class WriterUnavailableError(ChainWriterError):
+    """Raised when the writer process cannot be reached; the ballot may be resubmitted"""
+
+
+def sealed_receipt(chain, vote: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The receipt of a ballot already on the chain, searching back from the tip, or None"""
+    for index in range(len(chain.chain) - 1, 0, -1):
+        block = chain.chain[index]
+        votes = list(iter_votes(block))
+        if vote not in votes:
+            continue
+        receipt = {'block_index': block.index, 'block_hash': block.hash}
+        if 'votes' in block.data:
+            leaf_index = votes.index(vote)
+            receipt.update(merkle_root=block.data['merkle_root'], leaf_index=leaf_index,
+                           proof=merkle_proof(votes, leaf_index))
+        return receipt
+    return None
+
+
+class RemoteBatcher:
+    """
+    Stands in for a VoteBatcher in processes that do not own the chain.
+
+    submit() returns a future like VoteBatcher.submit(); the round trip to
+    the writer runs on a small thread pool, each thread keeping its own
+    connection. The receipt only resolves once the writer has published
+    the block, so a refresh of the local read-only chain will find it.
+    ``chain`` is that read-only chain, searched for a resent ballot the
+    writer reports as a duplicate.
+    """
+
+    def __init__(self, address, authkey: bytes, connections: int = 8, chain=None):
+        self.address = address
+        self.authkey = authkey
+        self.chain = chain
+        self._executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='chain-writer')
+        self._local = threading.local()
+
+    def submit(self, vote: Dict[str, Any]) -> Future:
+        """Send a vote to the writer; the returned future resolves to its receipt"""
+        return self._executor.submit(self._call, vote)
+
+    def _call(self, vote: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            status, result = self._send(vote)
+        except (EOFError, OSError):
+            # The writer restarted; resend once
+            try:
+                status, result = self._send(vote)
+            except (EOFError, OSError) as error:
+                raise WriterUnavailableError(f'the chain writer at {self.address} is unavailable: {error}') from error
+            if status == 'duplicate':
+                # It may have sealed this very ballot before the connection dropped
+                receipt = self._find_sealed(vote)
+                if receipt is not None:
+                    return receipt
+
+        if status == 'duplicate':
+            raise DuplicateVoteError(result)
+        if status != 'ok':
+            raise ChainWriterError(result)
+        return result
+
+    def _send(self, vote: Dict[str, Any]):
+        """One round trip on this thread's connection, reconnecting if it was lost"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send(vote)
+            return connection.recv()
+        except (EOFError, OSError):
+            self._local.connection = None
+            connection.close()
+            raise
+
+    def _find_sealed(self, vote: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.chain is None:
+            return None
+        self.chain.refresh()
+        chains_for = getattr(self.chain, 'chains_for', None)
+        for chain in chains_for(vote.get('election_id')) if chains_for else [self.chain]:
+            receipt = sealed_receipt(chain, vote)
+            if receipt is not None:
+                return receipt
+        return None
+
+    def flush(self):
+        """Nothing is queued locally; the writer seals pending ballots"""
+
+    def close(self):
+        """Stop sending ballots"""
+        self._executor.shutdown(wait=False)